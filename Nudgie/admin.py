@@ -1,9 +1,43 @@
 from django.contrib import admin
+from django.utils.html import format_html
 
-from .models import CachedApiResponse, Conversation, Goal, MockedTime, NudgieTask
+from .chat.archive import format_transcript, get_goal_transcript
+from .models import (
+    CachedApiResponse,
+    Conversation,
+    ConversationArchiveManifest,
+    Goal,
+    LlmCallRecord,
+    MockedTime,
+    NudgieTask,
+    ScheduledEvent,
+)
 
 admin.site.register(Conversation)
 admin.site.register(NudgieTask)
 admin.site.register(MockedTime)
 admin.site.register(CachedApiResponse)
 admin.site.register(Goal)
+admin.site.register(LlmCallRecord)
+admin.site.register(ScheduledEvent)
+
+
+@admin.register(ConversationArchiveManifest)
+class ConversationArchiveManifestAdmin(admin.ModelAdmin):
+    list_display = [
+        "goal_name",
+        "user",
+        "line_count",
+        "raw_bytes",
+        "compressed_bytes",
+        "created_at",
+        "completed_at",
+    ]
+    exclude = ["goal"]
+    readonly_fields = ["transcript"]
+
+    def transcript(self, manifest: ConversationArchiveManifest) -> str:
+        """Archived transcripts are decompressed on demand, so only on the detail page."""
+        return format_html(
+            "<pre>{}</pre>", format_transcript(get_goal_transcript(manifest))
+        )
@@ -0,0 +1,207 @@
+"""
+Archives the transcripts of finished goals. When a goal ends, a manifest is opened for the lines the
+user exchanged with Nudgie since the previous goal's transcript. A background job then moves those
+lines out of the Conversation table in batches: each batch is compressed into a chunk, and the lines
+are deleted in the same transaction. The manifest's cursor (archived_through_id) records how far the
+job has got, so an interrupted run simply carries on from there.
+
+Only lines which have already been folded into the user's rolling summary are archived, so the context
+sent to OpenAI is the same whether a line is archived or not. The rest of the transcript stays in the
+Conversation table until the summary catches up with it.
+"""
+
+import json
+import zlib
+from typing import NamedTuple, Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from Nudgie.chat.dialogue import get_last_line_id
+from Nudgie.constants import (
+    ARCHIVE_BATCH_LINES,
+    ARCHIVE_MAX_BATCHES_PER_RUN,
+    DIALOGUE_TYPE_SYSTEM_MESSAGE,
+)
+from Nudgie.models import (
+    Conversation,
+    ConversationArchiveChunk,
+    ConversationArchiveManifest,
+    ConversationSummary,
+    Goal,
+)
+
+ARCHIVED_LINE_FIELDS = ["id", "message_type", "dialogue_type", "content", "timestamp"]
+
+
+class ArchivedLine(NamedTuple):
+    id: int
+    message_type: str
+    dialogue_type: str
+    content: Optional[str]
+    timestamp: str  # isoformat
+
+
+def open_archive_manifest(goal: Goal) -> ConversationArchiveManifest:
+    """
+    Opens the manifest for a finished goal's transcript: the lines after the previous manifest's
+    through the user's latest line. Opening it again for the same goal returns the existing one.
+    """
+    previous = (
+        ConversationArchiveManifest.objects.filter(user_id=goal.user_id)
+        .order_by("-through_line_id")
+        .first()
+    )
+    from_line_id = previous.through_line_id if previous else 0
+
+    manifest, _ = ConversationArchiveManifest.objects.get_or_create(
+        goal=goal,
+        defaults={
+            "user_id": goal.user_id,
+            "goal_name": goal.goal_name,
+            "from_line_id": from_line_id,
+            "through_line_id": max(from_line_id, get_last_line_id(goal.user_id)),
+            "archived_through_id": from_line_id,
+        },
+    )
+    return manifest
+
+
+def compress_lines(lines: list[dict]) -> tuple[bytes, int]:
+    """Returns the lines as zlib-compressed JSON lines, along with their uncompressed size."""
+    raw = "\n".join(
+        json.dumps({**line, "timestamp": line["timestamp"].isoformat()})
+        for line in lines
+    ).encode()
+    return zlib.compress(raw), len(raw)
+
+
+def read_chunk(chunk: ConversationArchiveChunk) -> list[ArchivedLine]:
+    raw = zlib.decompress(chunk.data).decode()
+    return [ArchivedLine(**json.loads(line)) for line in raw.splitlines()]
+
+
+def archive_next_batch(manifest_id: int) -> int:
+    """
+    Moves the next batch of the manifest's lines into a chunk. Returns how many lines were archived.
+    The manifest is completed once none of its lines are left in the Conversation table.
+    """
+    with transaction.atomic():
+        manifest = ConversationArchiveManifest.objects.select_for_update().get(
+            id=manifest_id
+        )
+        if manifest.completed_at is not None:
+            return 0
+
+        summarized_through_id = (
+            ConversationSummary.objects.filter(user_id=manifest.user_id)
+            .values_list("summarized_through_id", flat=True)
+            .first()
+            or 0
+        )
+        archivable_through_id = min(manifest.through_line_id, summarized_through_id)
+        lines = list(
+            Conversation.objects.filter(
+                user_id=manifest.user_id,
+                id__gt=manifest.archived_through_id,
+                id__lte=archivable_through_id,
+            )
+            .order_by("id")
+            .values(*ARCHIVED_LINE_FIELDS)[:ARCHIVE_BATCH_LINES]
+        )
+
+        if lines:
+            data, raw_bytes = compress_lines(lines)
+            ConversationArchiveChunk.objects.create(
+                manifest=manifest,
+                first_line_id=lines[0]["id"],
+                last_line_id=lines[-1]["id"],
+                line_count=len(lines),
+                data=data,
+            )
+            Conversation.objects.filter(id__in=[line["id"] for line in lines]).delete()
+
+            manifest.archived_through_id = lines[-1]["id"]
+            manifest.line_count += len(lines)
+            manifest.raw_bytes += raw_bytes
+            manifest.compressed_bytes += len(data)
+
+        if archivable_through_id == manifest.through_line_id and (
+            len(lines) < ARCHIVE_BATCH_LINES
+        ):
+            manifest.archived_through_id = manifest.through_line_id
+            manifest.completed_at = timezone.now()
+
+        manifest.save()
+
+    return len(lines)
+
+
+def archive_conversations(max_batches: int = ARCHIVE_MAX_BATCHES_PER_RUN) -> int:
+    """
+    Works through the open manifests, oldest first, archiving at most max_batches batches. Returns
+    how many lines were archived.
+    """
+    open_manifest_ids = (
+        ConversationArchiveManifest.objects.filter(completed_at__isnull=True)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+
+    archived = 0
+    batches = 0
+    for manifest_id in list(open_manifest_ids):
+        while batches < max_batches:
+            batches += 1
+            count = archive_next_batch(manifest_id)
+            archived += count
+            if count < ARCHIVE_BATCH_LINES:
+                break
+
+    return archived
+
+
+def get_archived_lines(manifest: ConversationArchiveManifest) -> list[ArchivedLine]:
+    """Decompresses the lines which have been archived so far, oldest first."""
+    return [
+        line
+        for chunk in manifest.chunks.order_by("first_line_id")
+        for line in read_chunk(chunk)
+    ]
+
+
+def get_goal_transcript(
+    manifest: ConversationArchiveManifest, include_internal: bool = False
+) -> list[ArchivedLine]:
+    """
+    The goal's full transcript: the archived lines followed by the ones which are still waiting to
+    be archived. Internal lines (system messages) are left out unless include_internal is set.
+    """
+    live_lines = (
+        Conversation.objects.filter(
+            user_id=manifest.user_id,
+            id__gt=manifest.archived_through_id,
+            id__lte=manifest.through_line_id,
+        )
+        .order_by("id")
+        .values(*ARCHIVED_LINE_FIELDS)
+    )
+    lines = [
+        *get_archived_lines(manifest),
+        *(
+            ArchivedLine(**{**line, "timestamp": line["timestamp"].isoformat()})
+            for line in live_lines
+        ),
+    ]
+
+    if include_internal:
+        return lines
+    return [
+        line for line in lines if line.dialogue_type != DIALOGUE_TYPE_SYSTEM_MESSAGE
+    ]
+
+
+def format_transcript(lines: list[ArchivedLine]) -> str:
+    return "\n".join(
+        f"[{line.timestamp}] {line.message_type}: {line.content}" for line in lines
+    )
@@ -0,0 +1,141 @@
+"""
+Cache-key normalization for OpenAI requests. Some prompt fragments (e.g. the current time and the
+time remaining on a goal) change on every request, which would otherwise make every cache key unique.
+Before a request is hashed, its message contents are run through the normalizers registered for the
+dialogue type's cache policy. Only the key is normalized - the request sent to OpenAI is untouched.
+"""
+
+import copy
+import json
+import re
+from datetime import datetime
+from typing import Callable, Optional
+
+from django.conf import settings
+
+from Nudgie.chat.response_cache import get_request_hash
+from Nudgie.constants import (
+    CACHE_KEY_DEFAULT_POLICY,
+    CACHE_KEY_POLICIES,
+    CACHE_POLICY_EXACT,
+    CACHE_POLICY_MINUTE,
+    CACHE_POLICY_NEVER,
+    CACHE_POLICY_STRIP,
+    CHATGPT_CONTENT_KEY,
+    OPENAI_MESSAGE_FIELD,
+)
+
+# Volatile fragments of TIME_REMAINING_FRAGMENT (see Nudgie/config/chatgpt_inputs.py).
+CURRENT_TIME_PATTERN = re.compile(r"(The current time is )(\S+?)(\.\s)")
+TIME_REMAINING_PATTERN = re.compile(
+    r"(exactly )(\d+) days, (\d+) hours, (\d+) minutes, and (\d+) seconds( remaining)"
+)
+VOLATILE_PLACEHOLDER = "<volatile>"
+
+
+def truncate_current_time_to_minute(content: str) -> str:
+    """Truncates the current time in the time remaining fragment to minute granularity."""
+
+    def truncate(match):
+        try:
+            current_time = datetime.fromisoformat(match.group(2))
+        except ValueError:
+            return match.group(0)
+        truncated = current_time.replace(second=0, microsecond=0).isoformat()
+        return f"{match.group(1)}{truncated}{match.group(3)}"
+
+    return CURRENT_TIME_PATTERN.sub(truncate, content)
+
+
+def drop_seconds_remaining(content: str) -> str:
+    """Drops the seconds from the time remaining fragment."""
+    return TIME_REMAINING_PATTERN.sub(
+        lambda match: (
+            f"{match.group(1)}{match.group(2)} days, {match.group(3)} hours, "
+            f"{match.group(4)} minutes, and 0 seconds{match.group(6)}"
+        ),
+        content,
+    )
+
+
+def strip_current_time(content: str) -> str:
+    """Replaces the current time in the time remaining fragment with a placeholder."""
+    return CURRENT_TIME_PATTERN.sub(
+        lambda match: f"{match.group(1)}{VOLATILE_PLACEHOLDER}{match.group(3)}",
+        content,
+    )
+
+
+def strip_time_remaining(content: str) -> str:
+    """Replaces the time remaining in the time remaining fragment with a placeholder."""
+    return TIME_REMAINING_PATTERN.sub(
+        lambda match: f"{match.group(1)}{VOLATILE_PLACEHOLDER}{match.group(6)}",
+        content,
+    )
+
+
+# Maps each cache policy to the normalizers that are applied to every message's content. The
+# NEVER policy has no entry, since requests under it are not cached at all.
+_policy_normalizers: dict[str, list[Callable[[str], str]]] = {
+    CACHE_POLICY_EXACT: [],
+    CACHE_POLICY_MINUTE: [truncate_current_time_to_minute, drop_seconds_remaining],
+    CACHE_POLICY_STRIP: [strip_current_time, strip_time_remaining],
+}
+
+
+def register_cache_key_policy(
+    policy: str, normalizers: list[Callable[[str], str]]
+) -> None:
+    """Registers (or replaces) the normalizers used for a cache policy."""
+    _policy_normalizers[policy] = list(normalizers)
+
+
+def get_cache_policy(dialogue_type: Optional[str]) -> str:
+    """Returns the cache policy for a dialogue type, with overrides from settings."""
+    policies = {**CACHE_KEY_POLICIES, **settings.CACHE_KEY_POLICY_OVERRIDES}
+    return policies.get(dialogue_type, CACHE_KEY_DEFAULT_POLICY)
+
+
+def normalize_request(args: dict, policy: str) -> dict:
+    """Returns a copy of the request args with the policy's normalizers applied."""
+    normalizers = _policy_normalizers[policy]
+    if not normalizers:
+        return args
+
+    normalized_args = copy.deepcopy(args)
+    for message in normalized_args[OPENAI_MESSAGE_FIELD]:
+        content = message.get(CHATGPT_CONTENT_KEY)
+        if not content:
+            continue
+        for normalizer in normalizers:
+            content = normalizer(content)
+        message[CHATGPT_CONTENT_KEY] = content
+
+    return normalized_args
+
+
+def get_cache_key(args: dict, dialogue_type: Optional[str]) -> Optional[str]:
+    """
+    Returns the cache key for a request, or None if requests of this dialogue type must not be
+    cached.
+    """
+    policy = get_cache_policy(dialogue_type)
+    if policy == CACHE_POLICY_NEVER:
+        return None
+
+    return get_request_hash(normalize_request(args, policy))
+
+
+def record_request(args: dict, dialogue_type: Optional[str]) -> None:
+    """
+    Appends the request to the workload recording, if one is configured. The recording is the
+    input for the cache_key_report management command.
+    """
+    record_path = settings.OPENAI_WORKLOAD_RECORD_PATH
+    if not record_path:
+        return
+
+    with open(record_path, "a", encoding="utf-8") as record_file:
+        record_file.write(
+            json.dumps({"dialogue_type": dialogue_type, "args": args}) + "\n"
+        )
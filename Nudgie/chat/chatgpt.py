@@ -1,22 +1,56 @@
 import json
 import logging
+import time
 from types import SimpleNamespace
-from typing import Optional
+from typing import Generator, Iterator, NamedTuple, Optional
 
+import httpx
 import openai
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.exceptions import ObjectDoesNotExist
-from django.core.serializers import serialize
-from django.db.models import Min
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from httpx import get
 
-from Nudgie.chat.dialogue import load_conversation, save_line_of_speech
+from Nudgie.chat.cache_keys import get_cache_key, record_request
+from Nudgie.chat.context import (
+    ConversationContext,
+    build_conversation_context,
+    count_message_tokens,
+    estimate_tokens,
+    get_lines_pending_summary,
+    get_summary,
+)
+from Nudgie.chat.dialogue import (
+    asave_line_of_speech,
+    conversation_turn,
+    save_line_of_speech,
+)
+from Nudgie.chat.instrumentation import (
+    CACHE_STATUS_MISS,
+    LlmCallRecorder,
+    llm_call_site,
+)
+from Nudgie.chat.model_routing import build_request_args
+from Nudgie.chat.rate_limit import aschedule_openai_call, schedule_openai_call
+from Nudgie.chat.response_cache import cache_response, get_cached_response
 from Nudgie.chat.system_prompt import (
     get_initial_system_prompt,
     get_standard_system_prompt,
 )
+from Nudgie.chat.task_matching import (
+    PATH_FUNCTION_CALL,
+    PATH_LLM,
+    PATH_LOCAL,
+    PATH_NO_TASKS,
+    PATH_SINGLE_TASK,
+    match_task_locally,
+    record_identification_path,
+)
 from Nudgie.config.chatgpt_inputs import (
     CLARIFICATION_PROMPT,
+    CONVERSATION_SUMMARY_PROMPT,
     DEADLINE_MISSED_PROMPT,
     GOAL_COMPLETION_FRAGMENT,
     GOAL_COMPLETION_PROMPT,
@@ -24,6 +58,7 @@ from Nudgie.config.chatgpt_inputs import (
     INITIAL_CONVO_SYSTEM_PROMPT,
     NUDGE_PROMPT,
     ONGOING_CONVO_FUNCTIONS,
+    PENDING_TASKS_FRAGMENT,
     REMINDER_PROMPT,
     STANDARD_SYSTEM_PROMPT,
     SUCCESSFUL_TASK_IDENTIFICATION_PROMPT,
@@ -31,7 +66,6 @@ from Nudgie.config.chatgpt_inputs import (
     TIME_REMAINING_FRAGMENT,
 )
 from Nudgie.constants import (
-    CHAT_GPT_MODEL,
     CHATGPT_ASSISTANT_ROLE,
     CHATGPT_COMPLETE_TASK_FUNCTION,
     CHATGPT_CONTENT_KEY,
@@ -47,42 +81,73 @@ from Nudgie.constants import (
     CHATGPT_SCHEDULES_KEY,
     CHATGPT_SYSTEM_ROLE,
     CHATGPT_USER_ROLE,
+    COMPLETE_TASK_REPLY_KEY,
+    CONTEXT_SUMMARY_CHECKPOINT,
     DIALOGUE_TYPE_AI_STANDARD,
     DIALOGUE_TYPE_DEADLINE,
     DIALOGUE_TYPE_GOAL_END,
+    DIALOGUE_TYPE_GOAL_SETUP,
     DIALOGUE_TYPE_NUDGE,
-    DIALOGUE_TYPE_REMINDER,
+    DIALOGUE_TYPE_SUMMARY,
     DIALOGUE_TYPE_SYSTEM_MESSAGE,
+    DIALOGUE_TYPE_TASK_IDENTIFICATION,
     DIALOGUE_TYPE_USER_INPUT,
     GOAL_NAME_AI_STRUCT_KEY,
     NUDGIE_TASK_DUE_DATE_FIELD,
     NUDGIE_TASK_TASK_NAME_FIELD,
+    OPENAI_ASYNC_MAX_CONNECTIONS,
+    OPENAI_COMPLETION_TOKENS_RESERVE,
     OPENAI_FUNCTIONS_FIELD,
+    OPENAI_MAX_TOKENS_FIELD,
     OPENAI_MESSAGE_FIELD,
-    OPENAI_MODEL_FIELD,
     PENDING_TASKS_KEY,
     REMINDER_DATA_AI_STRUCT_KEY,
+    TASK_COMPLETION_MODE_SINGLE_CALL,
     TASK_IDENTIFICATION_CERTAINTY_SCORE,
     TASK_IDENTIFICATION_NUDGIE_TASK_ID,
     TASK_IDENTIFICATION_REASONING,
     TASK_NAME_AI_STRUCT_KEY,
 )
 from Nudgie.goals.goals import create_goal, get_current_goal
-from Nudgie.models import CachedApiResponse, Goal, NudgieTask, Task
+from Nudgie.models import Goal, NudgieTask, Task
 from Nudgie.scheduling.periodic_task_helper import TaskData
 from Nudgie.scheduling.scheduler import (
     schedule_goal_end,
     schedule_tasks_from_crontab_list,
 )
-from Nudgie.time_utils.time import (
-    date_to_crontab,
-    get_next_run_time_from_crontab,
-    get_time,
-)
+from Nudgie.time_utils.time import get_time
 
 # __name__ is the name of the current module, automatically set by Python.
 logger = logging.getLogger(__name__)
-client = openai.OpenAI()
+client = None
+async_client = None
+
+
+def configure_openai_clients(
+    base_url: Optional[str] = None, api_key: Optional[str] = None
+) -> None:
+    """
+    (Re)creates the OpenAI clients. base_url defaults to the OPENAI_BASE_URL setting, which can point
+    at a local stand-in for the API (see Nudgie/llm_stub/server.py).
+    """
+    global client, async_client
+
+    base_url = base_url or settings.OPENAI_BASE_URL
+    # retries are handled by schedule_openai_call, so that they're coordinated with the rate limits
+    client = openai.OpenAI(base_url=base_url, api_key=api_key, max_retries=0)
+    # The async client's connection pool has to be large enough for every in-flight request,
+    # otherwise concurrent requests queue up waiting for a connection (openai's default limit is 100).
+    async_client = openai.AsyncOpenAI(
+        base_url=base_url,
+        api_key=api_key,
+        max_retries=0,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=OPENAI_ASYNC_MAX_CONNECTIONS)
+        ),
+    )
+
+
+configure_openai_clients()
 
 
 def has_function_call(response) -> bool:
@@ -187,26 +252,30 @@ def handle_goal_creation(user: User, goal_name: str, goal_length_days: int) -> N
     goal = create_goal(
         user=user, goal_name=goal_name, goal_length_days=goal_length_days
     )
-    crontab = date_to_crontab(goal.goal_end_date)
-
     schedule_goal_end(
         TaskData(
-            crontab=crontab,
+            crontab=None,
             task_name="",  # special case. we only need the goal-related data.
             user_id=user.id,
             goal_name=goal_name,
             due_date=goal.goal_end_date.isoformat(),
-            next_run_time=get_next_run_time_from_crontab(crontab, user).isoformat(),
+            next_run_time=goal.goal_end_date.isoformat(),
             dialogue_type=DIALOGUE_TYPE_GOAL_END,
-        )
+        ),
+        goal,
     )
 
 
 def handle_chatgpt_function_call(
-    function_name: str, function_args: dict, user: User, messages: list
+    function_name: str,
+    function_args: dict,
+    user: User,
+    messages: list,
+    pending_tasks: Optional[list[NudgieTask]] = None,
 ):
     """
-    Handles a function call from the OpenAI API, returns the response.
+    Handles a function call from the OpenAI API, returns the response. pending_tasks are the ones
+    sent with the request, if any (see prepare_convo_request).
     """
     if function_name == CHATGPT_INITIAL_GOAL_SETUP:
         handle_goal_creation(
@@ -227,9 +296,19 @@ def handle_chatgpt_function_call(
         )
 
         # Generate a response to the user based on the function call.
-        return call_openai_api(messages)
+        return call_openai_api(messages, dialogue_type=DIALOGUE_TYPE_GOAL_SETUP)
 
     elif function_name == CHATGPT_COMPLETE_TASK_FUNCTION:
+        resolved_task = resolve_completed_task(function_args, pending_tasks)
+        if resolved_task is not None:
+            # the AI identified the task and wrote the reply in the same call
+            resolved_task.completed = True
+            resolved_task.save()
+            record_identification_path(PATH_FUNCTION_CALL)
+            return SimpleNamespace(
+                content=function_args[COMPLETE_TASK_REPLY_KEY], function_call=None
+            )
+
         certainty, identified_task, reasoning = identify_task(user.id, messages)
         if certainty == 1:
             # log the data point
@@ -243,7 +322,7 @@ def handle_chatgpt_function_call(
                 True,
                 messages,
             )
-            return call_openai_api(messages)
+            return call_openai_api(messages, dialogue_type=DIALOGUE_TYPE_AI_STANDARD)
         else:
             generate_chat_gpt_message(
                 CHATGPT_USER_ROLE,
@@ -254,56 +333,209 @@ def handle_chatgpt_function_call(
                 messages,
             )
             # confirm_task(identified_tasks, user, messages)
-            return call_openai_api(messages, ONGOING_CONVO_FUNCTIONS)
+            return call_openai_api(
+                messages,
+                ONGOING_CONVO_FUNCTIONS,
+                dialogue_type=DIALOGUE_TYPE_AI_STANDARD,
+            )
     else:
         raise NotImplementedError(f"Function {function_name} is not implemented.")
 
 
+def estimate_request_tokens(args: dict) -> int:
+    """Estimates how many tokens a request will use, for the tokens-per-minute rate limit."""
+    return (
+        count_message_tokens(args[OPENAI_MESSAGE_FIELD])
+        + estimate_tokens(json.dumps(args.get(OPENAI_FUNCTIONS_FIELD, "")))
+        # a routed response length cap bounds the completion better than the flat reserve
+        + args.get(OPENAI_MAX_TOKENS_FIELD, OPENAI_COMPLETION_TOKENS_RESERVE)
+    )
+
+
 def call_openai_api(
-    messages: list[str], functions: Optional[list] = None, ignore_cache: bool = False
+    messages: list[str],
+    functions: Optional[list] = None,
+    ignore_cache: bool = False,
+    dialogue_type: Optional[str] = None,
 ):
     """
-    Calls the OpenAI API and returns the response.
+    Calls the OpenAI API and returns the response. The dialogue type selects the model route (see
+    Nudgie/chat/model_routing.py) and the cache policy used to build the request's cache key.
     """
-    args = {OPENAI_MODEL_FIELD: CHAT_GPT_MODEL, OPENAI_MESSAGE_FIELD: messages}
-    if functions is not None:
-        args[OPENAI_FUNCTIONS_FIELD] = functions
+    args = build_request_args(messages, functions, dialogue_type)
+
+    recorder = LlmCallRecorder(args, dialogue_type)
+    record_request(args, dialogue_type)
+    request_hash = get_cache_key(args, dialogue_type)
+
+    if not ignore_cache and request_hash is not None:
+        # Check if the request is already cached
+        cached_response, cache_tier = get_cached_response(request_hash)
+        if cached_response is not None:
+            recorder.finish(cache_status=cache_tier)
+            return deserialize_response_data(cached_response)
+        recorder.cache_status = CACHE_STATUS_MISS
+
+    try:
+        api_response = schedule_openai_call(
+            lambda: client.chat.completions.create(**args),
+            estimate_request_tokens(args),
+        )
+    except Exception:
+        recorder.finish(success=False)
+        raise
+    recorder.finish(**get_token_usage(api_response))
 
-    args_json = json.dumps(args, sort_keys=True)
+    # Generate cached object
+    response_data = get_serializable_response_data(api_response)
 
-    if not ignore_cache:
-        try:
-            # Check if the request is already cached
-            cached_response = CachedApiResponse.objects.get(request_params=args_json)
-            print("Cache hit for OpenAI request, skipping API call")
-            return deserialize_response_data(json.loads(cached_response.response))
-        except ObjectDoesNotExist:
-            print("OpenAI response cache miss, calling API")
-            pass
+    # Cache the response
+    if request_hash is not None:
+        cache_response(request_hash, response_data)
 
-    api_response = client.chat.completions.create(**args)
+    return deserialize_response_data(response_data)
+
+
+async def acall_openai_api(
+    messages: list[str],
+    functions: Optional[list] = None,
+    ignore_cache: bool = False,
+    dialogue_type: Optional[str] = None,
+):
+    """
+    Async version of call_openai_api. The OpenAI request doesn't block a thread, so a single
+    ASGI process can have many of these in flight at once.
+    """
+    args = build_request_args(messages, functions, dialogue_type)
+
+    recorder = LlmCallRecorder(args, dialogue_type)
+    await sync_to_async(record_request)(args, dialogue_type)
+    request_hash = get_cache_key(args, dialogue_type)
+
+    if not ignore_cache and request_hash is not None:
+        cached_response, cache_tier = await sync_to_async(get_cached_response)(
+            request_hash
+        )
+        if cached_response is not None:
+            await sync_to_async(recorder.finish)(cache_status=cache_tier)
+            return deserialize_response_data(cached_response)
+        recorder.cache_status = CACHE_STATUS_MISS
+
+    try:
+        api_response = await aschedule_openai_call(
+            lambda: async_client.chat.completions.create(**args),
+            estimate_request_tokens(args),
+        )
+    except Exception:
+        await sync_to_async(recorder.finish)(success=False)
+        raise
+    await sync_to_async(recorder.finish)(**get_token_usage(api_response))
 
-    # Generate cached object
     response_data = get_serializable_response_data(api_response)
 
-    # Cache the response
-    response_json = json.dumps(response_data)
-    CachedApiResponse.objects.create(request_params=args_json, response=response_json)
+    if request_hash is not None:
+        await sync_to_async(cache_response)(request_hash, response_data)
+
+    return deserialize_response_data(response_data)
+
+
+def stream_openai_api(
+    messages: list[str],
+    functions: Optional[list] = None,
+    dialogue_type: Optional[str] = None,
+) -> Generator[str, None, SimpleNamespace]:
+    """
+    Streaming counterpart of call_openai_api. Yields the response content piece by piece as it
+    arrives and returns the complete response (in the same shape as call_openai_api's) once the
+    stream is done. Function calls aren't yielded, only accumulated into the returned response.
+    Use it with `response = yield from stream_openai_api(...)`.
+    """
+    args = build_request_args(messages, functions, dialogue_type)
+
+    recorder = LlmCallRecorder(args, dialogue_type)
+    record_request(args, dialogue_type)
+    request_hash = get_cache_key(args, dialogue_type)
+
+    if request_hash is not None:
+        cached_response, cache_tier = get_cached_response(request_hash)
+        if cached_response is not None:
+            recorder.finish(cache_status=cache_tier)
+            if cached_response[CHATGPT_CONTENT_KEY]:
+                yield cached_response[CHATGPT_CONTENT_KEY]
+            return deserialize_response_data(cached_response)
+        recorder.cache_status = CACHE_STATUS_MISS
+
+    content_parts = []
+    function_name_parts = []
+    function_argument_parts = []
+
+    try:
+        # only opening the stream is scheduled; errors after the first chunk aren't retried
+        stream = schedule_openai_call(
+            lambda: client.chat.completions.create(**args, stream=True),
+            estimate_request_tokens(args),
+        )
+        for chunk in stream:
+            recorder.mark_first_token()
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+
+            if delta.content:
+                content_parts.append(delta.content)
+                yield delta.content
+
+            if delta.function_call is not None:
+                if delta.function_call.name:
+                    function_name_parts.append(delta.function_call.name)
+                if delta.function_call.arguments:
+                    function_argument_parts.append(delta.function_call.arguments)
+    except Exception:
+        recorder.finish(success=False)
+        raise
+
+    # streamed responses don't report usage, so the token counts are estimates
+    recorder.finish(
+        prompt_tokens=count_message_tokens(args[OPENAI_MESSAGE_FIELD]),
+        completion_tokens=estimate_tokens(
+            "".join(content_parts + function_name_parts + function_argument_parts)
+        ),
+    )
+
+    response_data = {CHATGPT_CONTENT_KEY: "".join(content_parts) or None}
+    if function_name_parts:
+        response_data[CHATGPT_FUNCTION_CALL_KEY] = {
+            CHATGPT_FUNCTION_NAME_KEY: "".join(function_name_parts),
+            CHATGPT_FUNCTION_ARGUMENTS_KEY: "".join(function_argument_parts),
+        }
+
+    if request_hash is not None:
+        cache_response(request_hash, response_data)
 
     return deserialize_response_data(response_data)
 
 
+def get_token_usage(api_response) -> dict:
+    """Returns the token counts OpenAI reported for a response, as LlmCallRecorder.finish kwargs."""
+    usage = getattr(api_response, "usage", None)
+    if usage is None:
+        return {}
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+    }
+
+
 def deserialize_response_data(serialized_response_data):
     """
     This deserializes the response data so that it can be treated in the exact same way as
     the original API response.
     """
-    if CHATGPT_FUNCTION_CALL_KEY in serialized_response_data:
-        function_call = SimpleNamespace(
-            **serialized_response_data[CHATGPT_FUNCTION_CALL_KEY]
-        )
-        serialized_response_data[CHATGPT_FUNCTION_CALL_KEY] = function_call
-    return SimpleNamespace(**serialized_response_data)
+    response_data = dict(serialized_response_data)
+    if CHATGPT_FUNCTION_CALL_KEY in response_data:
+        function_call = SimpleNamespace(**response_data[CHATGPT_FUNCTION_CALL_KEY])
+        response_data[CHATGPT_FUNCTION_CALL_KEY] = function_call
+    return SimpleNamespace(**response_data)
 
 
 def get_serializable_response_data(api_response):
@@ -325,6 +557,54 @@ def get_serializable_response_data(api_response):
     return response_data
 
 
+@llm_call_site
+def refresh_conversation_summary(user: User) -> None:
+    """
+    Folds the lines that have fallen out of the recent window into the user's rolling summary. This
+    only calls OpenAI once a full checkpoint's worth of lines is pending, so the summary is refreshed
+    incrementally rather than on every turn.
+    """
+    summary = get_summary(user)
+    pending_lines = get_lines_pending_summary(user, summary)
+
+    if len(pending_lines) < CONTEXT_SUMMARY_CHECKPOINT:
+        return
+
+    print(f"summarizing {len(pending_lines)} lines of conversation for {user.username}")
+    # internal prompts and replies are noise to the summary
+    transcript = "\n".join(
+        f"{line.message_type}: {line.content}"
+        for line in pending_lines
+        if line.dialogue_type != DIALOGUE_TYPE_SYSTEM_MESSAGE
+    )
+    response = call_openai_api(
+        [
+            {
+                CHATGPT_ROLE_KEY: CHATGPT_USER_ROLE,
+                CHATGPT_CONTENT_KEY: CONVERSATION_SUMMARY_PROMPT.format(
+                    previous_summary=summary.content, transcript=transcript
+                ),
+            }
+        ],
+        dialogue_type=DIALOGUE_TYPE_SUMMARY,
+    )
+
+    summary.content = response.content
+    summary.summarized_through_id = pending_lines[-1].id
+    summary.save()
+
+
+def get_conversation_context(user: User) -> ConversationContext:
+    """Refreshes the user's rolling summary if needed and builds the conversation context."""
+    refresh_conversation_summary(user)
+    context = build_conversation_context(user)
+    print(
+        f"assembled conversation context for {user.username}:"
+        f" {len(context.messages)} messages, ~{context.token_count} tokens"
+    )
+    return context
+
+
 def generate_reminder_prompt(task_data: TaskData) -> str:
     """
     Generates the prompt for the AI to generate a reminder.
@@ -348,50 +628,62 @@ def generate_deadline_missed_prompt(task_data: TaskData) -> str:
     )
 
 
-def generate_and_send_message_to_user(
-    user: User, message: str, dialogue_type: str
-) -> None:
+def generate_message_for_user(user: User, message: str, dialogue_type: str) -> str:
     """
-    Prompts ChatGPT to generate a reminder or a nudge, then sends it to the user.
+    Prompts ChatGPT to generate a reminder, nudge, etc. for the user and returns it without
+    sending it.
     """
-    messages = load_conversation(user)
+    messages = get_conversation_context(user).messages
     generate_chat_gpt_message(
         role=CHATGPT_USER_ROLE,
         content=message,
         user=user,
         dialogue_type=DIALOGUE_TYPE_SYSTEM_MESSAGE,
-        save_conversation=True,
+        save_conversation=False,
         messages=messages,
     )
 
-    # Generate, package, and send the response.
-    response_text = call_openai_api(
-        [get_system_message_standard(user), *messages]
+    return call_openai_api(
+        [get_system_message_standard(user), *messages], dialogue_type=dialogue_type
     ).content
-    generate_chat_gpt_message(
-        role=CHATGPT_ASSISTANT_ROLE,
-        content=response_text,
-        user=user,
-        dialogue_type=dialogue_type,
-        save_conversation=True,
-        messages=messages,
-    )
 
 
-def generate_and_send_reminder(user: User, task_data: TaskData) -> None:
+@conversation_turn
+def send_message_to_user(
+    user: User,
+    message: str,
+    response_text: str,
+    dialogue_type: str,
+    nudgie_task_id: Optional[int] = None,
+) -> None:
     """
-    Prompts ChatGPT to generate a reminder, then sends the reminder to the user.
+    Saves a generated message to the user's conversation, along with the prompt it was generated
+    from. A reminder or nudge is saved with the id of the NudgieTask it is about.
     """
-    generate_and_send_message_to_user(
-        user, generate_reminder_prompt(task_data), DIALOGUE_TYPE_REMINDER
+    save_line_of_speech(user, CHATGPT_USER_ROLE, DIALOGUE_TYPE_SYSTEM_MESSAGE, message)
+    save_line_of_speech(
+        user, CHATGPT_ASSISTANT_ROLE, dialogue_type, response_text, nudgie_task_id
     )
 
 
-def generate_and_send_nudge(user: User) -> None:
+@llm_call_site
+def generate_and_send_message_to_user(
+    user: User, message: str, dialogue_type: str, nudgie_task_id: Optional[int] = None
+) -> None:
     """
-    Prompts ChatGPT to generate a nudge, then sends the nudge to the user.
+    Prompts ChatGPT to generate a reminder or a nudge, then sends it to the user.
     """
-    generate_and_send_message_to_user(user, NUDGE_PROMPT, DIALOGUE_TYPE_NUDGE)
+    response_text = generate_message_for_user(user, message, dialogue_type)
+    send_message_to_user(user, message, response_text, dialogue_type, nudgie_task_id)
+
+
+def get_scheduled_message_prompt(task_data: TaskData) -> str:
+    """
+    Returns the prompt for a scheduled reminder or nudge.
+    """
+    if task_data.dialogue_type == DIALOGUE_TYPE_NUDGE:
+        return NUDGE_PROMPT
+    return generate_reminder_prompt(task_data)
 
 
 def generate_and_send_deadline(task_data: TaskData) -> None:
@@ -441,37 +733,63 @@ def get_functions(initial_goal_convo: bool) -> str:
     return INITIAL_CONVO_FUNCTIONS if initial_goal_convo else ONGOING_CONVO_FUNCTIONS
 
 
-def handle_convo(
-    prompt,
-    messages,
-    user,
-) -> str:
+class ConvoRequest(NamedTuple):
+    api_messages: list[dict]
+    functions: list
+    dialogue_type: str
+    # the pending tasks the AI was shown (single call mode only, see resolve_completed_task)
+    pending_tasks: Optional[list[NudgieTask]]
+
+
+def prepare_convo_request(prompt, messages, user) -> ConvoRequest:
     """
-    Calls OpenAI with the user's input and responds accordingly based on the AI's
-    response. Returns the final output to display to the user.
+    Saves the user's input and prepares the API call for it: the messages, functions and dialogue
+    type to call OpenAI with, along with the pending tasks sent with them.
     """
-
-    # Generate message and prepare API call
     generate_chat_gpt_message(
         CHATGPT_USER_ROLE, prompt, user, DIALOGUE_TYPE_USER_INPUT, True, messages
     )
 
     initial_goal_convo = get_current_goal(user) is None
     api_messages = add_system_message(messages, initial_goal_convo, user)
+    pending_tasks = None
+    if (
+        not initial_goal_convo
+        and settings.TASK_COMPLETION_MODE == TASK_COMPLETION_MODE_SINGLE_CALL
+    ):
+        # lets the AI pick the task itself when it calls complete_task (see resolve_completed_task).
+        # This is on every ongoing-goal turn, whether or not it's about a task, so each of them
+        # pays for the message's instructions and a line per pending task in prompt tokens (see
+        # bench_task_completion).
+        pending_tasks = get_pending_tasks(user, get_time(user))
+        api_messages.insert(1, get_pending_tasks_message(pending_tasks))
+
+    return ConvoRequest(
+        api_messages,
+        get_functions(initial_goal_convo),
+        DIALOGUE_TYPE_GOAL_SETUP if initial_goal_convo else DIALOGUE_TYPE_AI_STANDARD,
+        pending_tasks,
+    )
 
-    response = call_openai_api(api_messages, get_functions(initial_goal_convo))
 
-    # Handle function call, if necessary
-    if has_function_call(response):
-        response = handle_chatgpt_function_call(
-            response.function_call.name,
-            json.loads(response.function_call.arguments),
-            user,
-            messages,
-        )
+def handle_function_call_if_present(
+    response, user, messages, pending_tasks: Optional[list[NudgieTask]] = None
+):
+    """Handles the function call in the AI's response, if there is one."""
+    if not has_function_call(response):
+        return response
 
-    # Generate final response to the user
-    response_text = response.content
+    return handle_chatgpt_function_call(
+        response.function_call.name,
+        json.loads(response.function_call.arguments),
+        user,
+        messages,
+        pending_tasks,
+    )
+
+
+def save_convo_response(response_text: str, user, messages) -> None:
+    """Saves the final response to the user."""
     generate_chat_gpt_message(
         CHATGPT_ASSISTANT_ROLE,
         response_text,
@@ -481,9 +799,96 @@ def handle_convo(
         messages,
     )
 
+
+@llm_call_site
+@conversation_turn
+def handle_convo(
+    prompt,
+    messages,
+    user,
+) -> str:
+    """
+    Calls OpenAI with the user's input and responds accordingly based on the AI's
+    response. Returns the final output to display to the user.
+    """
+    request = prepare_convo_request(prompt, messages, user)
+
+    response = call_openai_api(
+        request.api_messages, request.functions, dialogue_type=request.dialogue_type
+    )
+
+    # Handle function call, if necessary
+    response = handle_function_call_if_present(
+        response, user, messages, request.pending_tasks
+    )
+
+    # Generate final response to the user
+    response_text = response.content
+    save_convo_response(response_text, user, messages)
+
     return response_text
 
 
+@llm_call_site
+@conversation_turn
+async def ahandle_convo(
+    prompt,
+    messages,
+    user,
+) -> str:
+    """
+    Async version of handle_convo. Preparing the request and handling function calls (which set up
+    goals, schedule tasks, etc) is still done synchronously, off the event loop.
+    """
+    request = await sync_to_async(prepare_convo_request)(prompt, messages, user)
+
+    response = await acall_openai_api(
+        request.api_messages, request.functions, dialogue_type=request.dialogue_type
+    )
+
+    if has_function_call(response):
+        response = await sync_to_async(handle_function_call_if_present)(
+            response, user, messages, request.pending_tasks
+        )
+
+    response_text = response.content
+    await asave_line_of_speech(
+        user, CHATGPT_ASSISTANT_ROLE, DIALOGUE_TYPE_AI_STANDARD, response_text
+    )
+    messages.append(
+        {CHATGPT_ROLE_KEY: CHATGPT_ASSISTANT_ROLE, CHATGPT_CONTENT_KEY: response_text}
+    )
+
+    return response_text
+
+
+@llm_call_site
+@conversation_turn
+def handle_convo_stream(
+    prompt,
+    messages,
+    user,
+) -> Iterator[str]:
+    """
+    Streaming version of handle_convo. Yields the response to the user as it is generated. If the
+    AI calls a function, the follow-up response is yielded in one piece once the function call has
+    been handled. The complete response is saved once the stream is done.
+    """
+    request = prepare_convo_request(prompt, messages, user)
+
+    response = yield from stream_openai_api(
+        request.api_messages, request.functions, dialogue_type=request.dialogue_type
+    )
+
+    if has_function_call(response):
+        response = handle_function_call_if_present(
+            response, user, messages, request.pending_tasks
+        )
+        yield response.content
+
+    save_convo_response(response.content, user, messages)
+
+
 def get_task_identification_message(
     nudgie_tasks: list[NudgieTask], user: User, messages: list
 ):
@@ -493,7 +898,7 @@ def get_task_identification_message(
     return generate_chat_gpt_message(
         CHATGPT_USER_ROLE,
         TASK_IDENTIFICATION_PROMPT.format(
-            **{PENDING_TASKS_KEY: serialize("json", nudgie_tasks)}
+            **{PENDING_TASKS_KEY: serialize_pending_tasks(nudgie_tasks)}
         ),
         user,
         DIALOGUE_TYPE_SYSTEM_MESSAGE,
@@ -502,25 +907,122 @@ def get_task_identification_message(
     )
 
 
-def identify_task(user_id: str, messages: list) -> (float, list[NudgieTask]):
-    user = User.objects.get(id=user_id)
+def get_latest_user_message(messages: list) -> str:
+    return next(
+        (
+            message[CHATGPT_CONTENT_KEY]
+            for message in reversed(messages)
+            if message[CHATGPT_ROLE_KEY] == CHATGPT_USER_ROLE
+        ),
+        "",
+    )
+
+
+def get_pending_tasks(user: User, now) -> list[NudgieTask]:
+    """Returns the user's pending tasks, only the earliest due one for each task name."""
     tasks = NudgieTask.objects.filter(
-        user_id=user_id,
+        user_id=user.id,
         completed=False,
-        due_date__gt=get_time(user),
+        due_date__gt=now,
+    )
+
+    # Only the earliest occurrence of each task counts as pending.
+    return list(
+        remove_duplicate_tasks(tasks)
+        .select_related("task", "goal")
+        .order_by(NUDGIE_TASK_DUE_DATE_FIELD)
+    )
+
+
+def serialize_pending_tasks(tasks: list[NudgieTask]) -> str:
+    """
+    Compact listing of the pending tasks for the AI, one JSON object per line with just the fields
+    it needs to tell them apart. Times are to the minute, which is as precise as the crontabs are,
+    and the reminder is just a time of day since it goes off on (or before) the due date.
+    """
+    lines = []
+    for task in tasks:
+        projection = {
+            TASK_IDENTIFICATION_NUDGIE_TASK_ID: task.id,
+            "task_name": task.task.name,
+            "goal_name": task.goal.goal_name,
+            "due_date": task.due_date.isoformat(timespec="minutes"),
+        }
+        if task.reminder_time is not None:
+            projection["reminder_time"] = task.reminder_time.strftime("%H:%M")
+        lines.append(json.dumps(projection, separators=(",", ":")))
+
+    return "\n".join(lines)
+
+
+def get_pending_tasks_message(tasks: list[NudgieTask]) -> dict:
+    """
+    Generates the (unsaved) message listing the pending tasks for the AI's complete_task call.
+    """
+    return generate_chat_gpt_message(
+        CHATGPT_SYSTEM_ROLE,
+        PENDING_TASKS_FRAGMENT.format(
+            **{PENDING_TASKS_KEY: serialize_pending_tasks(tasks)}
+        ),
+        None,
+        DIALOGUE_TYPE_SYSTEM_MESSAGE,
+        False,
     )
 
-    # If there are any tasks with the same task_name, remove whichever one has the greatest due_date.
-    tasks = remove_duplicate_tasks(tasks)
+
+def resolve_completed_task(
+    function_args: dict, pending_tasks: Optional[list[NudgieTask]]
+) -> Optional[NudgieTask]:
+    """
+    Returns the task the AI identified in its complete_task call, if it was certain, wrote a reply
+    and picked one of the pending tasks it was shown. Otherwise returns None, and the task has to
+    be identified separately (which looks the pending tasks up afresh).
+    """
+    if pending_tasks is None:
+        # multi call mode, the AI wasn't shown the pending tasks
+        return None
+    certainty = function_args.get(TASK_IDENTIFICATION_CERTAINTY_SCORE)
+    if certainty != 1 or not function_args.get(COMPLETE_TASK_REPLY_KEY):
+        return None
+
+    task_id = function_args.get(TASK_IDENTIFICATION_NUDGIE_TASK_ID)
+    return next((task for task in pending_tasks if task.id == task_id), None)
+
+
+@llm_call_site
+def identify_task(user_id: str, messages: list) -> (float, NudgieTask, str):
+    user = User.objects.get(id=user_id)
+    now = get_time(user)
+    tasks = get_pending_tasks(user, now)
+
+    if not tasks:
+        record_identification_path(PATH_NO_TASKS)
+        return 0, None, "there are no pending tasks"
 
     # If there's only one task, there's no need to perform complex task identification.
-    if tasks.count() == 1:
+    if len(tasks) == 1:
         print("only one task, skipping chatGPT task identification task query")
-        return 1, [tasks[0]], ""
+        record_identification_path(PATH_SINGLE_TASK)
+        return 1, tasks[0], ""
+
+    # Try to identify the task locally, only falling back to the AI if it's ambiguous.
+    task, reasoning = match_task_locally(
+        tasks, get_latest_user_message(messages), user, now
+    )
+    print(f"local task identification: {reasoning}")
+    if task is not None:
+        record_identification_path(PATH_LOCAL)
+        return 1, task, reasoning
 
     # Perform complex task identification using the AI
+    start = time.perf_counter()
     get_task_identification_message(tasks, user, messages)
-    response = call_openai_api(messages, ONGOING_CONVO_FUNCTIONS)
+    response = call_openai_api(
+        messages,
+        ONGOING_CONVO_FUNCTIONS,
+        dialogue_type=DIALOGUE_TYPE_TASK_IDENTIFICATION,
+    )
+    record_identification_path(PATH_LLM, time.perf_counter() - start)
     print(f"response for task identification: {response.content}")
 
     # Make the AI aware that it already executed the function call.
@@ -551,17 +1053,14 @@ def identify_task(user_id: str, messages: list) -> (float, list[NudgieTask]):
 
 
 def remove_duplicate_tasks(tasks):
-    # Annotate each task_name with the earliest due_date
-    min_dates = tasks.values(NUDGIE_TASK_TASK_NAME_FIELD).annotate(
-        min_due_date=Min(NUDGIE_TASK_DUE_DATE_FIELD)
-    )
-
-    task_ids_to_keep = []
-
-    for item in min_dates:
-        task = tasks.get(
-            task__name=item[NUDGIE_TASK_TASK_NAME_FIELD], due_date=item["min_due_date"]
+    """
+    Keeps only the earliest due task for each task name. This is a single query: the tasks are
+    ranked by due date within each task name, and only the first of each is kept.
+    """
+    return tasks.annotate(
+        due_date_rank=Window(
+            RowNumber(),
+            partition_by=F(NUDGIE_TASK_TASK_NAME_FIELD),
+            order_by=[F(NUDGIE_TASK_DUE_DATE_FIELD).asc(), F("id").asc()],
         )
-        task_ids_to_keep.append(task.id)
-
-    return tasks.filter(id__in=task_ids_to_keep)
+    ).filter(due_date_rank=1)
@@ -0,0 +1,185 @@
+"""
+Assembles the conversation history that is sent to OpenAI. Rather than replaying every line the user
+has ever exchanged with Nudgie, the context is the user's rolling summary (see ConversationSummary)
+followed by the lines that haven't been summarized yet, trimmed from the oldest end to fit a token
+budget. Internal lines (system messages) which have already served their purpose are dropped or
+condensed along the way.
+"""
+
+from typing import NamedTuple, Optional
+
+from django.contrib.auth.models import User
+
+from Nudgie.config.chatgpt_inputs import (
+    CONDENSED_PROMPT_DEFAULT_DESCRIPTION,
+    CONDENSED_PROMPT_DESCRIPTIONS,
+    CONDENSED_PROMPT_FRAGMENT,
+    CONVERSATION_SUMMARY_FRAGMENT,
+)
+from Nudgie.constants import (
+    CHARS_PER_TOKEN,
+    CHATGPT_ASSISTANT_ROLE,
+    CHATGPT_CONTENT_KEY,
+    CHATGPT_ROLE_KEY,
+    CHATGPT_SYSTEM_ROLE,
+    CONTEXT_RECENT_TURNS,
+    CONTEXT_TOKEN_BUDGET,
+    DIALOGUE_TYPE_SYSTEM_MESSAGE,
+    TOKENS_PER_MESSAGE_OVERHEAD,
+)
+from Nudgie.models import Conversation, ConversationSummary
+
+
+class ConversationContext(NamedTuple):
+    messages: list[dict]
+    token_count: int
+    summarized_through_id: int
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Cheap token estimate, good enough for budgeting."""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def count_message_tokens(messages: list[dict]) -> int:
+    """Estimates the number of prompt tokens taken up by a list of messages."""
+    return sum(
+        TOKENS_PER_MESSAGE_OVERHEAD + estimate_tokens(message.get(CHATGPT_CONTENT_KEY))
+        for message in messages
+    )
+
+
+def get_summary(user: User) -> ConversationSummary:
+    summary, _ = ConversationSummary.objects.get_or_create(user=user)
+    return summary
+
+
+def get_lines_pending_summary(user: User, summary: ConversationSummary) -> list:
+    """
+    Returns the unsummarized lines which have fallen out of the recent window (i.e. everything
+    between the summary checkpoint and the CONTEXT_RECENT_TURNS most recent lines), oldest first.
+    """
+    recent_ids = list(
+        Conversation.objects.filter(user=user)
+        .order_by("-id")
+        .values_list("id", flat=True)[:CONTEXT_RECENT_TURNS]
+    )
+    if len(recent_ids) < CONTEXT_RECENT_TURNS:
+        return []
+
+    return list(
+        Conversation.objects.filter(
+            user=user, id__gt=summary.summarized_through_id, id__lt=recent_ids[-1]
+        ).order_by("id")
+    )
+
+
+def get_prompt_tag(content: Optional[str]) -> Optional[str]:
+    """Returns the bracketed tag an internal prompt starts with (e.g. [REMINDER]), if it has one."""
+    if not content or not content.startswith("["):
+        return None
+    end = content.find("]")
+    return content[: end + 1] if end != -1 else None
+
+
+def condense_prompt(content: Optional[str]) -> Optional[str]:
+    """
+    Condenses an internal prompt to its tag (e.g. [REMINDER]) and a one-line description of what it
+    was for. Returns None if it has no tag.
+    """
+    tag = get_prompt_tag(content)
+    if tag is None:
+        return None
+    return CONDENSED_PROMPT_FRAGMENT.format(
+        tag=tag,
+        description=CONDENSED_PROMPT_DESCRIPTIONS.get(
+            tag, CONDENSED_PROMPT_DEFAULT_DESCRIPTION
+        ),
+    )
+
+
+def condense_internal_lines(lines: list[tuple]) -> list[dict]:
+    """
+    Turns (message_type, dialogue_type, content) lines into messages, dropping the internal lines
+    which are stale, i.e. followed by a line the user saw. The exception is the prompt that the
+    following reply of the AI answered, which is condensed to its tag and a line saying what it was
+    for (see condense_prompt), so that the AI can still tell why it said what it did. Internal lines
+    after the last visible line belong to an exchange still in progress and are kept as is.
+    """
+    last_visible = max(
+        (
+            index
+            for index, (_, dialogue_type, _) in enumerate(lines)
+            if dialogue_type != DIALOGUE_TYPE_SYSTEM_MESSAGE
+        ),
+        default=-1,
+    )
+
+    messages = []
+    for index, (message_type, dialogue_type, content) in enumerate(lines):
+        if dialogue_type == DIALOGUE_TYPE_SYSTEM_MESSAGE and index < last_visible:
+            next_message_type, next_dialogue_type, _ = lines[index + 1]
+            answered = (
+                next_message_type == CHATGPT_ASSISTANT_ROLE
+                and next_dialogue_type != DIALOGUE_TYPE_SYSTEM_MESSAGE
+            )
+            content = condense_prompt(content) if answered else None
+            if content is None:
+                continue
+        messages.append({CHATGPT_ROLE_KEY: message_type, CHATGPT_CONTENT_KEY: content})
+
+    return messages
+
+
+def build_conversation_context(
+    user: User, token_budget: int = CONTEXT_TOKEN_BUDGET
+) -> ConversationContext:
+    """
+    Builds the conversation history for a request: the rolling summary (if there is one) plus the
+    unsummarized lines, verbatim apart from stale internal lines (see condense_internal_lines). If
+    that exceeds the token budget, the oldest verbatim lines are dropped, though the most recent line
+    is always kept.
+    """
+    summary = get_summary(user)
+
+    summary_messages = []
+    if summary.content:
+        summary_messages.append(
+            {
+                CHATGPT_ROLE_KEY: CHATGPT_SYSTEM_ROLE,
+                CHATGPT_CONTENT_KEY: CONVERSATION_SUMMARY_FRAGMENT.format(
+                    summary=summary.content
+                ),
+            }
+        )
+
+    lines = (
+        Conversation.objects.filter(user=user, id__gt=summary.summarized_through_id)
+        .order_by("id")
+        .values_list("message_type", "dialogue_type", "content")
+    )
+    line_messages = condense_internal_lines(list(lines))
+
+    token_count = count_message_tokens(summary_messages)
+    kept_messages = []
+    for message in reversed(line_messages):
+        message_tokens = count_message_tokens([message])
+        if kept_messages and token_count + message_tokens > token_budget:
+            break
+        kept_messages.append(message)
+        token_count += message_tokens
+    kept_messages.reverse()
+
+    if len(kept_messages) < len(line_messages):
+        print(
+            f"context for {user.username} over budget, dropped"
+            f" {len(line_messages) - len(kept_messages)} unsummarized lines"
+        )
+
+    return ConversationContext(
+        messages=[*summary_messages, *kept_messages],
+        token_count=token_count,
+        summarized_through_id=summary.summarized_through_id,
+    )
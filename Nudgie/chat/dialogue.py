@@ -1,27 +1,227 @@
+import contextvars
+import functools
+import inspect
+from typing import NamedTuple, Optional
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
+from django.db import transaction
 
+from Nudgie.config.chatgpt_inputs import TURN_INTERRUPTED_FRAGMENT
+from Nudgie.constants import (
+    CHATGPT_USER_ROLE,
+    CONVERSATION_PAGE_SIZE,
+    DIALOGUE_TYPE_SYSTEM_MESSAGE,
+)
 from Nudgie.models import Conversation
 
 
-def load_conversation(user):
-    # check if the convo is in the request session
-    lines = Conversation.objects.filter(user=user).order_by("timestamp")
-    return [{"role": line.message_type, "content": line.content} for line in lines]
+def get_visible_lines(user):
+    """
+    The user's side of the conversation: every line except the internal prompts and replies
+    (system messages), which are only there for the AI.
+    """
+    return (
+        Conversation.objects.filter(user=user)
+        .exclude(dialogue_type=DIALOGUE_TYPE_SYSTEM_MESSAGE)
+        .order_by("id")
+    )
+
+
+def get_last_line_id(user_id: int) -> int:
+    """Returns the id of the user's latest Conversation line (0 if there are none)."""
+    return (
+        Conversation.objects.filter(user_id=user_id)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+        or 0
+    )
+
+
+class ConversationPage(NamedTuple):
+    lines: list[dict]  # oldest first
+    has_more: bool  # whether there are more lines beyond this page, in the direction it was read
+
+
+def get_conversation_page(
+    user: User,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    page_size: int = CONVERSATION_PAGE_SIZE,
+) -> ConversationPage:
+    """
+    Returns a page of the user-visible transcript. Pages are keyed on line ids rather than offsets,
+    so each one is a short range scan of the (user, id) index however long the history gets. By
+    default this is the latest page; `before` gives the lines preceding that line id (scrolling
+    back) and `after` the lines following it (catching up).
+    """
+    lines = get_visible_lines(user)
+    if after is not None:
+        lines = lines.filter(id__gt=after)
+    else:
+        if before is not None:
+            lines = lines.filter(id__lt=before)
+        lines = lines.reverse()
+
+    rows = list(lines.values_list("id", "message_type", "content")[: page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if after is None:
+        rows.reverse()
+
+    return ConversationPage(
+        lines=[
+            {"id": id, "role": message_type, "content": content}
+            for id, message_type, content in rows
+        ],
+        has_more=has_more,
+    )
+
+
+class ConversationWriter:
+    """
+    Buffers the lines saved during one turn of the conversation, and writes them in order in a
+    single transaction when the turn is over. If the turn fails partway, the lines it got to are
+    still written, followed by a marker saying that the turn was interrupted.
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def add(self, line: Conversation) -> None:
+        self.lines.append(line)
+
+    def flush(self, interrupted: bool = False) -> None:
+        lines, self.lines = self.lines, []
+        if not lines:
+            return
+
+        if interrupted:
+            lines.append(
+                Conversation(
+                    user=lines[-1].user,
+                    message_type=CHATGPT_USER_ROLE,
+                    dialogue_type=DIALOGUE_TYPE_SYSTEM_MESSAGE,
+                    content=TURN_INTERRUPTED_FRAGMENT,
+                )
+            )
+        with transaction.atomic():
+            Conversation.objects.bulk_create(lines)
+
+
+_writer = contextvars.ContextVar("conversation_writer", default=None)
+
+
+def conversation_turn(func):
+    """
+    Buffers the lines saved while the decorated function runs, writing them all at once when it
+    returns (see ConversationWriter). Nested turns are part of the outermost one.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _writer.get() is not None:
+            return func(*args, **kwargs)
+
+        writer = ConversationWriter()
+        token = _writer.set(writer)
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            writer.flush(interrupted=True)
+            raise
+        finally:
+            _writer.reset(token)
+        writer.flush()
+        return result
+
+    @functools.wraps(func)
+    async def async_wrapper(*args, **kwargs):
+        if _writer.get() is not None:
+            return await func(*args, **kwargs)
+
+        writer = ConversationWriter()
+        token = _writer.set(writer)
+        try:
+            result = await func(*args, **kwargs)
+        except BaseException:
+            await sync_to_async(writer.flush)(interrupted=True)
+            raise
+        finally:
+            _writer.reset(token)
+        await sync_to_async(writer.flush)()
+        return result
+
+    @functools.wraps(func)
+    def generator_wrapper(*args, **kwargs):
+        if _writer.get() is not None:
+            return (yield from func(*args, **kwargs))
+
+        # the writer has to be set around each step of the generator, not just its creation
+        writer = ConversationWriter()
+        generator = func(*args, **kwargs)
+        value = None
+        try:
+            while True:
+                token = _writer.set(writer)
+                try:
+                    item = generator.send(value)
+                except StopIteration as stop:
+                    writer.flush()
+                    return stop.value
+                finally:
+                    _writer.reset(token)
+                value = yield item
+        except BaseException:
+            # includes the consumer going away partway (GeneratorExit)
+            generator.close()
+            writer.flush(interrupted=True)
+            raise
+
+    if inspect.iscoroutinefunction(func):
+        return async_wrapper
+    if inspect.isgeneratorfunction(func):
+        return generator_wrapper
+    return wrapper
 
 
 def save_line_of_speech(
-    user: User, message_type: str, dialogue_type: str, content: str
+    user: User,
+    message_type: str,
+    dialogue_type: str,
+    content: str,
+    nudgie_task_id: Optional[int] = None,
 ):
-    """Saves a line of conversation to the database."""
-    message = Conversation(
+    """
+    Saves a line of conversation to the database. During a conversation turn, the line is only
+    written at the end of the turn.
+    """
+    line = Conversation(
         user=user,
         message_type=message_type,
         dialogue_type=dialogue_type,
         content=content,
+        nudgie_task_id=nudgie_task_id,
     )
-    print(
-        f"{message.user=} {message.message_type=} {message.dialogue_type=}"
-        f" {message.content=} {message.timestamp=} {message.id=}"
-        f" {message.pk=} {message.save}"
+    writer = _writer.get()
+    if writer is not None:
+        writer.add(line)
+    else:
+        line.save()
+
+
+async def asave_line_of_speech(
+    user: User, message_type: str, dialogue_type: str, content: str
+):
+    """Async version of save_line_of_speech."""
+    if _writer.get() is not None:
+        save_line_of_speech(user, message_type, dialogue_type, content)
+        return
+
+    await Conversation.objects.acreate(
+        user=user,
+        message_type=message_type,
+        dialogue_type=dialogue_type,
+        content=content,
     )
-    message.save()
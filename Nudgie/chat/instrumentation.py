@@ -0,0 +1,217 @@
+"""
+Per-call instrumentation for OpenAI calls. Each call is recorded with its wall time, token usage,
+model, cache status, calling path and dialogue type. Records are buffered in memory and written in
+batches, so recording adds next to nothing to the call itself.
+"""
+
+import atexit
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+from typing import Optional
+
+from django.utils import timezone
+
+from Nudgie.constants import (
+    LLM_CALL_RECORD_BUFFER_SIZE,
+    LLM_CALL_RECORD_FLUSH_SECONDS,
+    OPENAI_MODEL_FIELD,
+)
+from Nudgie.models import LlmCallRecord
+
+CACHE_STATUS_MISS = "miss"
+# the cache wasn't consulted (uncacheable dialogue type, or ignore_cache)
+CACHE_STATUS_BYPASS = "bypass"
+
+UNKNOWN_CALL_SITE = "unknown"
+
+_call_site = contextvars.ContextVar("llm_call_site", default=UNKNOWN_CALL_SITE)
+
+_buffer_lock = threading.Lock()
+_buffer = []
+_last_flush = time.monotonic()
+
+
+def get_call_site() -> str:
+    """Returns the label of the innermost @llm_call_site function that is currently running."""
+    return _call_site.get()
+
+
+def llm_call_site(func):
+    """
+    Labels every OpenAI call made while the decorated function runs with the function's name. When
+    labeled functions are nested, the innermost label wins.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _call_site.set(func.__name__)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _call_site.reset(token)
+
+    @functools.wraps(func)
+    async def async_wrapper(*args, **kwargs):
+        token = _call_site.set(func.__name__)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _call_site.reset(token)
+
+    @functools.wraps(func)
+    def generator_wrapper(*args, **kwargs):
+        # the label has to be set around each step of the generator, not just its creation
+        generator = func(*args, **kwargs)
+        value = None
+        while True:
+            token = _call_site.set(func.__name__)
+            try:
+                item = generator.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                _call_site.reset(token)
+            value = yield item
+
+    if inspect.iscoroutinefunction(func):
+        return async_wrapper
+    if inspect.isgeneratorfunction(func):
+        return generator_wrapper
+    return wrapper
+
+
+class LlmCallRecorder:
+    """Times one OpenAI call. Call finish() exactly once when the call is done."""
+
+    def __init__(self, args: dict, dialogue_type: Optional[str]):
+        self.model = args[OPENAI_MODEL_FIELD]
+        self.dialogue_type = dialogue_type or ""
+        self.call_site = get_call_site()
+        self.cache_status = CACHE_STATUS_BYPASS
+        self.first_token_ms = None
+        self._start = time.perf_counter()
+
+    def mark_first_token(self) -> None:
+        if self.first_token_ms is None:
+            self.first_token_ms = (time.perf_counter() - self._start) * 1000
+
+    def finish(
+        self,
+        cache_status: Optional[str] = None,
+        prompt_tokens: Optional[int] = None,
+        completion_tokens: Optional[int] = None,
+        success: bool = True,
+    ) -> None:
+        now = timezone.now()
+        buffer_record(
+            LlmCallRecord(
+                created_at=now,
+                day=now.date(),
+                call_site=self.call_site,
+                dialogue_type=self.dialogue_type,
+                model=self.model,
+                cache_status=cache_status or self.cache_status,
+                wall_ms=(time.perf_counter() - self._start) * 1000,
+                first_token_ms=self.first_token_ms,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                success=success,
+            )
+        )
+
+
+def buffer_record(record: LlmCallRecord) -> None:
+    """Adds a record to the buffer, flushing it once it's full or old enough."""
+    with _buffer_lock:
+        _buffer.append(record)
+        should_flush = (
+            len(_buffer) >= LLM_CALL_RECORD_BUFFER_SIZE
+            or time.monotonic() - _last_flush >= LLM_CALL_RECORD_FLUSH_SECONDS
+        )
+
+    if should_flush:
+        flush_llm_call_records()
+
+
+def flush_llm_call_records() -> int:
+    """Writes the buffered records to the DB. Returns how many were written."""
+    global _buffer, _last_flush
+
+    with _buffer_lock:
+        records, _buffer = _buffer, []
+        _last_flush = time.monotonic()
+
+    if records:
+        LlmCallRecord.objects.bulk_create(records)
+
+    return len(records)
+
+
+def _flush_at_exit() -> None:
+    try:
+        flush_llm_call_records()
+    except Exception as error:
+        print(f"failed to flush LLM call records at exit: {error}")
+
+
+atexit.register(_flush_at_exit)
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = round(fraction * len(sorted_values))
+    return sorted_values[min(len(sorted_values) - 1, max(0, rank - 1))]
+
+
+ROLLUP_FIELDS = ("dialogue_type", "day", "call_site", "model", "cache_status")
+
+
+def get_latency_rollups(
+    group_by: tuple = ("dialogue_type",), since: Optional[date] = None
+) -> list[dict]:
+    """
+    Aggregates the recorded calls by the given fields (any of ROLLUP_FIELDS): call count, wall time
+    percentiles, cache hit rate and token usage.
+    """
+    flush_llm_call_records()
+
+    records = LlmCallRecord.objects.all()
+    if since is not None:
+        records = records.filter(day__gte=since)
+
+    values = records.order_by().values_list(
+        *group_by, "wall_ms", "cache_status", "prompt_tokens", "completion_tokens"
+    )
+
+    groups = defaultdict(list)
+    for row in values.iterator():
+        groups[row[: len(group_by)]].append(row[len(group_by) :])
+
+    rollups = []
+    for key in sorted(groups, key=lambda key: tuple(str(part) for part in key)):
+        rows = groups[key]
+        wall_times = sorted(row[0] for row in rows)
+        cache_hits = sum(
+            1 for row in rows if row[1] not in (CACHE_STATUS_MISS, CACHE_STATUS_BYPASS)
+        )
+        rollups.append(
+            {
+                **dict(zip(group_by, key)),
+                "calls": len(rows),
+                "p50_ms": percentile(wall_times, 0.50),
+                "p95_ms": percentile(wall_times, 0.95),
+                "p99_ms": percentile(wall_times, 0.99),
+                "cache_hit_rate": cache_hits / len(rows),
+                "prompt_tokens": sum(row[2] or 0 for row in rows),
+                "completion_tokens": sum(row[3] or 0 for row in rows),
+            }
+        )
+
+    return rollups
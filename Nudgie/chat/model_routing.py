@@ -0,0 +1,58 @@
+"""
+Picks the model, response length cap and temperature for each OpenAI call. Short, formulaic
+messages (nudges, deadline notices) and the strict-JSON task identification don't need the
+largest model, so they are routed to a faster one. See MODEL_ROUTES in Nudgie/constants.py.
+"""
+
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+
+from Nudgie.chat.instrumentation import get_call_site
+from Nudgie.constants import (
+    MODEL_ROUTE_DEFAULT,
+    MODEL_ROUTES,
+    OPENAI_FUNCTIONS_FIELD,
+    OPENAI_MAX_TOKENS_FIELD,
+    OPENAI_MESSAGE_FIELD,
+    OPENAI_MODEL_FIELD,
+    OPENAI_TEMPERATURE_FIELD,
+)
+
+
+class ModelRoute(NamedTuple):
+    model: str
+    max_tokens: Optional[int]
+    temperature: Optional[float]
+
+
+def get_model_route(
+    dialogue_type: Optional[str], call_site: Optional[str] = None
+) -> ModelRoute:
+    """
+    Returns the route for a call. A (dialogue type, call site) route takes precedence over the
+    dialogue type's route, and settings.MODEL_ROUTE_OVERRIDES over both.
+    """
+    route = dict(MODEL_ROUTE_DEFAULT)
+    for key in (dialogue_type, (dialogue_type, call_site)):
+        route.update(MODEL_ROUTES.get(key, {}))
+        route.update(settings.MODEL_ROUTE_OVERRIDES.get(key, {}))
+
+    return ModelRoute(**route)
+
+
+def build_request_args(
+    messages: list, functions: Optional[list], dialogue_type: Optional[str]
+) -> dict:
+    """Builds the chat completion arguments for a call, routed by dialogue type and call site."""
+    route = get_model_route(dialogue_type, get_call_site())
+
+    args = {OPENAI_MODEL_FIELD: route.model, OPENAI_MESSAGE_FIELD: messages}
+    if functions is not None:
+        args[OPENAI_FUNCTIONS_FIELD] = functions
+    if route.max_tokens is not None:
+        args[OPENAI_MAX_TOKENS_FIELD] = route.max_tokens
+    if route.temperature is not None:
+        args[OPENAI_TEMPERATURE_FIELD] = route.temperature
+
+    return args
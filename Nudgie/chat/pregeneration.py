@@ -0,0 +1,219 @@
+"""
+Ahead-of-time generation of reminders and nudges. Instead of calling OpenAI when a reminder or nudge
+job fires (which makes delivery late by a full round trip, and lands all of a cron minute's calls at
+once), a beat task drafts each message a few minutes before its job's next run time. When the job
+fires, it only has to save the draft. Reminder jobs are PeriodicTasks, nudge jobs are ScheduledEvents
+(see Nudgie/scheduling/events.py).
+
+A draft is only used if it is still current: the job's next run time and the prompt haven't changed,
+and no lines have been added to the user's conversation since it was drafted. Otherwise (or if there
+is no draft) the message is generated on demand, as before.
+"""
+
+from datetime import datetime, timedelta
+from typing import Iterator, NamedTuple, Optional
+
+from django.contrib.auth.models import User
+from django_celery_beat.models import PeriodicTask
+
+from Nudgie.chat.chatgpt import (
+    generate_and_send_message_to_user,
+    generate_message_for_user,
+    get_scheduled_message_prompt,
+    send_message_to_user,
+)
+from Nudgie.chat.dialogue import get_last_line_id
+from Nudgie.chat.instrumentation import llm_call_site
+from Nudgie.constants import (
+    NUDGE_HANDLER,
+    PREGENERATION_LEAD_MINUTES,
+    REMINDER_HANDLER,
+)
+from Nudgie.models import (
+    NudgieTask,
+    PregeneratedMessage,
+    ScheduledEvent,
+    ScheduledJobLink,
+)
+from Nudgie.scheduling.events import (
+    get_dispatch_clocks,
+    get_pending_events_q,
+    get_task_data_from_event,
+)
+from Nudgie.scheduling.periodic_task_helper import (
+    TaskData,
+    get_task_data_from_periodic_task,
+)
+
+
+def is_task_pending(task_data: TaskData) -> bool:
+    """
+    Whether the job's NudgieTask is still to be completed. Jobs scheduled before their payload had
+    the NudgieTask id fall back to looking it up by task name, user and due date.
+    """
+    if task_data.nudgie_task_id is not None:
+        return NudgieTask.objects.filter(
+            id=task_data.nudgie_task_id, completed=False
+        ).exists()
+
+    return NudgieTask.objects.filter(
+        task__name=task_data.task_name,
+        user_id=task_data.user_id,
+        due_date=datetime.fromisoformat(task_data.due_date),
+        completed=False,
+    ).exists()
+
+
+def is_draft_current(
+    draft: PregeneratedMessage, task_data: TaskData, prompt: str
+) -> bool:
+    return (
+        draft.fire_at == datetime.fromisoformat(task_data.next_run_time)
+        and draft.prompt == prompt
+        and draft.context_through_id == get_last_line_id(task_data.user_id)
+    )
+
+
+class ScheduledJob(NamedTuple):
+    """The job a draft belongs to: a reminder's PeriodicTask or a nudge's ScheduledEvent."""
+
+    periodic_task_id: Optional[int] = None
+    scheduled_event_id: Optional[int] = None
+
+    def get_draft_fields(self) -> dict:
+        return {field: id for field, id in self._asdict().items() if id is not None}
+
+    def __str__(self):
+        if self.periodic_task_id is not None:
+            return f"periodic task {self.periodic_task_id}"
+        return f"scheduled event {self.scheduled_event_id}"
+
+
+@llm_call_site
+def pregenerate_message(
+    job: ScheduledJob, task_data: TaskData, prompt: str
+) -> PregeneratedMessage:
+    """Drafts the message for a reminder or nudge job and stores it against the job."""
+    user = User.objects.get(id=task_data.user_id)
+    context_through_id = get_last_line_id(user.id)
+
+    return PregeneratedMessage.objects.create(
+        **job.get_draft_fields(),
+        user=user,
+        dialogue_type=task_data.dialogue_type,
+        fire_at=datetime.fromisoformat(task_data.next_run_time),
+        prompt=prompt,
+        content=generate_message_for_user(user, prompt, task_data.dialogue_type),
+        context_through_id=context_through_id,
+    )
+
+
+def get_upcoming_jobs(
+    lead_minutes: int,
+) -> Iterator[tuple[ScheduledJob, TaskData, Optional[PregeneratedMessage]]]:
+    """
+    The reminder and nudge jobs which fire within the next `lead_minutes`, along with their drafts
+    (if they have one).
+    """
+    job_user_ids = ScheduledJobLink.objects.values_list("user_id", flat=True)
+    for user_id, now in get_dispatch_clocks(job_user_ids):
+        periodic_tasks = PeriodicTask.objects.filter(
+            enabled=True,
+            task=REMINDER_HANDLER,
+            job_link__next_run_time__gte=now,
+            job_link__next_run_time__lte=now + timedelta(minutes=lead_minutes),
+        ).select_related("crontab", "pregenerated_message")
+        if user_id is not None:
+            periodic_tasks = periodic_tasks.filter(job_link__user_id=user_id)
+
+        for periodic_task in periodic_tasks:
+            yield (
+                ScheduledJob(periodic_task_id=periodic_task.id),
+                get_task_data_from_periodic_task(periodic_task),
+                getattr(periodic_task, "pregenerated_message", None),
+            )
+
+    for user_id, now in get_dispatch_clocks():
+        events = ScheduledEvent.objects.filter(
+            get_pending_events_q(now),
+            handler=NUDGE_HANDLER,
+            fire_at__gte=now,
+            fire_at__lte=now + timedelta(minutes=lead_minutes),
+        ).select_related("pregenerated_message")
+        if user_id is not None:
+            events = events.filter(user_id=user_id)
+
+        for event in events:
+            yield (
+                ScheduledJob(scheduled_event_id=event.id),
+                get_task_data_from_event(event),
+                getattr(event, "pregenerated_message", None),
+            )
+
+
+def pregenerate_upcoming_messages(
+    lead_minutes: int = PREGENERATION_LEAD_MINUTES,
+) -> int:
+    """
+    Drafts the messages for reminder and nudge jobs that fire within the next `lead_minutes`, and
+    discards drafts that are no longer current (regenerating them if their task is still pending).
+    Returns the number of drafts generated.
+    """
+    drafted = 0
+    for job, task_data, draft in get_upcoming_jobs(lead_minutes):
+        prompt = get_scheduled_message_prompt(task_data)
+        if draft is not None:
+            if is_draft_current(draft, task_data, prompt):
+                continue
+            print(f"discarding stale draft for {job}")
+            draft.delete()
+
+        if not is_task_pending(task_data):
+            continue
+
+        try:
+            pregenerate_message(job, task_data, prompt)
+        except Exception as error:
+            # the job will fall back to generating the message when it fires
+            print(f"failed to draft message for {job}: {error}")
+            continue
+        drafted += 1
+
+    return drafted
+
+
+def take_pregenerated_message(
+    job: ScheduledJob, task_data: TaskData, prompt: str
+) -> Optional[str]:
+    """
+    Removes the job's draft and returns its content if it is still current, otherwise returns None.
+    """
+    draft = PregeneratedMessage.objects.filter(**job.get_draft_fields()).first()
+    if draft is None:
+        return None
+
+    # a draft is used at most once; if a concurrent run of the job already took it, don't send it again
+    deleted, _ = PregeneratedMessage.objects.filter(id=draft.id).delete()
+    if not deleted or not is_draft_current(draft, task_data, prompt):
+        return None
+
+    return draft.content
+
+
+def send_scheduled_message(user: User, task_data: TaskData, job: ScheduledJob) -> None:
+    """
+    Sends the message for a reminder or nudge job, using its draft if there is a current one and
+    generating it on demand otherwise.
+    """
+    prompt = get_scheduled_message_prompt(task_data)
+    content = take_pregenerated_message(job, task_data, prompt)
+
+    if content is None:
+        print(f"no current draft for {job}, generating now")
+        generate_and_send_message_to_user(
+            user, prompt, task_data.dialogue_type, task_data.nudgie_task_id
+        )
+    else:
+        send_message_to_user(
+            user, prompt, content, task_data.dialogue_type, task_data.nudgie_task_id
+        )
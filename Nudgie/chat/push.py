@@ -0,0 +1,217 @@
+"""
+Pushes new conversation lines (and task list changes) to open browsers over server-sent events.
+Lines are written by the web process and by Celery workers alike, so the Conversation table doubles
+as the notification log: each web process runs a single hub thread which polls it for the users who
+have a browser connected, and fans each new line out to their streams. That's one query per poll
+interval per process, however many browsers are connected.
+
+Every stream has a cursor (the last line id it has, as well as its user's task list version), so a stream
+catches up on whatever was written between the page load and the stream opening, and the browser
+can ignore whatever it already has. Line ids are handed out in insert order but become visible in
+commit order, so a line can turn up after lines with higher ids. The cursor therefore only moves
+past a line once it has been visible for PUSH_LOOKBACK_SECONDS: the lines above the cursor are
+re-read on every poll, and each stream remembers which of them it has already been sent.
+"""
+
+import asyncio
+import json
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+from django.db import close_old_connections
+from django.template.loader import render_to_string
+
+from Nudgie.constants import (
+    CONVERSATION_FRAGMENT_CONVERSATION_FIELD,
+    CONVERSATION_FRAGMENT_TEMPLATE_NAME,
+    DIALOGUE_TYPE_SYSTEM_MESSAGE,
+    PUSH_LOOKBACK_SECONDS,
+    PUSH_POLL_SECONDS,
+    SSE_LINE_EVENT,
+    SSE_TASKS_EVENT,
+)
+from Nudgie.models import Conversation
+from Nudgie.scheduling.task_list import get_task_list_versions
+
+
+class PushEvent(NamedTuple):
+    name: str
+    data: dict
+
+    def to_sse(self) -> str:
+        return f"event: {self.name}\ndata: {json.dumps(self.data)}\n\n"
+
+
+def render_line_event(id: int, message_type: str, content: Optional[str]) -> PushEvent:
+    html = render_to_string(
+        CONVERSATION_FRAGMENT_TEMPLATE_NAME,
+        {
+            CONVERSATION_FRAGMENT_CONVERSATION_FIELD: [
+                {"id": id, "role": message_type, "content": content}
+            ]
+        },
+    )
+    return PushEvent(SSE_LINE_EVENT, {"id": id, "html": html})
+
+
+class Subscription:
+    """One browser's event stream. Events are handed over from the hub thread."""
+
+    def __init__(
+        self,
+        user_id: int,
+        last_line_id: int,
+        task_list_version: str,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ):
+        self.user_id = user_id
+        self.last_line_id = last_line_id
+        # the lines above last_line_id which have been delivered
+        self.delivered_line_ids = set()
+        self.task_list_version = task_list_version
+        # async streams wait on their event loop rather than tying up a thread each
+        self._loop = loop
+        self._queue = asyncio.Queue() if loop else queue.Queue()
+
+    def deliver(self, event: PushEvent) -> None:
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+        else:
+            self._queue.put(event)
+
+    def get(self, timeout: float) -> Optional[PushEvent]:
+        """Waits for the next event. Returns None if there was none within the timeout."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def aget(self, timeout: float) -> Optional[PushEvent]:
+        """Async version of get, for subscriptions created with a loop."""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class PushHub:
+    def __init__(
+        self,
+        poll_seconds: float = PUSH_POLL_SECONDS,
+        lookback_seconds: float = PUSH_LOOKBACK_SECONDS,
+    ):
+        self.poll_seconds = poll_seconds
+        self.lookback_seconds = lookback_seconds
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+        # when each line above the cursors was first read, by line id (only used by the hub thread)
+        self._first_seen = {}
+        self._thread = None
+
+    def subscribe(self, subscription: Subscription) -> Subscription:
+        with self._lock:
+            self._subscriptions[subscription.user_id].add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="push-hub", daemon=True
+                )
+                self._thread.start()
+
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def get_subscriber_count(self) -> int:
+        with self._lock:
+            return sum(
+                len(subscriptions) for subscriptions in self._subscriptions.values()
+            )
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.poll()
+            except Exception as error:
+                print(f"push hub poll failed: {error}")
+            finally:
+                close_old_connections()
+            time.sleep(self.poll_seconds)
+
+    def poll(self) -> None:
+        """Fans out the lines written and the task list changes made since the last poll."""
+        with self._lock:
+            subscriptions = {
+                user_id: set(user_subscriptions)
+                for user_id, user_subscriptions in self._subscriptions.items()
+            }
+
+        if not subscriptions:
+            return
+
+        since = min(
+            subscription.last_line_id
+            for user_subscriptions in subscriptions.values()
+            for subscription in user_subscriptions
+        )
+        lines = list(
+            Conversation.objects.filter(id__gt=since, user_id__in=subscriptions.keys())
+            .exclude(dialogue_type=DIALOGUE_TYPE_SYSTEM_MESSAGE)
+            .order_by("id")
+            .values_list("id", "user_id", "message_type", "content")
+        )
+        now = time.monotonic()
+        for id, user_id, message_type, content in lines:
+            self._first_seen.setdefault(id, now)
+            event = None
+            for subscription in subscriptions[user_id]:
+                if (
+                    id > subscription.last_line_id
+                    and id not in subscription.delivered_line_ids
+                ):
+                    event = event or render_line_event(id, message_type, content)
+                    subscription.deliver(event)
+                    subscription.delivered_line_ids.add(id)
+
+        # a line which has been visible for the lookback period is assumed to have no stragglers
+        # below it
+        settled_id = max(
+            (
+                id
+                for id, first_seen in self._first_seen.items()
+                if now - first_seen >= self.lookback_seconds
+            ),
+            default=None,
+        )
+        if settled_id is not None:
+            self._first_seen = {
+                id: first_seen
+                for id, first_seen in self._first_seen.items()
+                if id > settled_id
+            }
+
+        versions = get_task_list_versions(subscriptions.keys())
+        for user_id, user_subscriptions in subscriptions.items():
+            version = versions[user_id]
+            for subscription in user_subscriptions:
+                # every subscribed user's lines up to here were in the query
+                if settled_id is not None and settled_id > subscription.last_line_id:
+                    subscription.last_line_id = settled_id
+                    subscription.delivered_line_ids = {
+                        id for id in subscription.delivered_line_ids if id > settled_id
+                    }
+                if subscription.task_list_version != version:
+                    subscription.task_list_version = version
+                    subscription.deliver(
+                        PushEvent(SSE_TASKS_EVENT, {"version": version})
+                    )
+
+
+push_hub = PushHub()
@@ -0,0 +1,320 @@
+"""
+Scheduling layer for OpenAI calls, shared by the web and Celery worker processes. Every call:
+- waits for capacity in two token buckets (requests per minute and tokens per minute), which live in
+  the DB so that all processes draw from the same budget,
+- is retried with jittered exponential backoff on rate limits and transient errors, honoring the
+  Retry-After header when OpenAI sends one,
+- goes through a circuit breaker (also in the DB), which fails fast while the API is down instead of
+  letting every caller wait out its own retries.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import openai
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+
+from Nudgie.constants import (
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_RESET_SECONDS,
+    OPENAI_BACKOFF_BASE_SECONDS,
+    OPENAI_BACKOFF_MAX_SECONDS,
+    OPENAI_MAX_RETRIES,
+    OPENAI_RATE_LIMIT_MAX_SLEEP_SECONDS,
+    OPENAI_REQUESTS_PER_MINUTE,
+    OPENAI_TOKENS_PER_MINUTE,
+)
+from Nudgie.models import CircuitBreaker, RateLimitBucket
+
+T = TypeVar("T")
+
+REQUESTS_BUCKET = "openai_requests"
+TOKENS_BUCKET = "openai_tokens"
+OPENAI_CIRCUIT = "openai"
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class OpenAIUnavailableError(Exception):
+    """Raised without calling OpenAI while the circuit breaker is open."""
+
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "queue_depth": 0,
+    "peak_queue_depth": 0,
+    "calls": 0,
+    "throttled_calls": 0,
+    "retries": 0,
+    "failures": 0,
+    "fast_failures": 0,
+}
+_wait_times = deque(maxlen=1000)
+
+
+def _update_metrics(**increments) -> None:
+    with _metrics_lock:
+        for key, amount in increments.items():
+            _metrics[key] += amount
+        _metrics["peak_queue_depth"] = max(
+            _metrics["peak_queue_depth"], _metrics["queue_depth"]
+        )
+
+
+def get_scheduler_metrics() -> dict:
+    """
+    Returns this process's scheduler metrics: how many callers are currently waiting for rate limit
+    capacity (queue depth), and the distribution of the time callers spent waiting.
+    """
+    with _metrics_lock:
+        metrics = dict(_metrics)
+        wait_times = sorted(_wait_times)
+
+    def percentile(fraction: float) -> float:
+        if not wait_times:
+            return 0.0
+        return wait_times[min(len(wait_times) - 1, int(fraction * len(wait_times)))]
+
+    metrics["wait_seconds_p50"] = percentile(0.5)
+    metrics["wait_seconds_p95"] = percentile(0.95)
+    metrics["wait_seconds_max"] = wait_times[-1] if wait_times else 0.0
+    metrics["circuit_state"] = get_circuit_state()
+
+    return metrics
+
+
+def _refill(bucket: RateLimitBucket, capacity: float, now) -> float:
+    elapsed = (now - bucket.updated_at).total_seconds()
+    return min(capacity, bucket.tokens + elapsed * capacity / 60)
+
+
+def try_acquire(token_count: int) -> float:
+    """
+    Takes one request and `token_count` tokens from the shared buckets if both have enough capacity.
+    Returns 0 if the capacity was taken, otherwise how many seconds to wait before trying again
+    (in which case nothing is taken).
+    """
+    now = timezone.now()
+    limits = {
+        REQUESTS_BUCKET: (OPENAI_REQUESTS_PER_MINUTE, 1),
+        # a request bigger than the whole budget would otherwise wait forever
+        TOKENS_BUCKET: (
+            OPENAI_TOKENS_PER_MINUTE,
+            min(token_count, OPENAI_TOKENS_PER_MINUTE),
+        ),
+    }
+
+    with transaction.atomic():
+        for name, (capacity, _) in limits.items():
+            RateLimitBucket.objects.get_or_create(
+                name=name, defaults={"tokens": capacity, "updated_at": now}
+            )
+        buckets = {
+            bucket.name: bucket
+            for bucket in RateLimitBucket.objects.select_for_update().filter(
+                name__in=limits.keys()
+            )
+        }
+
+        wait_seconds = 0.0
+        available = {}
+        for name, (capacity, amount) in limits.items():
+            available[name] = _refill(buckets[name], capacity, now)
+            if available[name] < amount:
+                wait_seconds = max(
+                    wait_seconds, (amount - available[name]) * 60 / capacity
+                )
+
+        if wait_seconds == 0:
+            for name, (_, amount) in limits.items():
+                available[name] -= amount
+
+        for name, bucket in buckets.items():
+            bucket.tokens = available[name]
+            bucket.updated_at = now
+            bucket.save(update_fields=["tokens", "updated_at"])
+
+    return wait_seconds
+
+
+def get_circuit_state() -> str:
+    breaker = CircuitBreaker.objects.filter(name=OPENAI_CIRCUIT).first()
+    return breaker.state if breaker else CIRCUIT_CLOSED
+
+
+def check_circuit() -> None:
+    """
+    Raises OpenAIUnavailableError if the circuit is open. Once the reset timeout has passed, a single
+    caller is let through (half-open) to test whether the API has recovered.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        breaker, _ = CircuitBreaker.objects.select_for_update().get_or_create(
+            name=OPENAI_CIRCUIT
+        )
+        if breaker.state == CIRCUIT_CLOSED:
+            return
+
+        reset_at = breaker.opened_at + timedelta(seconds=CIRCUIT_BREAKER_RESET_SECONDS)
+        if breaker.state == CIRCUIT_OPEN and now >= reset_at:
+            breaker.state = CIRCUIT_HALF_OPEN
+            breaker.opened_at = now
+            breaker.save(update_fields=["state", "opened_at"])
+            return
+
+        # a half-open trial which never reported back shouldn't keep the circuit stuck
+        if breaker.state == CIRCUIT_HALF_OPEN and now >= reset_at:
+            breaker.opened_at = now
+            breaker.save(update_fields=["opened_at"])
+            return
+
+    _update_metrics(fast_failures=1)
+    raise OpenAIUnavailableError(
+        f"OpenAI circuit is {breaker.state}, failing fast until {reset_at.isoformat()}"
+    )
+
+
+def record_success() -> None:
+    CircuitBreaker.objects.filter(name=OPENAI_CIRCUIT).exclude(
+        state=CIRCUIT_CLOSED, failure_count=0
+    ).update(state=CIRCUIT_CLOSED, failure_count=0)
+
+
+def record_failure() -> None:
+    now = timezone.now()
+    with transaction.atomic():
+        breaker, _ = CircuitBreaker.objects.select_for_update().get_or_create(
+            name=OPENAI_CIRCUIT
+        )
+        breaker.failure_count += 1
+        if (
+            breaker.state == CIRCUIT_HALF_OPEN
+            or breaker.failure_count >= CIRCUIT_BREAKER_FAILURE_THRESHOLD
+        ):
+            if breaker.state != CIRCUIT_OPEN:
+                print(f"OpenAI circuit opened after {breaker.failure_count} failures")
+            breaker.state = CIRCUIT_OPEN
+            breaker.opened_at = now
+        breaker.save()
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def get_retry_delay(error: Exception, attempt: int) -> float:
+    """
+    Full-jitter exponential backoff. If OpenAI sent a Retry-After header, it is used as the minimum
+    delay.
+    """
+    delay = random.uniform(
+        0, min(OPENAI_BACKOFF_MAX_SECONDS, OPENAI_BACKOFF_BASE_SECONDS * 2**attempt)
+    )
+
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after is not None:
+        try:
+            delay = max(delay, min(float(retry_after), OPENAI_BACKOFF_MAX_SECONDS))
+        except ValueError:
+            pass
+
+    return delay
+
+
+def _get_throttle_delay(token_count: int) -> Optional[float]:
+    wait_seconds = try_acquire(token_count)
+    if wait_seconds == 0:
+        return None
+    return min(wait_seconds, OPENAI_RATE_LIMIT_MAX_SLEEP_SECONDS) + random.uniform(
+        0, 0.1
+    )
+
+
+def _record_wait(wait_seconds: float, throttled: bool) -> None:
+    with _metrics_lock:
+        _wait_times.append(wait_seconds)
+    _update_metrics(calls=1, throttled_calls=int(throttled))
+
+
+def schedule_openai_call(call: Callable[[], T], token_count: int) -> T:
+    """Runs an OpenAI call under the shared rate limits, retry policy and circuit breaker."""
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        check_circuit()
+
+        _update_metrics(queue_depth=1)
+        wait_start = time.monotonic()
+        throttled = False
+        try:
+            while (delay := _get_throttle_delay(token_count)) is not None:
+                throttled = True
+                time.sleep(delay)
+        finally:
+            _update_metrics(queue_depth=-1)
+        _record_wait(time.monotonic() - wait_start, throttled)
+
+        try:
+            result = call()
+        except Exception as error:
+            if not is_retryable(error):
+                raise
+            record_failure()
+            if attempt == OPENAI_MAX_RETRIES:
+                _update_metrics(failures=1)
+                raise
+            delay = get_retry_delay(error, attempt)
+            print(f"OpenAI call failed ({error}), retrying in {delay:.1f}s")
+            _update_metrics(retries=1)
+            time.sleep(delay)
+        else:
+            record_success()
+            return result
+
+
+async def aschedule_openai_call(
+    call: Callable[[], Awaitable[T]], token_count: int
+) -> T:
+    """Async version of schedule_openai_call."""
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        await sync_to_async(check_circuit)()
+
+        _update_metrics(queue_depth=1)
+        wait_start = time.monotonic()
+        throttled = False
+        try:
+            while (
+                delay := await sync_to_async(_get_throttle_delay)(token_count)
+            ) is not None:
+                throttled = True
+                await asyncio.sleep(delay)
+        finally:
+            _update_metrics(queue_depth=-1)
+        _record_wait(time.monotonic() - wait_start, throttled)
+
+        try:
+            result = await call()
+        except Exception as error:
+            if not is_retryable(error):
+                raise
+            await sync_to_async(record_failure)()
+            if attempt == OPENAI_MAX_RETRIES:
+                _update_metrics(failures=1)
+                raise
+            delay = get_retry_delay(error, attempt)
+            print(f"OpenAI call failed ({error}), retrying in {delay:.1f}s")
+            _update_metrics(retries=1)
+            await asyncio.sleep(delay)
+        else:
+            await sync_to_async(record_success)()
+            return result
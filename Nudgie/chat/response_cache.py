@@ -0,0 +1,270 @@
+"""
+Two-tier cache for OpenAI API responses. Requests are keyed by a fixed-length digest of the
+serialized request, so lookups hit an indexed column instead of comparing whole message lists.
+A bounded in-process LRU tier sits in front of the DB tier (CachedApiResponse).
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional
+
+from django.db import IntegrityError
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from Nudgie.constants import (
+    OPENAI_CACHE_DB_EVICTION_CHECK_INTERVAL,
+    OPENAI_CACHE_DB_MAX_BYTES,
+    OPENAI_CACHE_DB_MAX_ENTRIES,
+    OPENAI_CACHE_MEMORY_MAX_BYTES,
+    OPENAI_CACHE_MEMORY_MAX_ENTRIES,
+    OPENAI_CACHE_TTL_SECONDS,
+)
+from Nudgie.models import CachedApiResponse
+
+logger = logging.getLogger(__name__)
+
+CACHE_STAT_MEMORY_HITS = "memory_hits"
+CACHE_STAT_DB_HITS = "db_hits"
+CACHE_STAT_MISSES = "misses"
+CACHE_STAT_EXPIRED = "expired"
+CACHE_STAT_MEMORY_EVICTIONS = "memory_evictions"
+CACHE_STAT_DB_EVICTIONS = "db_evictions"
+
+CACHE_TIER_MEMORY = "memory"
+CACHE_TIER_DB = "db"
+
+
+class LruCache:
+    """
+    Thread-safe in-process LRU cache bounded by both entry count and total size in bytes.
+    Values are stored as JSON strings so that every read hands back a fresh copy.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value_json, expires_at)
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value_json, expires_at = entry
+            if expires_at is not None and expires_at <= timezone.now():
+                self._remove(key)
+                _increment_stat(CACHE_STAT_EXPIRED)
+                return None
+
+            self._entries.move_to_end(key)
+            return value_json
+
+    def put(self, key: str, value_json: str, expires_at=None) -> None:
+        if len(value_json) > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value_json, expires_at)
+            self._size_bytes += len(value_json)
+
+            while (
+                len(self._entries) > self.max_entries
+                or self._size_bytes > self.max_bytes
+            ):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                _increment_stat(CACHE_STAT_MEMORY_EVICTIONS)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key: str) -> None:
+        value_json, _ = self._entries.pop(key)
+        self._size_bytes -= len(value_json)
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    CACHE_STAT_MEMORY_HITS: 0,
+    CACHE_STAT_DB_HITS: 0,
+    CACHE_STAT_MISSES: 0,
+    CACHE_STAT_EXPIRED: 0,
+    CACHE_STAT_MEMORY_EVICTIONS: 0,
+    CACHE_STAT_DB_EVICTIONS: 0,
+}
+_writes_since_eviction_check = 0
+
+_memory_tier = LruCache(OPENAI_CACHE_MEMORY_MAX_ENTRIES, OPENAI_CACHE_MEMORY_MAX_BYTES)
+
+
+def _increment_stat(stat: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[stat] += amount
+
+
+def get_cache_stats() -> dict:
+    """Returns a snapshot of the hit/miss/eviction counters for this process."""
+    with _stats_lock:
+        stats = dict(_stats)
+
+    lookups = (
+        stats[CACHE_STAT_MEMORY_HITS]
+        + stats[CACHE_STAT_DB_HITS]
+        + stats[CACHE_STAT_MISSES]
+    )
+    stats["lookups"] = lookups
+    stats["hit_rate"] = (
+        (stats[CACHE_STAT_MEMORY_HITS] + stats[CACHE_STAT_DB_HITS]) / lookups
+        if lookups
+        else 0.0
+    )
+    stats["memory_entries"] = len(_memory_tier)
+
+    return stats
+
+
+def get_request_hash(args: dict) -> str:
+    """
+    Computes the cache key for a request: a SHA-256 digest of the request serialized with
+    sorted keys, so that logically identical requests always map to the same key.
+    """
+    args_json = json.dumps(args, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(args_json.encode("utf-8")).hexdigest()
+
+
+def get_cached_response(request_hash: str) -> (Optional[dict], Optional[str]):
+    """
+    Looks up a response in the memory tier, then the DB tier. Returns the response data along
+    with the tier it was found in, or (None, None) on a miss.
+    """
+    response_json = _memory_tier.get(request_hash)
+    if response_json is not None:
+        _increment_stat(CACHE_STAT_MEMORY_HITS)
+        return json.loads(response_json), CACHE_TIER_MEMORY
+
+    now = timezone.now()
+    cached_response = (
+        CachedApiResponse.objects.filter(request_hash=request_hash)
+        .only("id", "response", "expires_at")
+        .first()
+    )
+
+    if cached_response is None:
+        _increment_stat(CACHE_STAT_MISSES)
+        return None, None
+
+    if cached_response.expires_at is not None and cached_response.expires_at <= now:
+        CachedApiResponse.objects.filter(id=cached_response.id).delete()
+        _increment_stat(CACHE_STAT_EXPIRED)
+        _increment_stat(CACHE_STAT_MISSES)
+        return None, None
+
+    CachedApiResponse.objects.filter(id=cached_response.id).update(last_accessed=now)
+    _memory_tier.put(
+        request_hash, json.dumps(cached_response.response), cached_response.expires_at
+    )
+    _increment_stat(CACHE_STAT_DB_HITS)
+
+    return cached_response.response, CACHE_TIER_DB
+
+
+def cache_response(
+    request_hash: str, response_data: dict, ttl_seconds: Optional[int] = None
+) -> None:
+    """Stores a response in both tiers, evicting from the DB tier if it has grown too large."""
+    global _writes_since_eviction_check
+
+    ttl_seconds = OPENAI_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=ttl_seconds) if ttl_seconds else None
+    response_json = json.dumps(response_data)
+
+    fields = {
+        "response": response_data,
+        "size_bytes": len(response_json),
+        "last_accessed": now,
+        "expires_at": expires_at,
+    }
+    try:
+        CachedApiResponse.objects.update_or_create(
+            request_hash=request_hash, defaults=fields
+        )
+    except IntegrityError:
+        # cached concurrently by an identical request
+        CachedApiResponse.objects.filter(request_hash=request_hash).update(**fields)
+    _memory_tier.put(request_hash, response_json, expires_at)
+
+    with _stats_lock:
+        _writes_since_eviction_check += 1
+        should_check = (
+            _writes_since_eviction_check >= OPENAI_CACHE_DB_EVICTION_CHECK_INTERVAL
+        )
+        if should_check:
+            _writes_since_eviction_check = 0
+
+    if should_check:
+        evict_db_entries()
+
+
+def evict_db_entries() -> int:
+    """
+    Deletes expired rows, then evicts the least recently accessed rows until the DB tier is
+    within its entry and size limits. Returns the number of rows evicted.
+    """
+    expired_count, _ = CachedApiResponse.objects.filter(
+        expires_at__lte=timezone.now()
+    ).delete()
+
+    totals = CachedApiResponse.objects.aggregate(
+        entries=Count("id"), size_bytes=Sum("size_bytes")
+    )
+    excess_entries = max(0, totals["entries"] - OPENAI_CACHE_DB_MAX_ENTRIES)
+    excess_bytes = max(0, (totals["size_bytes"] or 0) - OPENAI_CACHE_DB_MAX_BYTES)
+
+    evicted_ids = []
+    if excess_entries or excess_bytes:
+        freed_bytes = 0
+        for entry_id, size_bytes in (
+            CachedApiResponse.objects.order_by("last_accessed")
+            .values_list("id", "size_bytes")
+            .iterator()
+        ):
+            if len(evicted_ids) >= excess_entries and freed_bytes >= excess_bytes:
+                break
+            evicted_ids.append(entry_id)
+            freed_bytes += size_bytes
+
+        CachedApiResponse.objects.filter(id__in=evicted_ids).delete()
+
+    _increment_stat(CACHE_STAT_EXPIRED, expired_count)
+    _increment_stat(CACHE_STAT_DB_EVICTIONS, len(evicted_ids))
+
+    if expired_count or evicted_ids:
+        logger.info(
+            f"OpenAI response cache: removed {expired_count} expired and evicted"
+            f" {len(evicted_ids)} least recently used entries"
+        )
+
+    return expired_count + len(evicted_ids)
+
+
+def clear_response_cache() -> None:
+    """Clears both cache tiers."""
+    _memory_tier.clear()
+    CachedApiResponse.objects.all().delete()
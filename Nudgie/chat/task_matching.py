@@ -0,0 +1,192 @@
+"""
+Local task identification. When the user says they completed a task and more than one task is
+pending, the pending tasks are scored using signals that are already at hand:
+- whether the user's message mentions a word from the task's name,
+- whether the user was just reminded or nudged about the task,
+- how soon the task is due.
+A clear winner is picked without calling OpenAI. Only ambiguous cases are escalated to the LLM.
+"""
+
+import re
+import threading
+from collections import deque
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from django.contrib.auth.models import User
+
+from Nudgie.constants import (
+    DIALOGUE_TYPE_DEADLINE,
+    DIALOGUE_TYPE_NUDGE,
+    DIALOGUE_TYPE_REMINDER,
+    TASK_MATCH_DUE_WEIGHT,
+    TASK_MATCH_MIN_MARGIN,
+    TASK_MATCH_MIN_SCORE,
+    TASK_MATCH_NAME_WEIGHT,
+    TASK_MATCH_PROMPTED_WEIGHT,
+    TASK_MATCH_RECENT_LINES,
+)
+from Nudgie.models import Conversation, NudgieTask
+
+# the lines the scheduler sends. Reminders and nudges are saved with the NudgieTask they're about.
+SCHEDULED_DIALOGUE_TYPES = [
+    DIALOGUE_TYPE_REMINDER,
+    DIALOGUE_TYPE_NUDGE,
+    DIALOGUE_TYPE_DEADLINE,
+]
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+MIN_WORD_LENGTH = 3
+
+# the paths a task completion can take
+PATH_FUNCTION_CALL = "function_call"  # the AI picked the task itself (single call mode)
+PATH_NO_TASKS = "no_tasks"
+PATH_SINGLE_TASK = "single_task"
+PATH_LOCAL = "local"
+PATH_LLM = "llm"
+
+_stats_lock = threading.Lock()
+_path_counts = {
+    PATH_FUNCTION_CALL: 0,
+    PATH_NO_TASKS: 0,
+    PATH_SINGLE_TASK: 0,
+    PATH_LOCAL: 0,
+    PATH_LLM: 0,
+}
+_llm_seconds = deque(maxlen=1000)
+
+
+class TaskScore(NamedTuple):
+    task: NudgieTask
+    score: float
+    reasoning: str
+
+
+def stem(word: str) -> str:
+    """Very rough stemming, so that e.g. 'cooked' and 'cooking' match."""
+    for suffix in ("ing", "ed", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_WORD_LENGTH:
+            return word[: -len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> set[str]:
+    return {
+        stem(word)
+        for word in WORD_PATTERN.findall(text.lower())
+        if len(word) >= MIN_WORD_LENGTH
+    }
+
+
+def words_match(task_word: str, message_words: set[str]) -> bool:
+    return any(
+        word.startswith(task_word) or task_word.startswith(word)
+        for word in message_words
+    )
+
+
+def get_recently_prompted_task_id(user: User) -> Optional[int]:
+    """
+    Returns the id of the NudgieTask the user was just reminded or nudged about: that of the most
+    recent line the scheduler sent, if it is among their most recent lines. None if that line isn't
+    tied to a task (a deadline, or a line from before lines were).
+    """
+    recent_lines = (
+        Conversation.objects.filter(user=user)
+        .order_by("-id")
+        .values_list("dialogue_type", "nudgie_task_id")[:TASK_MATCH_RECENT_LINES]
+    )
+    return next(
+        (
+            nudgie_task_id
+            for dialogue_type, nudgie_task_id in recent_lines
+            if dialogue_type in SCHEDULED_DIALOGUE_TYPES
+        ),
+        None,
+    )
+
+
+def score_tasks(
+    tasks: list[NudgieTask],
+    message: str,
+    prompted_task_id: Optional[int],
+    now: datetime,
+) -> list[TaskScore]:
+    """Scores the pending tasks against the user's message, best match first."""
+    message_words = tokenize(message)
+    task_words = {task.id: tokenize(task.task.name) for task in tasks}
+    # words shared by every pending task's name (e.g. 'practice') don't tell them apart
+    shared_words = set.intersection(*task_words.values()) if task_words else set()
+
+    scores = []
+    for task in tasks:
+        distinctive_words = task_words[task.id] - shared_words
+        mentioned = any(words_match(word, message_words) for word in distinctive_words)
+        prompted = prompted_task_id is not None and task.id == prompted_task_id
+        hours_until_due = max(0.0, (task.due_date - now).total_seconds() / 3600)
+        due_soon = 1 / (1 + hours_until_due / 24)
+
+        scores.append(
+            TaskScore(
+                task=task,
+                score=TASK_MATCH_NAME_WEIGHT * mentioned
+                + TASK_MATCH_PROMPTED_WEIGHT * prompted
+                + TASK_MATCH_DUE_WEIGHT * due_soon,
+                reasoning=f"{task.task.name}: mentioned={mentioned}, recently prompted={prompted},"
+                f" due in {hours_until_due:.1f}h",
+            )
+        )
+
+    return sorted(scores, key=lambda task_score: task_score.score, reverse=True)
+
+
+def match_task_locally(
+    tasks: list[NudgieTask], message: str, user: User, now: datetime
+) -> (Optional[NudgieTask], str):
+    """
+    Returns the task the message refers to and the reasoning behind the choice, or (None, reasoning)
+    if the scores aren't decisive and the LLM should decide.
+    """
+    scores = score_tasks(tasks, message, get_recently_prompted_task_id(user), now)
+    best, runner_up = scores[0], scores[1]
+    reasoning = "; ".join(
+        f"{task_score.reasoning} -> {task_score.score:.2f}" for task_score in scores
+    )
+
+    if (
+        best.score >= TASK_MATCH_MIN_SCORE
+        and best.score - runner_up.score >= TASK_MATCH_MIN_MARGIN
+    ):
+        return best.task, reasoning
+    return None, reasoning
+
+
+def record_identification_path(path: str, llm_seconds: Optional[float] = None) -> None:
+    with _stats_lock:
+        _path_counts[path] += 1
+        if llm_seconds is not None:
+            _llm_seconds.append(llm_seconds)
+
+
+def get_task_identification_stats() -> dict:
+    """
+    Returns how often each identification path was taken in this process, and an estimate of the
+    time saved by not calling the LLM (the average LLM identification time, per avoided call).
+    """
+    with _stats_lock:
+        stats = dict(_path_counts)
+        llm_seconds = list(_llm_seconds)
+
+    average_llm_seconds = sum(llm_seconds) / len(llm_seconds) if llm_seconds else None
+    calls_avoided = (
+        stats[PATH_FUNCTION_CALL] + stats[PATH_SINGLE_TASK] + stats[PATH_LOCAL]
+    )
+    identifications = sum(stats.values())
+
+    stats["identifications"] = identifications
+    stats["llm_rate"] = stats[PATH_LLM] / identifications if identifications else 0.0
+    stats["average_llm_seconds"] = average_llm_seconds
+    stats["estimated_seconds_saved"] = (
+        calls_avoided * average_llm_seconds if average_llm_seconds is not None else None
+    )
+
+    return stats
@@ -138,7 +138,19 @@ ONGOING_CONVO_FUNCTIONS = [
                 "reasoning": {
                     "type": "string",
                     "description": "why you decided to call this method",
-                }
+                },
+                "nudgie_task_id": {
+                    "type": "integer",
+                    "description": "id of the completed task, from the [PENDING TASKS] list",
+                },
+                "certainty_score": {
+                    "type": "number",
+                    "description": "0-1, how certain you are that nudgie_task_id is the right task",
+                },
+                "reply": {
+                    "type": "string",
+                    "description": "your response to the user, shown once the task is marked as completed",
+                },
             },
         },
     }
@@ -257,7 +269,19 @@ fields: 'certainty_score' (a score from 0-1 of how certain you are that you have
 If the certainty_score is less than 1, make sure to mention which tasks you think are possibly the one referred to by the user (if the certainty
 score isn't 1 than there are likely multiple possible tasks).
 You are only to reply with the JSON object and no additional text - your reply will be parsed by the program and will
-not be displayed to the user. Here is the list of pending tasks which you are to use for your task identification: {PENDING_TASKS}"""
+not be displayed to the user. Here is the list of pending tasks which you are to use for your task identification, one per line:
+{PENDING_TASKS}"""
+
+TURN_INTERRUPTED_FRAGMENT = """[TURN INTERRUPTED] Something went wrong while responding to the user's last message, so the
+exchange above is incomplete and the user never got a reply to it."""
+
+PENDING_TASKS_FRAGMENT = """[PENDING TASKS] If the user indicates that he has completed a task, when you call the complete_task
+function, also fill in 'nudgie_task_id' with the id of the task the user completed (from the list below), 'certainty_score' with how
+certain you are of it (from 0 to 1), and 'reply' with your response to the user (congratulate him on completing the task, in an
+encouraging tone, and let him know that it has been marked as completed). Only give a certainty_score of 1 if you are sure which
+task it is. If you aren't, you will be asked to identify the task in a follow-up message prefixed with [TASK IDENTIFICATION].
+These are the user's pending tasks, one per line:
+{PENDING_TASKS}"""
 
 SUCCESSFUL_TASK_IDENTIFICATION_PROMPT = """[SUCCESS_TASK_MARK] You have successfully identified the task the user was referring to,
 and have marked it as completed. You are to write a brief response to the user now, congratulating him on completing the task and having
@@ -282,3 +306,39 @@ the user's ability to complete future goals.
 PERFORMANCE_DATA_TEMPLATE_FOR_ONE_TASK = """For the task {task_name}, the user completed {num_completed} out of {num_total} tasks,
  for a completion rate of {completion_rate}.
 """
+
+CONVERSATION_SUMMARY_FRAGMENT = """[CONVERSATION SUMMARY] The earlier part of your conversation with the user has been condensed
+into the summary below. Treat it as if you remembered that part of the conversation yourself.
+
+{summary}
+"""
+
+CONVERSATION_SUMMARY_PROMPT = """You are maintaining a running summary of a conversation between a user and Nudgie, an AI
+accountability buddy. Below is the existing summary (which may be empty) followed by the next part of the transcript. Write an
+updated summary which merges the two. Keep every detail that could matter later: the user's goals, tasks and schedules, which
+tasks were completed or missed, anything the user said about his personality, motivation or circumstances, and any open
+questions. Leave out greetings and small talk. Reply with only the summary.
+
+EXISTING SUMMARY:
+{previous_summary}
+
+TRANSCRIPT:
+{transcript}
+"""
+
+# what an internal prompt was for, by tag, for prompts which are condensed to their tag in the history
+CONDENSED_PROMPT_DESCRIPTIONS = {
+    "[REMINDER]": "you were prompted to remind the user to perform a scheduled task",
+    "[NUDGE]": "you were prompted to nudge the user to perform the task he was last reminded of",
+    "[DEADLINE]": "you were prompted to tell the user that he missed the deadline for a task",
+    "[TASK IDENTIFICATION]": "you were asked to identify which pending task the user completed",
+    "[TASK_CLARIFICATION]": "you were asked to get the user to clarify which task he completed",
+    "[SUCCESS_TASK_MARK]": "the task the user completed was marked as completed",
+    "[GOAL COMPLETION]": "you were prompted to congratulate the user on completing his goal",
+    "[TURN INTERRUPTED]": "your reply to the user's previous message was interrupted",
+}
+
+CONDENSED_PROMPT_FRAGMENT = """{tag} (condensed internal message from the application, invisible to the user: \
+{description})"""
+
+CONDENSED_PROMPT_DEFAULT_DESCRIPTION = "it prompted the reply which follows"
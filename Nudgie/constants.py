@@ -1,6 +1,7 @@
 QUEUE_NAME = "nudgie"
 
 CHAT_GPT_MODEL = "gpt-4"
+CHAT_GPT_FAST_MODEL = "gpt-3.5-turbo"
 
 DIALOGUE_TYPE_REMINDER = "reminder"
 DIALOGUE_TYPE_NUDGE = "nudge"
@@ -9,11 +10,19 @@ DIALOGUE_TYPE_GOAL_END = "goal_end"
 DIALOGUE_TYPE_USER_INPUT = "user_input"
 DIALOGUE_TYPE_SYSTEM_MESSAGE = "system_message"
 DIALOGUE_TYPE_AI_STANDARD = "ai_standard"
+# These are only used to label OpenAI calls (they are never saved on a Conversation line).
+DIALOGUE_TYPE_GOAL_SETUP = "goal_setup"
+DIALOGUE_TYPE_TASK_IDENTIFICATION = "task_identification"
+DIALOGUE_TYPE_SUMMARY = "summary"
 
 NUDGE_HANDLER = "Nudgie.tasks.handle_nudge"
 REMINDER_HANDLER = "Nudgie.tasks.handle_reminder"
 DEADLINE_HANDLER = "Nudgie.tasks.deadline_handler"
 GOAL_END_HANDLER = "Nudgie.tasks.goal_end_handler"
+PREGENERATION_HANDLER = "Nudgie.tasks.pregenerate_messages"
+ARCHIVE_HANDLER = "Nudgie.tasks.archive_conversation_history"
+DISPATCH_HANDLER = "Nudgie.tasks.dispatch_scheduled_events"
+SCHEDULE_GC_HANDLER = "Nudgie.tasks.collect_schedule_garbage"
 
 # ChatGPT notification scheduling object keys
 REMINDER_DATA_AI_STRUCT_KEY = "reminder_data"
@@ -32,6 +41,41 @@ PENDING_TASKS_KEY = "PENDING_TASKS"
 MAX_NUDGES_PER_REMINDER = 2
 MIN_MINUTES_BETWEEN_NUDGES = 60  # minutes
 MIN_TIME_BETWEEN_LAST_NUDGE_AND_DUE_DATE = 60  # minutes
+# reminders and nudges are drafted up to this long before they fire (see Nudgie/chat/pregeneration.py)
+PREGENERATION_LEAD_MINUTES = 10
+# how often the beat task looks for messages to draft
+PREGENERATION_INTERVAL_SECONDS = 60
+# One-off jobs (nudges, deadlines, goal ends) are fired by a dispatcher which runs this often
+# (see Nudgie/scheduling/events.py)
+SCHEDULED_EVENT_DISPATCH_INTERVAL_SECONDS = 5
+SCHEDULED_EVENT_BATCH_SIZE = 200  # events claimed per transaction
+SCHEDULED_EVENT_MAX_BATCHES_PER_RUN = 50
+# a claimed event which still hasn't been handled after this long is dispatched again
+SCHEDULED_EVENT_CLAIM_TIMEOUT_SECONDS = 600
+# a handler which started on an event this long ago without finishing (e.g. its worker died) is taken
+# to have failed. Well over what a handler takes, OpenAI retries and backoff included.
+SCHEDULED_EVENT_RUN_TIMEOUT_SECONDS = 3600
+# an event whose handler has failed this many times isn't dispatched again, and is kept (with
+# failed_at set) for inspection
+SCHEDULED_EVENT_MAX_ATTEMPTS = 3
+# Delivery modes (settings.SCHEDULED_EVENT_DELIVERY). The dispatcher mode enqueues events when
+# they're due. In ETA mode they're enqueued up to SCHEDULED_EVENT_ETA_HORIZON_SECONDS early, with an
+# ETA, so they fire on time rather than on the dispatcher's next run. The horizon is kept well under
+# RabbitMQ's consumer_timeout (30 minutes by default), since workers hold ETA messages unacked.
+SCHEDULED_EVENT_DELIVERY_DISPATCHER = "dispatcher"
+SCHEDULED_EVENT_DELIVERY_ETA = "eta"
+SCHEDULED_EVENT_ETA_HORIZON_SECONDS = 900
+# Archival of finished goals' transcripts (see Nudgie/chat/archive.py)
+ARCHIVE_INTERVAL_SECONDS = 600
+ARCHIVE_BATCH_LINES = 500  # lines per chunk (and per transaction)
+ARCHIVE_MAX_BATCHES_PER_RUN = 20
+# Garbage collection of fired one-off PeriodicTasks and orphaned crontabs (see
+# Nudgie/scheduling/crontabs.py)
+SCHEDULE_GC_INTERVAL_SECONDS = 3600
+SCHEDULE_GC_BATCH_SIZE = 500  # rows deleted per transaction
+SCHEDULE_GC_MAX_BATCHES_PER_RUN = 20
+# a crontab handed out this recently isn't collected, even if nothing uses it yet
+SCHEDULE_GC_GRACE_SECONDS = 3600
 
 # ChatGPT constants
 CHATGPT_FUNCTION_CALL_KEY = "function_call"
@@ -59,30 +103,124 @@ GOAL_END_DATE_FIELD = "goal_end_date"
 OPENAI_MODEL_FIELD = "model"
 OPENAI_MESSAGE_FIELD = "messages"
 OPENAI_FUNCTIONS_FIELD = "functions"
+OPENAI_MAX_TOKENS_FIELD = "max_tokens"
+OPENAI_TEMPERATURE_FIELD = "temperature"
+
+# max concurrent connections to OpenAI from the async client (per process)
+OPENAI_ASYNC_MAX_CONNECTIONS = 1000
+
+# OpenAI call scheduling. See Nudgie/chat/rate_limit.py. The limits should match the account's tier.
+OPENAI_REQUESTS_PER_MINUTE = 500
+OPENAI_TOKENS_PER_MINUTE = 40000
+# tokens reserved for the completion when charging a request against the tokens-per-minute budget
+OPENAI_COMPLETION_TOKENS_RESERVE = 500
+# callers waiting for capacity re-check at least this often
+OPENAI_RATE_LIMIT_MAX_SLEEP_SECONDS = 5
+OPENAI_MAX_RETRIES = 5
+OPENAI_BACKOFF_BASE_SECONDS = 1
+OPENAI_BACKOFF_MAX_SECONDS = 60
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5  # consecutive failures before the circuit opens
+# how long the circuit stays open before a trial call
+CIRCUIT_BREAKER_RESET_SECONDS = 30
+
+# LLM call records (see Nudgie/chat/instrumentation.py) are written in batches of this size, or
+# sooner if the oldest buffered record is this old
+LLM_CALL_RECORD_BUFFER_SIZE = 50
+LLM_CALL_RECORD_FLUSH_SECONDS = 10
+
+# OpenAI response cache limits
+OPENAI_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60  # 0 means entries never expire
+OPENAI_CACHE_MEMORY_MAX_ENTRIES = 256
+OPENAI_CACHE_MEMORY_MAX_BYTES = 8 * 1024 * 1024
+OPENAI_CACHE_DB_MAX_ENTRIES = 10000
+OPENAI_CACHE_DB_MAX_BYTES = 200 * 1024 * 1024
+# how many DB cache writes happen between checks of the DB tier's size limits
+OPENAI_CACHE_DB_EVICTION_CHECK_INTERVAL = 50
+
+# Cache key policies. See Nudgie/chat/cache_keys.py.
+CACHE_POLICY_NEVER = "never"  # never cached
+CACHE_POLICY_EXACT = "exact"  # keyed on the exact request
+CACHE_POLICY_MINUTE = "minute"  # volatile time fragments truncated to the minute
+CACHE_POLICY_STRIP = "strip"  # volatile time fragments removed entirely
+CACHE_KEY_DEFAULT_POLICY = CACHE_POLICY_EXACT
+CACHE_KEY_POLICIES = {
+    DIALOGUE_TYPE_GOAL_SETUP: CACHE_POLICY_EXACT,
+    DIALOGUE_TYPE_AI_STANDARD: CACHE_POLICY_MINUTE,
+    DIALOGUE_TYPE_REMINDER: CACHE_POLICY_MINUTE,
+    DIALOGUE_TYPE_NUDGE: CACHE_POLICY_MINUTE,
+    DIALOGUE_TYPE_DEADLINE: CACHE_POLICY_MINUTE,
+    DIALOGUE_TYPE_GOAL_END: CACHE_POLICY_MINUTE,
+    # identification results depend on which tasks are pending, so they're never reused.
+    DIALOGUE_TYPE_TASK_IDENTIFICATION: CACHE_POLICY_NEVER,
+}
+
+# Model routing. See Nudgie/chat/model_routing.py. Routes are keyed by dialogue type, or by a
+# (dialogue type, call site) pair for a route that only applies to one calling function. Unset
+# fields fall back to the default route, and None leaves the OpenAI default in place.
+MODEL_ROUTE_DEFAULT = {"model": CHAT_GPT_MODEL, "max_tokens": None, "temperature": None}
+MODEL_ROUTES = {
+    # setting up a goal relies on accurate function calls, so it stays on the large model
+    DIALOGUE_TYPE_GOAL_SETUP: {"model": CHAT_GPT_MODEL, "max_tokens": 600},
+    DIALOGUE_TYPE_AI_STANDARD: {"model": CHAT_GPT_MODEL, "max_tokens": 400},
+    DIALOGUE_TYPE_REMINDER: {"model": CHAT_GPT_FAST_MODEL, "max_tokens": 150},
+    DIALOGUE_TYPE_NUDGE: {"model": CHAT_GPT_FAST_MODEL, "max_tokens": 150},
+    DIALOGUE_TYPE_DEADLINE: {"model": CHAT_GPT_FAST_MODEL, "max_tokens": 150},
+    DIALOGUE_TYPE_GOAL_END: {"model": CHAT_GPT_FAST_MODEL, "max_tokens": 300},
+    DIALOGUE_TYPE_TASK_IDENTIFICATION: {
+        "model": CHAT_GPT_FAST_MODEL,
+        "max_tokens": 200,
+        "temperature": 0,
+    },
+    DIALOGUE_TYPE_SUMMARY: {
+        "model": CHAT_GPT_FAST_MODEL,
+        "max_tokens": 400,
+        "temperature": 0,
+    },
+}
 
 CRONTAB_FIELDS = ["minute", "hour", "day_of_week"]
 
+# Conversation context window. See Nudgie/chat/context.py.
+CONTEXT_TOKEN_BUDGET = 4000  # max tokens of conversation history sent with each request
+CONTEXT_RECENT_TURNS = 20  # the most recent lines are always sent verbatim
+# once this many lines have fallen out of the recent window, they're folded into the rolling summary
+CONTEXT_SUMMARY_CHECKPOINT = 20
+# rough token estimate used for budgeting (OpenAI's tokenizer averages ~4 chars per token for English)
+CHARS_PER_TOKEN = 4
+TOKENS_PER_MESSAGE_OVERHEAD = 4
+
 # how many seconds to fast forward by when triggering a reminder for testing
 TEST_FAST_FORWARD_SECONDS = 5
 
 # Some of the periodic task fields (the ones which I need constants for right now)
 PERIODIC_TASK_NEXT_RUNTIME_FIELD = "next_run_time"
-PERIODIC_TASK_ID_FIELD = "periodic_task_id"
 PERIODIC_TASK_USER_ID = "user_id"
 PERIODIC_TASK_CRONTAB_FIELD = "crontab"
+PERIODIC_TASK_NUDGIE_TASK_ID_FIELD = "nudgie_task_id"
 
 # Constants for the testing tool
 CELERY_BACKEND_CLEANUP_TASK = "celery.backend_cleanup"
 
 CHATBOT_TEMPLATE_NAME = "chatbot.html"
-CHATBOT_CONVERSATION_FIELD = "conversation"
-CHATBOT_TEMPLATE_SERVER_TIME_FIELD = "server_time"
-CHATBOT_TEMPLATE_TASKS_FIELD = "tasks"
 CONVERSATION_FRAGMENT_TEMPLATE_NAME = "conversation_fragment.html"
 CONVERSATION_FRAGMENT_CONVERSATION_FIELD = "conversation"
+CONVERSATION_FRAGMENT_OLDER_BEFORE_FIELD = "older_before"
+CONVERSATION_HISTORY_BEFORE_PARAM = "before"
+CONVERSATION_HISTORY_AFTER_PARAM = "after"
+# lines of conversation per page of the chat window (older pages are loaded as the user scrolls up)
+CONVERSATION_PAGE_SIZE = 50
 TASKLIST_FRAGMENT_TEMPLATE_NAME = "task_list_fragment.html"
 TASKLIST_FRAGMENT_TASKS_FIELD = "tasks"
 TASKLIST_FRAGMENT_SERVER_TIME_FIELD = "server_time"
+TASKLIST_FRAGMENT_VERSION_FIELD = "version"
+TASKLIST_ITEM_TEMPLATE_NAME = "task_list_item.html"
+TASKLIST_ITEM_TASK_FIELD = "task"
+# task list items are keyed on this, as both PeriodicTasks and ScheduledEvents are listed
+TASKLIST_ITEM_KEY_FIELD = "key"
+TASKLIST_PERIODIC_TASK_KEY_PREFIX = "task-"
+TASKLIST_SCHEDULED_EVENT_KEY_PREFIX = "event-"
+TRIGGER_TASK_KEY_FIELD = "task_key"
+TASKLIST_VERSION_PARAM = "version"
 USER_INPUT_MESSAGE_FIELD = "message"
 SENDER_MESSAGE = "sender"
 SEND_TYPE_ASSISTANT = "assistant"
@@ -96,5 +234,38 @@ CHATBOT_URL_PATH = "/chatbot"
 TASK_IDENTIFICATION_CERTAINTY_SCORE = "certainty_score"
 TASK_IDENTIFICATION_REASONING = "reasoning"
 TASK_IDENTIFICATION_NUDGIE_TASK_ID = "nudgie_task_id"
+COMPLETE_TASK_REPLY_KEY = "reply"
+
+# Task completion modes (settings.TASK_COMPLETION_MODE). In single call mode the pending tasks are
+# sent with every request, so the AI can pick the task and reply to the user in its complete_task
+# call. Multi call mode identifies the task and generates the reply in separate calls, and is
+# also the fallback when the AI isn't certain.
+TASK_COMPLETION_MODE_SINGLE_CALL = "single_call"
+TASK_COMPLETION_MODE_MULTI_CALL = "multi_call"
+
+# Local task identification. See Nudgie/chat/task_matching.py. A pending task's score is the weighted
+# sum of three signals, each between 0 and 1.
+TASK_MATCH_NAME_WEIGHT = 0.5  # the message mentions a word of the task's name
+TASK_MATCH_PROMPTED_WEIGHT = 0.4  # the user was recently reminded/nudged about the task
+TASK_MATCH_DUE_WEIGHT = 0.1  # the task is due soon
+# the best task is only picked locally if it scores at least this much, and beats the runner-up by
+# the margin. Otherwise the LLM decides.
+TASK_MATCH_MIN_SCORE = 0.4
+TASK_MATCH_MIN_MARGIN = 0.25
+# a reminder or nudge only counts as recent if it is among the user's last N conversation lines
+TASK_MATCH_RECENT_LINES = 6
 
 POST = "POST"
+
+# Server-sent events
+SSE_CONTENT_TYPE = "text/event-stream"
+SSE_DONE_EVENT = "done"
+SSE_LINE_EVENT = "line"
+SSE_TASKS_EVENT = "tasks"
+# how often each web process checks for new lines to push to open browsers (see Nudgie/chat/push.py)
+PUSH_POLL_SECONDS = 1
+# ids are handed out before commit, so a line can become visible after lines with higher ids. The
+# hub keeps re-reading lines for this long after it first saw them, to pick up any such stragglers.
+PUSH_LOOKBACK_SECONDS = 30
+# idle event streams get a comment this often, which also detects closed connections
+PUSH_HEARTBEAT_SECONDS = 15
@@ -0,0 +1,451 @@
+"""
+A local stand-in for the OpenAI chat completions API, for load testing and benchmarks. It speaks
+enough of the wire format for the openai client (including function calls and streaming), and can
+be given a latency distribution, an error rate and scripted responses.
+
+Run it with `py manage.py run_openai_stub`, then point OPENAI_BASE_URL in settings.py at it.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, NamedTuple, Optional
+
+from Nudgie.constants import (
+    CHATGPT_ASSISTANT_ROLE,
+    CHATGPT_COMPLETE_TASK_FUNCTION,
+    CHATGPT_CONTENT_KEY,
+    CHATGPT_FUNCTION_ARGUMENTS_KEY,
+    CHATGPT_FUNCTION_CALL_KEY,
+    CHATGPT_FUNCTION_NAME_KEY,
+    CHATGPT_INITIAL_GOAL_SETUP,
+    CHATGPT_ROLE_KEY,
+    CHATGPT_USER_ROLE,
+    COMPLETE_TASK_REPLY_KEY,
+    OPENAI_FUNCTIONS_FIELD,
+    OPENAI_MESSAGE_FIELD,
+    OPENAI_MODEL_FIELD,
+    TASK_IDENTIFICATION_CERTAINTY_SCORE,
+    TASK_IDENTIFICATION_NUDGIE_TASK_ID,
+    TASK_IDENTIFICATION_REASONING,
+)
+
+CHAT_COMPLETIONS_PATH = "/v1/chat/completions"
+
+TASK_IDENTIFICATION_PREFIX = "[TASK IDENTIFICATION]"
+SKIP_CONFIRMATION_PREFIXES = ("NOCONF", "SKIPCONF")
+TASK_DONE_PATTERN = re.compile(r"\b(done|did it|finished|completed)\b", re.IGNORECASE)
+PENDING_TASK_ID_PATTERN = re.compile(r'"pk":\s*(\d+)')
+PENDING_TASKS_PREFIX = "[PENDING TASKS]"
+
+# The goal set up by the stub whenever the user skips confirmation. Mirrors the chatbot's
+# "Default Test" message (see chatbot.js).
+DEFAULT_GOAL_SETUP_ARGUMENTS = {
+    "goal_name": "learn_to_cook",
+    "goal_length_days": 30,
+    "schedules": [
+        {
+            "crontab": {"minute": "0", "hour": "17", "day_of_week": "1,3,5"},
+            "reminder_data": {
+                "task_name": "practice_cooking",
+                "reminder_notes": "- user is tired on mondays\n- user is busy with the kids on wednesdays",
+            },
+        },
+        {
+            "crontab": {"minute": "0", "hour": "7", "day_of_week": "1,3,5"},
+            "reminder_data": {
+                "task_name": "study_cooking_theory",
+                "reminder_notes": "",
+            },
+        },
+    ],
+}
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """
+    Parses a latency distribution, in seconds. Supported forms: 'fixed:S', 'uniform:LOW,HIGH',
+    'normal:MEAN,STDDEV' and 'lognormal:MU,SIGMA'. A bare number is treated as fixed.
+    """
+    kind, _, params = spec.partition(":")
+    if not params:
+        kind, params = "fixed", kind
+    values = [float(value) for value in params.split(",")]
+
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(values[0], values[1])
+
+    raise ValueError(f"unknown latency distribution '{kind}'")
+
+
+class ScriptRule(NamedTuple):
+    """
+    A scripted response. A rule matches a request if every condition which is set matches. The
+    first matching rule wins; if none match, the stub's default responses are used.
+    """
+
+    response: dict
+    last_message_contains: Optional[str] = None
+    last_message_startswith: Optional[str] = None
+    # name of a function which must be offered to the model
+    function: Optional[str] = None
+    model: Optional[str] = None
+    latency: Optional[str] = None
+
+    def matches(self, request: dict) -> bool:
+        last_message = get_last_message_content(request)
+        return (
+            (
+                self.last_message_contains is None
+                or self.last_message_contains in last_message
+            )
+            and (
+                self.last_message_startswith is None
+                or last_message.startswith(self.last_message_startswith)
+            )
+            and (self.function is None or self.function in get_function_names(request))
+            and (self.model is None or self.model == request.get(OPENAI_MODEL_FIELD))
+        )
+
+
+def load_script(path: str) -> list[ScriptRule]:
+    """Loads a script: a JSON list of rules, each with a 'response' and optional conditions."""
+    with open(path, encoding="utf-8") as script_file:
+        return [ScriptRule(**rule) for rule in json.load(script_file)]
+
+
+def get_last_message_content(request: dict) -> str:
+    messages = request.get(OPENAI_MESSAGE_FIELD) or [{}]
+    return messages[-1].get(CHATGPT_CONTENT_KEY) or ""
+
+
+def get_last_user_message_content(request: dict) -> str:
+    for message in reversed(request.get(OPENAI_MESSAGE_FIELD) or []):
+        if message.get(CHATGPT_ROLE_KEY) == CHATGPT_USER_ROLE:
+            return message.get(CHATGPT_CONTENT_KEY) or ""
+    return ""
+
+
+def get_function_names(request: dict) -> list[str]:
+    return [
+        function[CHATGPT_FUNCTION_NAME_KEY]
+        for function in request.get(OPENAI_FUNCTIONS_FIELD) or []
+    ]
+
+
+def get_pending_tasks(request: dict) -> list[dict]:
+    """Returns the tasks listed in the request's [PENDING TASKS] message, if it has one."""
+    for message in request.get(OPENAI_MESSAGE_FIELD) or []:
+        content = message.get(CHATGPT_CONTENT_KEY) or ""
+        if content.startswith(PENDING_TASKS_PREFIX):
+            return [
+                json.loads(line)
+                for line in content.splitlines()[1:]
+                if line.startswith("{")
+            ]
+    return []
+
+
+def pick_pending_task(request: dict, user_message: str) -> dict:
+    """
+    Picks the task the user completed for a complete_task call, the way the model would in single
+    call mode: certain if only one task is pending or only one task's name is mentioned.
+    """
+    tasks = get_pending_tasks(request)
+    if not tasks:
+        return {}
+
+    user_words = set(re.findall(r"[a-z]+", user_message.lower()))
+    mentioned = [
+        task for task in tasks if user_words & set(task["task_name"].lower().split("_"))
+    ]
+    candidates = tasks if len(tasks) == 1 else mentioned
+    if len(candidates) != 1:
+        return {
+            TASK_IDENTIFICATION_NUDGIE_TASK_ID: tasks[0][
+                TASK_IDENTIFICATION_NUDGIE_TASK_ID
+            ],
+            TASK_IDENTIFICATION_CERTAINTY_SCORE: 0.5,
+        }
+
+    task = candidates[0]
+    return {
+        TASK_IDENTIFICATION_NUDGIE_TASK_ID: task[TASK_IDENTIFICATION_NUDGIE_TASK_ID],
+        TASK_IDENTIFICATION_CERTAINTY_SCORE: 1.0,
+        COMPLETE_TASK_REPLY_KEY: f"[stub reply] marked {task['task_name']} as completed",
+    }
+
+
+def function_call_response(name: str, arguments: dict) -> dict:
+    return {
+        CHATGPT_CONTENT_KEY: None,
+        CHATGPT_FUNCTION_CALL_KEY: {
+            CHATGPT_FUNCTION_NAME_KEY: name,
+            CHATGPT_FUNCTION_ARGUMENTS_KEY: json.dumps(arguments),
+        },
+    }
+
+
+def default_response(request: dict) -> dict:
+    """Stands in for the model when no scripted rule matches."""
+    last_message = get_last_message_content(request)
+    last_user_message = get_last_user_message_content(request)
+    function_names = get_function_names(request)
+
+    if last_message.startswith(TASK_IDENTIFICATION_PREFIX):
+        task_ids = [
+            int(task_id) for task_id in PENDING_TASK_ID_PATTERN.findall(last_message)
+        ]
+        return {
+            CHATGPT_CONTENT_KEY: json.dumps(
+                {
+                    TASK_IDENTIFICATION_CERTAINTY_SCORE: 1.0 if task_ids else 0.0,
+                    TASK_IDENTIFICATION_NUDGIE_TASK_ID: (
+                        task_ids[0] if task_ids else None
+                    ),
+                    TASK_IDENTIFICATION_REASONING: "stub: picked the first pending task",
+                }
+            )
+        }
+
+    if CHATGPT_INITIAL_GOAL_SETUP in function_names and last_user_message.startswith(
+        SKIP_CONFIRMATION_PREFIXES
+    ):
+        return function_call_response(
+            CHATGPT_INITIAL_GOAL_SETUP, DEFAULT_GOAL_SETUP_ARGUMENTS
+        )
+
+    if CHATGPT_COMPLETE_TASK_FUNCTION in function_names and TASK_DONE_PATTERN.search(
+        last_message
+    ):
+        return function_call_response(
+            CHATGPT_COMPLETE_TASK_FUNCTION,
+            {
+                "reasoning": "stub: the user said they finished a task",
+                **pick_pending_task(request, last_user_message),
+            },
+        )
+
+    return {CHATGPT_CONTENT_KEY: f"[stub reply] {last_user_message[:80]}"}
+
+
+class OpenAIStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: str = "fixed:0",
+        error_rate: float = 0.0,
+        error_status: int = 429,
+        retry_after: Optional[float] = 1.0,
+        script: Optional[list[ScriptRule]] = None,
+        model_latency: Optional[dict[str, str]] = None,
+    ):
+        super().__init__((host, port), OpenAIStubHandler)
+        self.latency = parse_latency(latency)
+        self.model_latency = {
+            model: parse_latency(spec) for model, spec in (model_latency or {}).items()
+        }
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.script = script or []
+
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+        # the prompt sizes of the requests, in the same rough tokens as the responses' usage
+        self.prompt_tokens = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start_in_background(self) -> "OpenAIStubServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.request_count = 0
+            self.error_count = 0
+            self.prompt_tokens = 0
+            self.peak_in_flight = self.in_flight
+
+    def get_response(self, request: dict) -> (dict, Callable[[], float]):
+        """Returns the response message for a request, and the latency to apply to it."""
+        for rule in self.script:
+            if rule.matches(request):
+                latency = parse_latency(rule.latency) if rule.latency else None
+                return rule.response, latency or self.get_latency(request)
+        return default_response(request), self.get_latency(request)
+
+    def get_latency(self, request: dict) -> Callable[[], float]:
+        return self.model_latency.get(request.get(OPENAI_MODEL_FIELD), self.latency)
+
+
+def get_prompt_chars(request: dict) -> int:
+    return sum(
+        len(m.get(CHATGPT_CONTENT_KEY) or "")
+        for m in request.get(OPENAI_MESSAGE_FIELD, [])
+    )
+
+
+class OpenAIStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.rstrip("/") != CHAT_COMPLETIONS_PATH:
+            self.send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        request = json.loads(body)
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+            server.prompt_tokens += get_prompt_chars(request) // 4
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+
+        try:
+            message, latency = server.get_response(request)
+            time.sleep(latency())
+
+            if random.random() < server.error_rate:
+                with server.lock:
+                    server.error_count += 1
+                self.send_error_response()
+            elif request.get("stream"):
+                self.send_stream(request, message)
+            else:
+                self.send_json(200, self.build_completion(request, message))
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def build_completion(self, request: dict, message: dict) -> dict:
+        prompt_chars = get_prompt_chars(request)
+        completion_chars = len(message.get(CHATGPT_CONTENT_KEY) or "") + len(
+            json.dumps(message.get(CHATGPT_FUNCTION_CALL_KEY) or "")
+        )
+        return {
+            "id": f"chatcmpl-stub-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get(OPENAI_MODEL_FIELD),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {CHATGPT_ROLE_KEY: CHATGPT_ASSISTANT_ROLE, **message},
+                    "finish_reason": (
+                        CHATGPT_FUNCTION_CALL_KEY
+                        if message.get(CHATGPT_FUNCTION_CALL_KEY)
+                        else "stop"
+                    ),
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_chars // 4,
+                "completion_tokens": completion_chars // 4,
+                "total_tokens": (prompt_chars + completion_chars) // 4,
+            },
+        }
+
+    def send_stream(self, request: dict, message: dict) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex}"
+
+        def send_chunk(delta: dict, finish_reason: Optional[str] = None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get(OPENAI_MODEL_FIELD),
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        send_chunk({CHATGPT_ROLE_KEY: CHATGPT_ASSISTANT_ROLE})
+        function_call = message.get(CHATGPT_FUNCTION_CALL_KEY)
+        if function_call:
+            send_chunk(
+                {
+                    CHATGPT_FUNCTION_CALL_KEY: {
+                        CHATGPT_FUNCTION_NAME_KEY: function_call[
+                            CHATGPT_FUNCTION_NAME_KEY
+                        ],
+                        CHATGPT_FUNCTION_ARGUMENTS_KEY: "",
+                    }
+                }
+            )
+            send_chunk(
+                {
+                    CHATGPT_FUNCTION_CALL_KEY: {
+                        CHATGPT_FUNCTION_ARGUMENTS_KEY: function_call[
+                            CHATGPT_FUNCTION_ARGUMENTS_KEY
+                        ]
+                    }
+                }
+            )
+        for word in re.findall(r"\S+\s*", message.get(CHATGPT_CONTENT_KEY) or ""):
+            send_chunk({CHATGPT_CONTENT_KEY: word})
+        send_chunk({}, CHATGPT_FUNCTION_CALL_KEY if function_call else "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def send_error_response(self) -> None:
+        headers = {}
+        if self.server.retry_after is not None:
+            headers["Retry-After"] = str(self.server.retry_after)
+        self.send_json(
+            self.server.error_status,
+            {
+                "error": {
+                    "message": "stub: injected error",
+                    "type": (
+                        "rate_limit_error"
+                        if self.server.error_status == 429
+                        else "server_error"
+                    ),
+                }
+            },
+            headers,
+        )
+
+    def send_json(self, status: int, payload: dict, headers: Optional[dict] = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
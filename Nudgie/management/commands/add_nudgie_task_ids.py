@@ -0,0 +1,84 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django_celery_beat.models import PeriodicTask
+
+from Nudgie.constants import (
+    DIALOGUE_TYPE_GOAL_END,
+    PERIODIC_TASK_NUDGIE_TASK_ID_FIELD,
+    REMINDER_HANDLER,
+)
+from Nudgie.models import NudgieTask, ScheduledEvent
+from Nudgie.scheduling.events import get_task_data_from_event
+from Nudgie.scheduling.periodic_task_helper import (
+    TaskData,
+    get_task_data_from_periodic_task,
+    modify_periodic_task,
+)
+
+
+def find_nudgie_task_id(task_data: TaskData):
+    return (
+        NudgieTask.objects.filter(
+            task__name=task_data.task_name,
+            user_id=task_data.user_id,
+            due_date=task_data.due_date,
+        )
+        .values_list("id", flat=True)
+        .first()
+    )
+
+
+def has_nudgie_task_id(kwargs: str) -> bool:
+    return json.loads(kwargs).get(PERIODIC_TASK_NUDGIE_TASK_ID_FIELD) is not None
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds the NudgieTask id to the payloads of the reminders, nudges and deadlines scheduled "
+        "before it was stored, so that their handlers fetch it by primary key. Jobs whose "
+        "NudgieTask can't be found keep the old lookup. Safe to run again."
+    )
+
+    def handle(self, *args, **options):
+        updated = 0
+        missing = 0
+
+        events = ScheduledEvent.objects.exclude(dialogue_type=DIALOGUE_TYPE_GOAL_END)
+        for event in events.iterator():
+            if has_nudgie_task_id(event.kwargs):
+                continue
+            task_data = get_task_data_from_event(event)
+            nudgie_task_id = event.nudgie_task_id or find_nudgie_task_id(task_data)
+            if nudgie_task_id is None:
+                missing += 1
+                continue
+
+            ScheduledEvent.objects.filter(id=event.id).update(
+                kwargs=task_data._replace(nudgie_task_id=nudgie_task_id).get_as_kwargs()
+            )
+            updated += 1
+
+        reminders = PeriodicTask.objects.filter(task=REMINDER_HANDLER).select_related(
+            "crontab", "job_link"
+        )
+        for periodic_task in reminders.iterator():
+            if has_nudgie_task_id(periodic_task.kwargs):
+                continue
+            task_data = get_task_data_from_periodic_task(periodic_task)
+            link = getattr(periodic_task, "job_link", None)
+            nudgie_task_id = (link and link.nudgie_task_id) or find_nudgie_task_id(
+                task_data
+            )
+            if nudgie_task_id is None:
+                missing += 1
+                continue
+
+            modify_periodic_task(
+                periodic_task.id, task_data._replace(nudgie_task_id=nudgie_task_id)
+            )
+            updated += 1
+
+        self.stdout.write(
+            f"added the NudgieTask id to {updated} jobs ({missing} without a NudgieTask)"
+        )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from Nudgie.chat.archive import archive_conversations
+from Nudgie.constants import ARCHIVE_MAX_BATCHES_PER_RUN
+from Nudgie.models import ConversationArchiveManifest
+
+
+class Command(BaseCommand):
+    help = (
+        "Archives finished goals' transcripts, the same as the beat task does. Safe to interrupt: "
+        "the next run carries on from where this one stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            default=ARCHIVE_MAX_BATCHES_PER_RUN,
+            help="stop after this many batches",
+        )
+
+    def handle(self, *args, **options):
+        archived = archive_conversations(options["max_batches"])
+        self.stdout.write(f"archived {archived} lines")
+
+        for manifest in ConversationArchiveManifest.objects.order_by("id"):
+            ratio = (
+                manifest.compressed_bytes / manifest.raw_bytes
+                if manifest.raw_bytes
+                else 0
+            )
+            status = "done" if manifest.completed_at else "open"
+            self.stdout.write(
+                f"{manifest.id:>6} {manifest.user.username:<20} {manifest.goal_name:<30}"
+                f"{status:>6}{manifest.line_count:>8} lines{manifest.raw_bytes:>10} B"
+                f" -> {manifest.compressed_bytes:>8} B ({ratio:.0%})"
+            )
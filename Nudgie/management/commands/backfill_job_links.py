@@ -0,0 +1,58 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django_celery_beat.models import PeriodicTask
+
+from Nudgie.constants import PERIODIC_TASK_USER_ID
+from Nudgie.models import Goal, NudgieTask, ScheduledJobLink
+from Nudgie.scheduling.periodic_task_helper import get_task_data_from_periodic_task
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates the missing ScheduledJobLinks of PeriodicTasks scheduled before the links existed, "
+        "from the TaskData in their kwargs. Tasks without a user (the fixed beat entries) are "
+        "skipped. Safe to run again."
+    )
+
+    def handle(self, *args, **options):
+        unlinked = (
+            PeriodicTask.objects.filter(job_link__isnull=True)
+            .filter(kwargs__contains=f'"{PERIODIC_TASK_USER_ID}"')
+            .select_related("crontab")
+            .order_by("id")
+        )
+        linked = 0
+        links = []
+        for periodic_task in unlinked.iterator(chunk_size=BATCH_SIZE):
+            task_data = get_task_data_from_periodic_task(periodic_task)
+            goal = Goal.objects.filter(
+                user_id=task_data.user_id, goal_name=task_data.goal_name
+            ).first()
+            nudgie_task = NudgieTask.objects.filter(
+                user_id=task_data.user_id,
+                task__name=task_data.task_name,
+                due_date=task_data.due_date,
+            ).first()
+            links.append(
+                ScheduledJobLink(
+                    periodic_task=periodic_task,
+                    user_id=task_data.user_id,
+                    goal=goal,
+                    nudgie_task=nudgie_task,
+                    dialogue_type=task_data.dialogue_type,
+                    next_run_time=(
+                        datetime.fromisoformat(task_data.next_run_time)
+                        if task_data.next_run_time
+                        else None
+                    ),
+                )
+            )
+            if len(links) == BATCH_SIZE:
+                linked += len(ScheduledJobLink.objects.bulk_create(links))
+                links = []
+
+        linked += len(ScheduledJobLink.objects.bulk_create(links))
+        self.stdout.write(f"linked {linked} PeriodicTasks")
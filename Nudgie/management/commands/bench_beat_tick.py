@@ -0,0 +1,177 @@
+import time
+import uuid
+from datetime import timedelta
+
+from celery import current_app
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django_celery_beat.models import CrontabSchedule, PeriodicTask, PeriodicTasks
+from django_celery_beat.schedulers import DatabaseScheduler
+
+from Nudgie.constants import (
+    DIALOGUE_TYPE_NUDGE,
+    NUDGE_HANDLER,
+    QUEUE_NAME,
+    SCHEDULED_EVENT_DELIVERY_DISPATCHER,
+    SCHEDULED_EVENT_DELIVERY_ETA,
+    SCHEDULED_EVENT_ETA_HORIZON_SECONDS,
+)
+from Nudgie.models import ScheduledEvent
+from Nudgie.scheduling.events import claim_due_events
+from Nudgie.scheduling.task_list import record_task_list_change
+
+# one-off jobs as one-off PeriodicTasks, each with its own crontab, as before ScheduledEvents
+PERIODIC_TASKS_MODE = "periodic_tasks"
+
+
+class BenchScheduler(DatabaseScheduler):
+    """Beat's scheduler, minus the sending of due entries."""
+
+    producer = None
+
+    def apply_entry(self, entry, producer=None):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Times beat's scheduler tick with many one-off jobs pending, stored as one-off "
+        "PeriodicTasks (as they used to be) and as ScheduledEvents in dispatcher and ETA delivery "
+        "mode (see SCHEDULED_EVENT_DELIVERY in settings.py), along with the dispatcher's claim "
+        "query. Nothing is sent, and the bench data is deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pending", type=int, default=10000)
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=7,
+            help="the pending jobs are spread over this many days",
+        )
+        parser.add_argument("--rounds", type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'mode':<16}{'tick after a change ms':>24}{'steady tick ms':>16}"
+            f"{'dispatcher ms':>15}{'claimed':>9}"
+        )
+        for mode in (
+            PERIODIC_TASKS_MODE,
+            SCHEDULED_EVENT_DELIVERY_DISPATCHER,
+            SCHEDULED_EVENT_DELIVERY_ETA,
+        ):
+            # beat closes the connection on every tick, so this can't run in a rolled back transaction
+            user = User.objects.create_user(username=f"bench_{uuid.uuid4().hex[:12]}")
+            try:
+                self.report(mode, user, options)
+            finally:
+                self.delete_bench_data(user)
+
+    def report(self, mode: str, user: User, options: dict) -> None:
+        now = timezone.now()
+        spacing = timedelta(days=options["days"]) / options["pending"]
+        fire_times = [now + spacing * (i + 1) for i in range(options["pending"])]
+        if mode == PERIODIC_TASKS_MODE:
+            self.create_periodic_tasks(user, fire_times)
+        else:
+            self.create_events(user, fire_times)
+
+        scheduler = BenchScheduler(app=current_app)
+        # let the fixed entries run once, so that every timed tick only has to wait
+        while scheduler.tick() == 0:
+            pass
+
+        changed_ticks = []
+        steady_ticks = []
+        for i in range(options["rounds"]):
+            fire_at = now + timedelta(days=options["days"], minutes=i + 1)
+            if mode == PERIODIC_TASKS_MODE:
+                self.create_periodic_tasks(user, [fire_at])
+            else:
+                self.create_events(user, [fire_at])
+            changed_ticks.append(self.time_tick(scheduler))
+            steady_ticks.append(self.time_tick(scheduler))
+
+        dispatcher_ms = claimed = None
+        if mode != PERIODIC_TASKS_MODE:
+            horizon = timedelta(0)
+            if mode == SCHEDULED_EVENT_DELIVERY_ETA:
+                horizon = timedelta(seconds=SCHEDULED_EVENT_ETA_HORIZON_SECONDS)
+            timings = []
+            for _ in range(options["rounds"]):
+                with transaction.atomic():
+                    start = time.perf_counter()
+                    claimed = len(claim_due_events(timezone.now(), horizon=horizon))
+                    timings.append((time.perf_counter() - start) * 1000)
+                    transaction.set_rollback(True)
+            dispatcher_ms = min(timings)
+
+        self.stdout.write(
+            f"{mode:<16}{min(changed_ticks):>24.2f}{min(steady_ticks):>16.2f}"
+            + (
+                f"{dispatcher_ms:>15.2f}{claimed:>9}"
+                if dispatcher_ms is not None
+                else f"{'-':>15}{'-':>9}"
+            )
+        )
+
+    def time_tick(self, scheduler: BenchScheduler) -> float:
+        start = time.perf_counter()
+        scheduler.tick()
+        return (time.perf_counter() - start) * 1000
+
+    def create_periodic_tasks(self, user: User, fire_times: list) -> None:
+        crontabs = CrontabSchedule.objects.bulk_create(
+            (
+                CrontabSchedule(
+                    minute=fire_at.minute,
+                    hour=fire_at.hour,
+                    day_of_month=fire_at.day,
+                    month_of_year=fire_at.month,
+                )
+                for fire_at in fire_times
+            ),
+            batch_size=1000,
+        )
+        PeriodicTask.objects.bulk_create(
+            (
+                PeriodicTask(
+                    crontab=crontab,
+                    name=f"{user.id}: {DIALOGUE_TYPE_NUDGE} for {crontab.id}",
+                    task=NUDGE_HANDLER,
+                    kwargs="{}",
+                    one_off=True,
+                    queue=QUEUE_NAME,
+                )
+                for crontab in crontabs
+            ),
+            batch_size=1000,
+        )
+        # bulk_create skips the signal which tells beat that the schedule changed
+        PeriodicTasks.update_changed()
+
+    def delete_bench_data(self, user: User) -> None:
+        periodic_tasks = PeriodicTask.objects.filter(name__startswith=f"{user.id}: ")
+        crontab_ids = list(periodic_tasks.values_list("crontab_id", flat=True))
+        periodic_tasks.delete()
+        CrontabSchedule.objects.filter(id__in=crontab_ids).delete()
+        user.delete()  # and the events with it
+
+    def create_events(self, user: User, fire_times: list) -> None:
+        ScheduledEvent.objects.bulk_create(
+            (
+                ScheduledEvent(
+                    user=user,
+                    dialogue_type=DIALOGUE_TYPE_NUDGE,
+                    handler=NUDGE_HANDLER,
+                    fire_at=fire_at,
+                    kwargs="{}",
+                )
+                for fire_at in fire_times
+            ),
+            batch_size=1000,
+        )
+        record_task_list_change([user.id])
@@ -0,0 +1,95 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from Nudgie.chat import chatgpt
+from Nudgie.constants import (
+    CACHE_POLICY_NEVER,
+    CHATGPT_CONTENT_KEY,
+    CHATGPT_ROLE_KEY,
+    CHATGPT_USER_ROLE,
+    DIALOGUE_TYPE_AI_STANDARD,
+)
+from Nudgie.llm_stub.server import OpenAIStubServer
+
+
+def bench_messages(i: int) -> list:
+    return [{CHATGPT_ROLE_KEY: CHATGPT_USER_ROLE, CHATGPT_CONTENT_KEY: f"bench {i}"}]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares how many slow OpenAI requests can be in flight at once on the sync (WSGI) path, "
+        "where every request holds a worker thread, and the async (ASGI) path, against a local "
+        "stub backend with a fixed latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument(
+            "--latency", type=float, default=2.0, help="stub latency in seconds"
+        )
+        parser.add_argument(
+            "--wsgi-workers",
+            type=int,
+            default=8,
+            help="worker threads available to the WSGI server",
+        )
+
+    def handle(self, *args, **options):
+        server = OpenAIStubServer(
+            latency=f"fixed:{options['latency']}"
+        ).start_in_background()
+        chatgpt.configure_openai_clients(server.base_url, api_key="stub")
+
+        try:
+            # every request is unique anyway, this just keeps the cache out of the measurement
+            with override_settings(
+                CACHE_KEY_POLICY_OVERRIDES={
+                    DIALOGUE_TYPE_AI_STANDARD: CACHE_POLICY_NEVER
+                }
+            ):
+                self.report("WSGI", server, options, self.run_sync)
+                self.report("ASGI", server, options, self.run_async)
+        finally:
+            chatgpt.configure_openai_clients()
+            server.shutdown()
+
+    def report(self, mode, server, options, run):
+        server.reset_stats()
+        start = time.perf_counter()
+        run(options)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{mode}: {options['requests']} requests in {elapsed:.2f}s"
+            f" ({options['requests'] / elapsed:.1f} req/s),"
+            f" peak in-flight requests: {server.peak_in_flight}"
+        )
+
+    def run_sync(self, options):
+        with ThreadPoolExecutor(max_workers=options["wsgi_workers"]) as executor:
+            list(
+                executor.map(
+                    lambda i: chatgpt.call_openai_api(
+                        bench_messages(i), dialogue_type=DIALOGUE_TYPE_AI_STANDARD
+                    ),
+                    range(options["requests"]),
+                )
+            )
+
+    def run_async(self, options):
+        async def run_all():
+            await asyncio.gather(
+                *(
+                    chatgpt.acall_openai_api(
+                        bench_messages(i), dialogue_type=DIALOGUE_TYPE_AI_STANDARD
+                    )
+                    for i in range(options["requests"])
+                )
+            )
+
+        asyncio.run(run_all())
@@ -0,0 +1,75 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+
+from Nudgie.chat.instrumentation import percentile
+from Nudgie.constants import (
+    CHATGPT_ASSISTANT_ROLE,
+    CHATGPT_USER_ROLE,
+    DIALOGUE_TYPE_AI_STANDARD,
+    DIALOGUE_TYPE_SYSTEM_MESSAGE,
+    DIALOGUE_TYPE_USER_INPUT,
+)
+from Nudgie.models import Conversation
+
+HISTORY_SIZES = [100, 1000, 5000]
+
+
+class Command(BaseCommand):
+    help = (
+        "Times rendering the conversation window (the latest page, and the page before it) for "
+        "users with longer and longer histories. The history is generated and rolled back "
+        "afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=20)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'lines':>7}{'page':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for size in HISTORY_SIZES:
+            with transaction.atomic():
+                user = self.create_history(size)
+                client = Client()
+                client.force_login(user)
+                last_id = Conversation.objects.filter(user=user).latest("id").id
+
+                for page, url in (
+                    ("latest", "/get_conversation_display/"),
+                    ("older", f"/get_conversation_history/?before={last_id - 100}"),
+                ):
+                    timings = []
+                    for _ in range(options["rounds"]):
+                        start = time.perf_counter()
+                        client.get(url)
+                        timings.append((time.perf_counter() - start) * 1000)
+                    timings.sort()
+                    self.stdout.write(
+                        f"{size:>7}{page:>10}{percentile(timings, 0.5):>10.1f}"
+                        f"{percentile(timings, 0.95):>10.1f}"
+                    )
+
+                transaction.set_rollback(True)
+
+    def create_history(self, size: int) -> User:
+        user = User.objects.create_user(username="bench_conversation_display")
+        # a user line, an internal line and a reply, like a turn with task identification
+        turn = [
+            (CHATGPT_USER_ROLE, DIALOGUE_TYPE_USER_INPUT),
+            (CHATGPT_USER_ROLE, DIALOGUE_TYPE_SYSTEM_MESSAGE),
+            (CHATGPT_ASSISTANT_ROLE, DIALOGUE_TYPE_AI_STANDARD),
+        ]
+        Conversation.objects.bulk_create(
+            Conversation(
+                user=user,
+                message_type=turn[i % len(turn)][0],
+                dialogue_type=turn[i % len(turn)][1],
+                content=f"line {i} of the conversation",
+            )
+            for i in range(size)
+        )
+
+        return user
@@ -0,0 +1,63 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from Nudgie.chat.dialogue import conversation_turn, save_line_of_speech
+from Nudgie.chat.instrumentation import percentile
+from Nudgie.constants import (
+    CHATGPT_ASSISTANT_ROLE,
+    CHATGPT_USER_ROLE,
+    DIALOGUE_TYPE_AI_STANDARD,
+    DIALOGUE_TYPE_SYSTEM_MESSAGE,
+    DIALOGUE_TYPE_USER_INPUT,
+)
+
+# the lines of a turn in which the task had to be identified by the AI
+TURN_LINES = [
+    (CHATGPT_USER_ROLE, DIALOGUE_TYPE_USER_INPUT),
+    (CHATGPT_USER_ROLE, DIALOGUE_TYPE_SYSTEM_MESSAGE),
+    (CHATGPT_ASSISTANT_ROLE, DIALOGUE_TYPE_SYSTEM_MESSAGE),
+    (CHATGPT_USER_ROLE, DIALOGUE_TYPE_SYSTEM_MESSAGE),
+    (CHATGPT_ASSISTANT_ROLE, DIALOGUE_TYPE_AI_STANDARD),
+]
+
+
+def save_turn(user: User) -> None:
+    for message_type, dialogue_type in TURN_LINES:
+        save_line_of_speech(user, message_type, dialogue_type, "x" * 200)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the time spent writing the lines of a conversation turn one INSERT at a time vs "
+        "buffered and written in one transaction (conversation_turn), on the default database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=200)
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username="bench_conversation_writes")
+        self.stdout.write(
+            f"{connection.vendor}, {len(TURN_LINES)} lines per turn\n"
+            f"{'writes':<12}{'p50 ms':>10}{'p95 ms':>10}"
+        )
+        try:
+            for label, write in (
+                ("per line", save_turn),
+                ("per turn", conversation_turn(save_turn)),
+            ):
+                timings = []
+                for _ in range(options["rounds"]):
+                    start = time.perf_counter()
+                    write(user)
+                    timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+                self.stdout.write(
+                    f"{label:<12}{percentile(timings, 0.5):>10.2f}"
+                    f"{percentile(timings, 0.95):>10.2f}"
+                )
+        finally:
+            user.delete()
@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from Nudgie.constants import DIALOGUE_TYPE_NUDGE, NUDGE_HANDLER
+from Nudgie.models import ScheduledEvent
+from Nudgie.scheduling.events import claim_due_events
+
+DUE_EVENTS = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Times claiming a batch of due events with different numbers of events pending in the "
+        "future, to check that the dispatcher's cost doesn't grow with them. The data is rolled back "
+        "afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--pending",
+            type=int,
+            nargs="+",
+            default=[1000, 10000, 100000],
+            help="numbers of future events to try",
+        )
+        parser.add_argument("--rounds", type=int, default=5)
+
+    def handle(self, *args, **options):
+        for pending in options["pending"]:
+            with transaction.atomic():
+                now = self.create_events(pending)
+                timings = []
+                for _ in range(options["rounds"]):
+                    start = time.perf_counter()
+                    with CaptureQueriesContext(connection) as queries:
+                        events = claim_due_events(now)
+                    timings.append((time.perf_counter() - start) * 1000)
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f"{pending:>8} pending: {len(events)} claimed per batch in"
+                f" {min(timings):.2f} ms (best of {options['rounds']}),"
+                f" {len(queries)} queries"
+            )
+
+    def create_events(self, pending: int):
+        now = timezone.now()
+        user = User.objects.create_user(username="event_dispatch_bench")
+        fire_times = [now - timedelta(seconds=i + 1) for i in range(DUE_EVENTS)] + [
+            now + timedelta(seconds=i + 1) for i in range(pending)
+        ]
+        ScheduledEvent.objects.bulk_create(
+            (
+                ScheduledEvent(
+                    user=user,
+                    dialogue_type=DIALOGUE_TYPE_NUDGE,
+                    handler=NUDGE_HANDLER,
+                    fire_at=fire_at,
+                    kwargs="{}",
+                )
+                for fire_at in fire_times
+            ),
+            batch_size=1000,
+        )
+
+        return now
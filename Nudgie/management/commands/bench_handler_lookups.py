@@ -0,0 +1,150 @@
+import contextlib
+import io
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from Nudgie.constants import (
+    DEADLINE_HANDLER,
+    DIALOGUE_TYPE_DEADLINE,
+    DIALOGUE_TYPE_NUDGE,
+    NUDGE_HANDLER,
+)
+from Nudgie.models import Goal, NudgieTask, ScheduledEvent, Task
+from Nudgie.scheduling.periodic_task_helper import TaskData
+from Nudgie.tasks import deadline_handler, handle_nudge
+
+BENCH_TASK_NAMES = ["practice_cooking", "study_cooking_theory", "go_running"]
+
+
+class QueryTimer:
+    """Adds up the time spent in the DB, for use with connection.execute_wrapper."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.queries += 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the DB work of the nudge and deadline handlers when their job's NudgieTask is "
+        "fetched by primary key, and when it's looked up by task name, user and due date (as for "
+        "jobs scheduled before the id was stored). The tasks are completed, so no messages are "
+        "generated. The data is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--nudgie-tasks",
+            type=int,
+            default=5000,
+            help="NudgieTasks in the table, spread over the bench user's tasks",
+        )
+        parser.add_argument("--rounds", type=int, default=200)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'handler':<10}{'lookup':<14}{'queries':>9}{'db ms p50':>11}{'wall ms p50':>13}"
+        )
+        with transaction.atomic():
+            nudgie_tasks = self.create_nudgie_tasks(options["nudgie_tasks"])
+            for name, handler, celery_task, dialogue_type in (
+                ("nudge", handle_nudge, NUDGE_HANDLER, DIALOGUE_TYPE_NUDGE),
+                (
+                    "deadline",
+                    deadline_handler,
+                    DEADLINE_HANDLER,
+                    DIALOGUE_TYPE_DEADLINE,
+                ),
+            ):
+                for lookup, by_id in (("name + date", False), ("primary key", True)):
+                    self.report(
+                        name,
+                        lookup,
+                        handler,
+                        self.create_events(
+                            nudgie_tasks[: options["rounds"]],
+                            celery_task,
+                            dialogue_type,
+                            by_id,
+                        ),
+                    )
+            transaction.set_rollback(True)
+
+    def report(self, name: str, lookup: str, handler, events: list) -> None:
+        db_times = []
+        wall_times = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for event in events:
+                timer = QueryTimer()
+                start = time.perf_counter()
+                with connection.execute_wrapper(timer):
+                    handler(event.id)
+                wall_times.append((time.perf_counter() - start) * 1000)
+                db_times.append(timer.seconds * 1000)
+
+        db_times.sort()
+        wall_times.sort()
+        self.stdout.write(
+            f"{name:<10}{lookup:<14}{timer.queries:>9}{db_times[len(db_times) // 2]:>11.3f}"
+            f"{wall_times[len(wall_times) // 2]:>13.3f}"
+        )
+
+    def create_nudgie_tasks(self, count: int) -> list[NudgieTask]:
+        user = User.objects.create_user(username="handler_lookup_bench")
+        now = timezone.now()
+        goal = Goal.objects.create(
+            user=user, goal_name="bench_goal", goal_end_date=now + timedelta(days=30)
+        )
+        tasks = [Task.objects.create(goal=goal, name=name) for name in BENCH_TASK_NAMES]
+        return NudgieTask.objects.bulk_create(
+            (
+                NudgieTask(
+                    user=user,
+                    task=tasks[i % len(tasks)],
+                    goal=goal,
+                    due_date=now + timedelta(hours=i),
+                    reminder_time=now + timedelta(hours=i),
+                    completed=True,
+                )
+                for i in range(count)
+            ),
+            batch_size=1000,
+        )
+
+    def create_events(
+        self, nudgie_tasks: list, celery_task: str, dialogue_type: str, by_id: bool
+    ) -> list[ScheduledEvent]:
+        return ScheduledEvent.objects.bulk_create(
+            ScheduledEvent(
+                user_id=nudgie_task.user_id,
+                dialogue_type=dialogue_type,
+                handler=celery_task,
+                fire_at=nudgie_task.due_date,
+                goal_id=nudgie_task.goal_id,
+                nudgie_task=nudgie_task,
+                kwargs=TaskData(
+                    crontab=None,
+                    task_name=nudgie_task.task.name,
+                    goal_name=nudgie_task.goal.goal_name,
+                    user_id=nudgie_task.user_id,
+                    due_date=nudgie_task.due_date.isoformat(),
+                    dialogue_type=dialogue_type,
+                    next_run_time=nudgie_task.due_date.isoformat(),
+                    nudgie_task_id=nudgie_task.id if by_id else None,
+                ).get_as_kwargs(),
+            )
+            for nudgie_task in nudgie_tasks
+        )
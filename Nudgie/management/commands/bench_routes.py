@@ -0,0 +1,102 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from Nudgie.chat import chatgpt
+from Nudgie.chat.instrumentation import percentile
+from Nudgie.chat.model_routing import get_model_route
+from Nudgie.constants import (
+    CACHE_POLICY_NEVER,
+    CHAT_GPT_MODEL,
+    CHATGPT_CONTENT_KEY,
+    CHATGPT_ROLE_KEY,
+    CHATGPT_USER_ROLE,
+    MODEL_ROUTES,
+)
+from Nudgie.llm_stub.server import OpenAIStubServer
+
+DEFAULT_MODEL_LATENCY = ["gpt-4=normal:2.5,0.5", "gpt-3.5-turbo=normal:0.7,0.2"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports OpenAI call latency per model route (see MODEL_ROUTES in Nudgie/constants.py) "
+        "against a local stub backend with per-model latencies, next to the latency of sending "
+        f"every call to {CHAT_GPT_MODEL}."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--calls", type=int, default=20, help="calls per route and mode"
+        )
+        parser.add_argument(
+            "--model-latency",
+            action="append",
+            metavar="MODEL=DISTRIBUTION",
+            help="stub latency distribution for a model, in seconds "
+            f"(default: {' '.join(DEFAULT_MODEL_LATENCY)})",
+        )
+        parser.add_argument(
+            "--latency", default="fixed:1", help="stub latency for any other model"
+        )
+
+    def handle(self, *args, **options):
+        model_latency = options["model_latency"] or DEFAULT_MODEL_LATENCY
+        server = OpenAIStubServer(
+            latency=options["latency"],
+            model_latency=dict(spec.split("=", 1) for spec in model_latency),
+        ).start_in_background()
+        chatgpt.configure_openai_clients(server.base_url, api_key="stub")
+
+        dialogue_types = [key for key in MODEL_ROUTES if isinstance(key, str)]
+        single_model_routes = {
+            dialogue_type: {"model": CHAT_GPT_MODEL} for dialogue_type in dialogue_types
+        }
+
+        self.stdout.write(
+            f"{'route':<22}{'model':<16}{'max tok':>8}{'p50 ms':>10}{'p95 ms':>10}"
+            f"{CHAT_GPT_MODEL + ' p50':>16}{'speedup':>10}"
+        )
+        try:
+            # every request is unique anyway, this just keeps the cache out of the measurement
+            with override_settings(
+                CACHE_KEY_POLICY_OVERRIDES={
+                    dialogue_type: CACHE_POLICY_NEVER
+                    for dialogue_type in dialogue_types
+                }
+            ):
+                for dialogue_type in dialogue_types:
+                    route = get_model_route(dialogue_type)
+                    routed = self.time_calls(dialogue_type, options["calls"])
+                    with override_settings(MODEL_ROUTE_OVERRIDES=single_model_routes):
+                        single_model = self.time_calls(dialogue_type, options["calls"])
+
+                    routed_p50 = percentile(routed, 0.5)
+                    single_model_p50 = percentile(single_model, 0.5)
+                    self.stdout.write(
+                        f"{dialogue_type:<22}{route.model:<16}{str(route.max_tokens):>8}"
+                        f"{routed_p50:>10.0f}{percentile(routed, 0.95):>10.0f}"
+                        f"{single_model_p50:>16.0f}{single_model_p50 / routed_p50:>9.1f}x"
+                    )
+        finally:
+            chatgpt.configure_openai_clients()
+            server.shutdown()
+
+    def time_calls(self, dialogue_type: str, calls: int) -> list[float]:
+        """Returns the sorted wall times of `calls` sequential calls, in milliseconds."""
+        wall_times = []
+        for i in range(calls):
+            start = time.perf_counter()
+            chatgpt.call_openai_api(
+                [
+                    {
+                        CHATGPT_ROLE_KEY: CHATGPT_USER_ROLE,
+                        CHATGPT_CONTENT_KEY: f"bench {dialogue_type} {i}",
+                    }
+                ],
+                dialogue_type=dialogue_type,
+            )
+            wall_times.append((time.perf_counter() - start) * 1000)
+
+        return sorted(wall_times)
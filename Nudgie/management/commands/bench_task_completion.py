@@ -0,0 +1,111 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from Nudgie.chat import chatgpt
+from Nudgie.chat.instrumentation import percentile
+from Nudgie.constants import (
+    CACHE_POLICY_NEVER,
+    DIALOGUE_TYPE_AI_STANDARD,
+    DIALOGUE_TYPE_TASK_IDENTIFICATION,
+    TASK_COMPLETION_MODE_MULTI_CALL,
+    TASK_COMPLETION_MODE_SINGLE_CALL,
+)
+from Nudgie.llm_stub.server import OpenAIStubServer
+from Nudgie.models import Conversation, Goal, NudgieTask, RateLimitBucket, Task
+from Nudgie.time_utils.time import set_time
+
+BENCH_TASK_NAMES = ["practice_cooking", "study_cooking_theory"]
+# one message naming each task, and one which can't be resolved without the identification call
+BENCH_MESSAGES = ["done with my practice!", "finished the theory", "done!"]
+# a message which isn't about completing a task, which pays for the pending tasks all the same
+BENCH_ORDINARY_MESSAGE = "how should I plan my week?"
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the end-to-end latency and prompt size of 'I finished my task' messages in single "
+        "call and multi call task completion mode (see TASK_COMPLETION_MODE in settings.py), "
+        "against a local stub backend with a fixed latency. Single call mode sends the pending "
+        "tasks with every ongoing-goal message, task completion or not, so its prompt cost is also "
+        "reported for an ordinary message."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=10)
+        parser.add_argument(
+            "--latency", type=float, default=1.0, help="stub latency in seconds"
+        )
+
+    def handle(self, *args, **options):
+        server = OpenAIStubServer(
+            latency=f"fixed:{options['latency']}"
+        ).start_in_background()
+        chatgpt.configure_openai_clients(server.base_url, api_key="stub")
+        user = self.create_bench_user()
+
+        self.stdout.write(
+            f"{'mode':<14}{'message':<28}{'p50 ms':>10}{'p95 ms':>10}{'calls/msg':>11}"
+            f"{'prompt tok/msg':>16}"
+        )
+        try:
+            with override_settings(
+                CACHE_KEY_POLICY_OVERRIDES={
+                    DIALOGUE_TYPE_AI_STANDARD: CACHE_POLICY_NEVER,
+                    DIALOGUE_TYPE_TASK_IDENTIFICATION: CACHE_POLICY_NEVER,
+                }
+            ):
+                for mode in (
+                    TASK_COMPLETION_MODE_MULTI_CALL,
+                    TASK_COMPLETION_MODE_SINGLE_CALL,
+                ):
+                    with override_settings(TASK_COMPLETION_MODE=mode):
+                        for message in BENCH_MESSAGES + [BENCH_ORDINARY_MESSAGE]:
+                            self.report(mode, message, user, server, options["rounds"])
+        finally:
+            user.delete()
+            chatgpt.configure_openai_clients()
+            server.shutdown()
+
+    def create_bench_user(self) -> User:
+        user = User.objects.create_user(username=f"bench_{uuid.uuid4().hex[:12]}")
+        now = timezone.now()
+        goal = Goal.objects.create(
+            user=user, goal_name="bench_goal", goal_end_date=now + timedelta(days=30)
+        )
+        for task_name in BENCH_TASK_NAMES:
+            NudgieTask.objects.create(
+                user=user,
+                task=Task.objects.create(goal=goal, name=task_name),
+                goal=goal,
+                due_date=now + timedelta(days=1),
+            )
+        # the goal's start date is set on creation, so the user's clock has to be past it
+        set_time(user, now + timedelta(minutes=1))
+
+        return user
+
+    def report(self, mode, message, user, server, rounds):
+        wall_times = []
+        server.reset_stats()
+        for _ in range(rounds):
+            # every round starts from the same state, with full rate limit buckets
+            Conversation.objects.filter(user=user).delete()
+            NudgieTask.objects.filter(user=user).update(completed=False)
+            RateLimitBucket.objects.all().delete()
+
+            start = time.perf_counter()
+            chatgpt.handle_convo(message, [], user)
+            wall_times.append((time.perf_counter() - start) * 1000)
+
+        wall_times.sort()
+        self.stdout.write(
+            f"{mode:<14}{message:<28}{percentile(wall_times, 0.5):>10.0f}"
+            f"{percentile(wall_times, 0.95):>10.0f}{server.request_count / rounds:>11.1f}"
+            f"{server.prompt_tokens / rounds:>16.0f}"
+        )
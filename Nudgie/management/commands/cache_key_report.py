@@ -0,0 +1,72 @@
+import json
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from Nudgie.chat.cache_keys import get_cache_key, get_cache_policy
+from Nudgie.chat.response_cache import get_request_hash
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays a recorded OpenAI workload (see OPENAI_WORKLOAD_RECORD_PATH) and reports the "
+        "response cache hit rate per dialogue type, before and after cache key normalization."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "workload", help="path to the recorded workload (JSON lines)"
+        )
+
+    def handle(self, *args, **options):
+        raw_keys_seen = set()
+        normalized_keys_seen = set()
+        # dialogue type -> [requests, raw hits, normalized hits]
+        results = defaultdict(lambda: [0, 0, 0])
+
+        with open(options["workload"], encoding="utf-8") as workload_file:
+            for line in workload_file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                dialogue_type = record["dialogue_type"]
+                request_args = record["args"]
+                result = results[dialogue_type]
+                result[0] += 1
+
+                raw_key = get_request_hash(request_args)
+                if raw_key in raw_keys_seen:
+                    result[1] += 1
+                raw_keys_seen.add(raw_key)
+
+                normalized_key = get_cache_key(request_args, dialogue_type)
+                if normalized_key is None:
+                    continue
+                if normalized_key in normalized_keys_seen:
+                    result[2] += 1
+                normalized_keys_seen.add(normalized_key)
+
+        self.stdout.write(
+            f"{'dialogue type':<22}{'policy':<10}{'requests':>10}"
+            f"{'raw hit rate':>15}{'normalized hit rate':>22}"
+        )
+        totals = [0, 0, 0]
+        for dialogue_type, (requests, raw_hits, normalized_hits) in sorted(
+            results.items(), key=lambda item: str(item[0])
+        ):
+            self.stdout.write(
+                f"{str(dialogue_type):<22}{get_cache_policy(dialogue_type):<10}"
+                f"{requests:>10}{raw_hits / requests:>15.1%}"
+                f"{normalized_hits / requests:>22.1%}"
+            )
+            totals = [
+                totals[0] + requests,
+                totals[1] + raw_hits,
+                totals[2] + normalized_hits,
+            ]
+
+        if totals[0]:
+            self.stdout.write(
+                f"{'total':<32}{totals[0]:>10}{totals[1] / totals[0]:>15.1%}"
+                f"{totals[2] / totals[0]:>22.1%}"
+            )
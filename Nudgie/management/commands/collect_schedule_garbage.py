@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from Nudgie.constants import SCHEDULE_GC_MAX_BATCHES_PER_RUN
+from Nudgie.scheduling.crontabs import delete_schedule_garbage, get_schedule_table_sizes
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes fired one-off PeriodicTasks and orphaned crontabs, the same as the beat task does, "
+        "and reports the scheduler tables' sizes before and after. Safe to interrupt: the next run "
+        "carries on with whatever is left."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            default=SCHEDULE_GC_MAX_BATCHES_PER_RUN,
+            help="stop after this many batches",
+        )
+
+    def handle(self, *args, **options):
+        before = get_schedule_table_sizes()
+        garbage = delete_schedule_garbage(options["max_batches"])
+        after = get_schedule_table_sizes()
+
+        self.stdout.write(
+            f"deleted {garbage.periodic_tasks} fired one-off PeriodicTasks and"
+            f" {garbage.crontabs} orphaned crontabs"
+        )
+        for table, size in before.items():
+            line = f"{table:<40}{size.rows:>10} -> {after[table].rows:>10} rows"
+            if size.bytes is not None:
+                # PostgreSQL only hands the space back once the table has been vacuumed
+                line += f"{size.bytes:>14} -> {after[table].bytes:>14} B"
+            self.stdout.write(line)
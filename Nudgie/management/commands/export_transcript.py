@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from Nudgie.chat.archive import format_transcript, get_goal_transcript
+from Nudgie.models import ConversationArchiveManifest
+
+
+class Command(BaseCommand):
+    help = "Writes out a finished goal's transcript, whether or not it has been archived yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument("manifest_id", type=int)
+        parser.add_argument(
+            "--jsonl", action="store_true", help="one JSON object per line"
+        )
+        parser.add_argument(
+            "--include-internal",
+            action="store_true",
+            help="include the internal prompts and replies (system messages)",
+        )
+
+    def handle(self, *args, **options):
+        manifest = ConversationArchiveManifest.objects.get(id=options["manifest_id"])
+        lines = get_goal_transcript(manifest, options["include_internal"])
+
+        if options["jsonl"]:
+            for line in lines:
+                self.stdout.write(json.dumps(line._asdict()))
+        else:
+            self.stdout.write(format_transcript(lines))
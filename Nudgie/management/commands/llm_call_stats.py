@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from Nudgie.chat.instrumentation import get_latency_rollups
+
+GROUPABLE_FIELDS = ["dialogue_type", "day", "call_site", "model", "cache_status"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports recorded OpenAI call latency percentiles, cache hit rate and token usage, grouped "
+        "by dialogue type (and optionally day, call site, model or cache status)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--by",
+            nargs="+",
+            choices=GROUPABLE_FIELDS,
+            default=["dialogue_type"],
+            help="fields to group by",
+        )
+        parser.add_argument(
+            "--days", type=int, default=7, help="only include the last N days"
+        )
+
+    def handle(self, *args, **options):
+        group_by = tuple(options["by"])
+        since = timezone.now().date() - timedelta(days=options["days"] - 1)
+        rollups = get_latency_rollups(group_by, since)
+
+        header = "".join(f"{field:<24}" for field in group_by)
+        self.stdout.write(
+            f"{header}{'calls':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+            f"{'cache hits':>12}{'prompt tok':>12}{'compl tok':>12}"
+        )
+        for rollup in rollups:
+            key = "".join(f"{str(rollup[field]):<24}" for field in group_by)
+            self.stdout.write(
+                f"{key}{rollup['calls']:>8}{rollup['p50_ms']:>10.0f}"
+                f"{rollup['p95_ms']:>10.0f}{rollup['p99_ms']:>10.0f}"
+                f"{rollup['cache_hit_rate']:>12.1%}{rollup['prompt_tokens']:>12}"
+                f"{rollup['completion_tokens']:>12}"
+            )
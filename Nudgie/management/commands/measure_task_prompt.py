@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.serializers import serialize
+from django.db import transaction
+from django.utils import timezone
+
+from Nudgie.chat.chatgpt import get_pending_tasks, serialize_pending_tasks
+from Nudgie.chat.context import estimate_tokens
+from Nudgie.models import Goal, NudgieTask, Task
+
+TASK_COUNTS = [2, 5, 10]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the prompt tokens taken up by the pending task listing in the task identification "
+        "prompt: Django's JSON serializer (the old payload) vs the compact projection. Uses "
+        "generated tasks, which are rolled back afterwards."
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'tasks':>6}{'serializer tok':>16}{'compact tok':>13}{'saved':>8}"
+        )
+        for task_count in TASK_COUNTS:
+            with transaction.atomic():
+                now = timezone.now()
+                tasks = get_pending_tasks(self.create_tasks(task_count, now), now)
+                serializer_tokens = estimate_tokens(serialize("json", tasks))
+                compact_tokens = estimate_tokens(serialize_pending_tasks(tasks))
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f"{task_count:>6}{serializer_tokens:>16}{compact_tokens:>13}"
+                f"{1 - compact_tokens / serializer_tokens:>8.0%}"
+            )
+
+        self.stdout.write(
+            "The listing is saved as a conversation line, so the saving applies again to every "
+            "later request which replays it."
+        )
+
+    def create_tasks(self, task_count: int, now) -> User:
+        user = User.objects.create_user(username="measure_task_prompt")
+        goal = Goal.objects.create(
+            user=user, goal_name="learn_to_cook", goal_end_date=now + timedelta(days=30)
+        )
+        for i in range(task_count):
+            task = Task.objects.create(goal=goal, name=f"practice_recipe_{i}")
+            NudgieTask.objects.create(
+                user=user,
+                task=task,
+                goal=goal,
+                due_date=now + timedelta(days=1, hours=i),
+                reminder_time=now + timedelta(hours=i),
+            )
+
+        return user
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django_celery_beat.models import CrontabSchedule, PeriodicTask
+
+from Nudgie.constants import DEADLINE_HANDLER, GOAL_END_HANDLER, NUDGE_HANDLER
+from Nudgie.models import Goal, NudgieTask
+from Nudgie.scheduling.events import schedule_event
+from Nudgie.scheduling.periodic_task_helper import get_task_data_from_periodic_task
+
+ONE_OFF_HANDLERS = [NUDGE_HANDLER, DEADLINE_HANDLER, GOAL_END_HANDLER]
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the nudges, deadlines and goal ends which were scheduled as one-off PeriodicTasks "
+        "into ScheduledEvents, deleting the PeriodicTasks and their crontabs."
+    )
+
+    def handle(self, *args, **options):
+        moved = 0
+        for periodic_task in PeriodicTask.objects.filter(task__in=ONE_OFF_HANDLERS):
+            task_data = get_task_data_from_periodic_task(periodic_task)
+            goal = Goal.objects.filter(
+                user_id=task_data.user_id, goal_name=task_data.goal_name
+            ).first()
+            nudgie_task = NudgieTask.objects.filter(
+                user_id=task_data.user_id,
+                task__name=task_data.task_name,
+                due_date=task_data.due_date,
+            ).first()
+
+            with transaction.atomic():
+                schedule_event(
+                    task_data._replace(crontab=None),
+                    periodic_task.task,
+                    goal=goal,
+                    nudgie_task=nudgie_task,
+                )
+                periodic_task.delete()
+                # each one-off job had a crontab of its own
+                CrontabSchedule.objects.filter(
+                    id=periodic_task.crontab_id, periodictask__isnull=True
+                ).delete()
+            moved += 1
+
+        self.stdout.write(f"moved {moved} one-off PeriodicTasks to ScheduledEvents")
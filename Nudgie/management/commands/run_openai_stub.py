@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+
+from Nudgie.llm_stub.server import OpenAIStubServer, load_script
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a local stand-in for the OpenAI chat completions API. Set OPENAI_BASE_URL in "
+        "settings.py to the URL it prints to send the app's requests to it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument(
+            "--latency",
+            default="fixed:0",
+            help="latency distribution in seconds: fixed:S, uniform:LOW,HIGH, "
+            "normal:MEAN,STDDEV or lognormal:MU,SIGMA",
+        )
+        parser.add_argument(
+            "--model-latency",
+            action="append",
+            default=[],
+            metavar="MODEL=DISTRIBUTION",
+            help="latency distribution for a specific model, e.g. gpt-4=normal:3,1",
+        )
+        parser.add_argument(
+            "--error-rate", type=float, default=0.0, help="fraction of requests to fail"
+        )
+        parser.add_argument(
+            "--error-status", type=int, default=429, help="status of injected errors"
+        )
+        parser.add_argument(
+            "--retry-after",
+            type=float,
+            default=1.0,
+            help="Retry-After header (seconds) sent with injected errors",
+        )
+        parser.add_argument("--script", help="JSON file of scripted responses")
+
+    def handle(self, *args, **options):
+        server = OpenAIStubServer(
+            host=options["host"],
+            port=options["port"],
+            latency=options["latency"],
+            error_rate=options["error_rate"],
+            error_status=options["error_status"],
+            retry_after=options["retry_after"],
+            script=load_script(options["script"]) if options["script"] else None,
+            model_latency=dict(spec.split("=", 1) for spec in options["model_latency"]),
+        )
+        self.stdout.write(f"OpenAI stub listening on {server.base_url}")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
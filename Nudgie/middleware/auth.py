@@ -1,18 +1,41 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.shortcuts import redirect
 
 
 class AuthenticationMiddleware:
+    # Supports both sync and async requests, so that async views (e.g. chatbot_api) don't need a
+    # thread for the whole request.
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if self.requires_login(request) and not request.user.is_authenticated:
+            return redirect("/accounts/login/")
+        response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        # loading the user hits the DB, so it has to happen outside the event loop
+        if (
+            self.requires_login(request)
+            and not await sync_to_async(lambda: request.user.is_authenticated)()
+        ):
+            return redirect("/accounts/login/")
+        return await self.get_response(request)
+
+    def requires_login(self, request) -> bool:
         # eventually you're going to want to modify this condition to exclude all the chatbot api endpoints
-        if not request.user.is_authenticated and request.path not in [
+        return request.path not in [
             "/accounts/login/",
             "/accounts/signup/",
             "/chatbot/api/",
             "/admin/",
-        ]:
-            return redirect("/accounts/login/")
-        response = self.get_response(request)
-        return response
+        ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django_celery_beat.models import CrontabSchedule, PeriodicTask
 
 
 class Conversation(models.Model):
@@ -18,11 +19,84 @@ class Conversation(models.Model):
     content = models.TextField(blank=True, null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     dialogue_type = models.TextField(default="standard")
+    # the task a reminder or nudge was about (see Nudgie/chat/task_matching.py)
+    nudgie_task = models.ForeignKey(
+        "NudgieTask",
+        related_name="conversation_lines",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+
+    class Meta:
+        indexes = [
+            # the user-visible transcript, which leaves out internal prompts and replies
+            # (DIALOGUE_TYPE_SYSTEM_MESSAGE)
+            models.Index(
+                fields=["user", "id"],
+                condition=~models.Q(dialogue_type="system_message"),
+                name="conversation_visible_idx",
+            )
+        ]
 
     def __str__(self):
         return f"Conversation with {self.user.username} - {self.timestamp}"
 
 
+class ConversationSummary(models.Model):
+    # Rolling summary of the older part of a user's conversation. Every line up to and including
+    # summarized_through_id has been folded into the summary, so only the lines after it need to be
+    # sent to the AI verbatim.
+    user = models.OneToOneField(
+        User, related_name="conversation_summary", on_delete=models.CASCADE
+    )
+    content = models.TextField(blank=True, default="")
+    summarized_through_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Conversation summary for {self.user.username} through line {self.summarized_through_id}"
+
+
+class ConversationArchiveManifest(models.Model):
+    # Transcript of a finished goal: the user's lines after from_line_id, through through_line_id.
+    # The archival job (see Nudgie/chat/archive.py) moves them into compressed chunks in batches,
+    # and archived_through_id is how far it has got, so that an interrupted run picks up from there.
+    user = models.ForeignKey(
+        User, related_name="conversation_archives", on_delete=models.CASCADE
+    )
+    goal = models.OneToOneField(
+        "Goal",
+        related_name="archive_manifest",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+    goal_name = models.CharField(max_length=100)
+    from_line_id = models.PositiveBigIntegerField()
+    through_line_id = models.PositiveBigIntegerField()
+    archived_through_id = models.PositiveBigIntegerField()
+    line_count = models.PositiveIntegerField(default=0)
+    raw_bytes = models.PositiveBigIntegerField(default=0)
+    compressed_bytes = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Transcript of {self.goal_name} for {self.user.username}"
+
+
+class ConversationArchiveChunk(models.Model):
+    # A batch of archived lines: zlib-compressed JSON, one line of conversation per line.
+    manifest = models.ForeignKey(
+        ConversationArchiveManifest, related_name="chunks", on_delete=models.CASCADE
+    )
+    first_line_id = models.PositiveBigIntegerField()
+    last_line_id = models.PositiveBigIntegerField()
+    line_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+
 class Goal(models.Model):
     user = models.ForeignKey(User, related_name="goals", on_delete=models.CASCADE)
     goal_name = models.CharField(max_length=100)
@@ -56,12 +130,194 @@ class NudgieTask(models.Model):
         Goal, related_name="nudgie_tasks", on_delete=models.CASCADE, null=True
     )
     due_date = models.DateTimeField()
+    # when the reminder for this occurrence fires (the crontab's next run time when it was created)
+    reminder_time = models.DateTimeField(null=True, blank=True)
     completed = models.BooleanField(default=False)
 
     def __str__(self):
         return f"{self.task.name=} {self.goal.goal_name=} {self.due_date=} {self.completed=}"
 
 
+class ScheduledEvent(models.Model):
+    # A one-off job (nudge, deadline or goal end). These used to be one-off PeriodicTasks, but beat's
+    # DatabaseScheduler reloads its whole schedule whenever that table changes, so they're kept here
+    # and fired by the dispatcher instead (see Nudgie/scheduling/events.py). Deleted once handled.
+    user = models.ForeignKey(
+        User, related_name="scheduled_events", on_delete=models.CASCADE
+    )
+    dialogue_type = models.CharField(max_length=50)
+    handler = models.CharField(max_length=200)  # name of the Celery task
+    fire_at = models.DateTimeField()
+    goal = models.ForeignKey(
+        "Goal",
+        related_name="scheduled_events",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+    nudgie_task = models.ForeignKey(
+        "NudgieTask",
+        related_name="scheduled_events",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+    kwargs = models.TextField()  # the TaskData, as for a PeriodicTask
+    # set when the dispatcher hands the event to its handler (to its fire time if that's later, when
+    # it's handed to Celery with an ETA)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    # set when a handler starts on the event, so that a second delivery of it leaves it alone
+    started_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # set when the event is given up on, after SCHEDULED_EVENT_MAX_ATTEMPTS failed attempts
+    failed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["fire_at"], name="scheduled_event_fire_at_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.dialogue_type} for user {self.user_id} at {self.fire_at}"
+
+
+class TaskListChange(models.Model):
+    # When the user's jobs (PeriodicTasks and ScheduledEvents) were last created, changed or deleted,
+    # which is the version of their task list in the test tool (see Nudgie/scheduling/task_list.py).
+    user = models.OneToOneField(
+        User,
+        related_name="task_list_change",
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    last_update = models.DateTimeField()
+
+
+class CrontabKey(models.Model):
+    # The normalized schedule of a CrontabSchedule, so that identical schedules share a single row
+    # (see Nudgie/scheduling/crontabs.py). django-celery-beat's table has no unique constraint of its
+    # own. used_at keeps a crontab which was just handed out from being collected as an orphan before
+    # its PeriodicTask is saved.
+    key = models.CharField(max_length=255, unique=True)
+    crontab = models.OneToOneField(
+        CrontabSchedule, related_name="interned_key", on_delete=models.CASCADE
+    )
+    used_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.key
+
+
+class ScheduledJobLink(models.Model):
+    # Who a recurring job (a reminder's PeriodicTask) belongs to. django-celery-beat only has the
+    # job's TaskData as JSON in its kwargs, so without this a user's or a goal's jobs can only be found
+    # by scanning it. Kept up to date by the scheduler (one-off jobs are ScheduledEvents, which have
+    # these columns of their own).
+    periodic_task = models.OneToOneField(
+        PeriodicTask, related_name="job_link", on_delete=models.CASCADE
+    )
+    user = models.ForeignKey(
+        User, related_name="scheduled_job_links", on_delete=models.CASCADE
+    )
+    goal = models.ForeignKey(
+        "Goal",
+        related_name="scheduled_job_links",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+    # the NudgieTask for the job's current due date
+    nudgie_task = models.ForeignKey(
+        "NudgieTask",
+        related_name="scheduled_job_links",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+    dialogue_type = models.CharField(max_length=50)
+    next_run_time = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "next_run_time"], name="job_link_user_next_run_idx"
+            ),
+            models.Index(fields=["next_run_time"], name="job_link_next_run_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.dialogue_type} for user {self.user_id} at {self.next_run_time}"
+
+
+class PregeneratedMessage(models.Model):
+    # A reminder or nudge drafted shortly before its scheduled job fires, so that the job only has
+    # to save it (see Nudgie/chat/pregeneration.py). Deleted along with its job, which is either a
+    # reminder's PeriodicTask or a nudge's ScheduledEvent.
+    periodic_task = models.OneToOneField(
+        PeriodicTask,
+        related_name="pregenerated_message",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+    scheduled_event = models.OneToOneField(
+        ScheduledEvent,
+        related_name="pregenerated_message",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    dialogue_type = models.CharField(max_length=50)
+    fire_at = models.DateTimeField()
+    prompt = models.TextField()
+    content = models.TextField()
+    # the user's latest Conversation line when the draft was generated
+    context_through_id = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class RateLimitBucket(models.Model):
+    # Token bucket shared by every process that calls OpenAI (see Nudgie/chat/rate_limit.py).
+    name = models.CharField(max_length=50, unique=True)
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField()
+
+
+class CircuitBreaker(models.Model):
+    # Shared circuit breaker state for calls to an upstream service (see Nudgie/chat/rate_limit.py).
+    name = models.CharField(max_length=50, unique=True)
+    state = models.CharField(
+        max_length=10,
+        default="closed",
+        choices=[("closed", "Closed"), ("open", "Open"), ("half_open", "Half open")],
+    )
+    failure_count = models.PositiveIntegerField(default=0)
+    opened_at = models.DateTimeField(null=True, blank=True)
+
+
+class LlmCallRecord(models.Model):
+    # One row per OpenAI call (cache hits included), see Nudgie/chat/instrumentation.py.
+    created_at = models.DateTimeField()
+    day = models.DateField()
+    call_site = models.CharField(max_length=100)
+    dialogue_type = models.CharField(max_length=50, blank=True)
+    model = models.CharField(max_length=50)
+    # memory / db (cache tier that served the call), miss, or bypass (cache not consulted)
+    cache_status = models.CharField(max_length=10)
+    wall_ms = models.FloatField()
+    first_token_ms = models.FloatField(null=True, blank=True)  # streaming calls only
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    completion_tokens = models.PositiveIntegerField(null=True, blank=True)
+    success = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["day", "dialogue_type"]),
+        ]
+
+
 class MockedTime(models.Model):
     # the CASCADE value means that if the user is deleted, all of their mocked times will be deleted
     user = models.ForeignKey(
@@ -73,5 +329,11 @@ class MockedTime(models.Model):
 class CachedApiResponse(models.Model):
     # This is a model for caching the openAI API responses. Right now the API is quite slow, so
     # this should significantly speed up the development process.
-    request_params = models.JSONField()
+    # Rows are keyed by a SHA-256 digest of the request (see Nudgie/chat/response_cache.py) rather
+    # than the request itself, so that lookups are a single indexed equality check.
+    request_hash = models.CharField(max_length=64, unique=True)
     response = models.JSONField()
+    size_bytes = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed = models.DateTimeField(db_index=True)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
@@ -0,0 +1,154 @@
+"""
+Keeps the scheduler tables from growing without bound. Identical schedules are interned: every
+CrontabSchedule is created through intern_crontab, which looks it up by its normalized schedule (a
+CrontabKey, which has the unique index django-celery-beat's table lacks) and only creates a row for a
+schedule it hasn't seen before.
+
+A background job then collects what's left behind: one-off PeriodicTasks which have fired (beat
+disables them, but never deletes them) and crontabs which no PeriodicTask uses any more. It deletes
+them in batches, each in its own transaction and re-checked as it's deleted, so an interrupted run
+loses nothing and the next run simply carries on with whatever is left.
+"""
+
+import re
+from datetime import timedelta
+from typing import NamedTuple, Optional
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+from django_celery_beat.models import CrontabSchedule, PeriodicTask
+
+from Nudgie.constants import (
+    SCHEDULE_GC_BATCH_SIZE,
+    SCHEDULE_GC_GRACE_SECONDS,
+    SCHEDULE_GC_MAX_BATCHES_PER_RUN,
+)
+from Nudgie.models import CrontabKey
+
+CRONTAB_FIELDS = ["minute", "hour", "day_of_month", "month_of_year", "day_of_week"]
+CRONTAB_TIMEZONE_FIELD = "timezone"
+
+
+class ScheduleGarbage(NamedTuple):
+    periodic_tasks: int
+    crontabs: int
+
+
+class TableSize(NamedTuple):
+    rows: int
+    bytes: Optional[int]  # only known on PostgreSQL
+
+
+def normalize_crontab_field(value) -> str:
+    """'*' if unset, lowercase, without spaces and without leading zeros ('05' is '5')."""
+    value = str("*" if value is None else value).strip().lower().replace(" ", "")
+    return re.sub(r"\b0+(?=\d)", "", value) or "*"
+
+
+def get_crontab_fields(fields: dict) -> dict:
+    normalized = {
+        field: normalize_crontab_field(fields.get(field)) for field in CRONTAB_FIELDS
+    }
+    normalized[CRONTAB_TIMEZONE_FIELD] = str(
+        fields.get(CRONTAB_TIMEZONE_FIELD)
+        or CrontabSchedule._meta.get_field(CRONTAB_TIMEZONE_FIELD).get_default()
+    )
+    return normalized
+
+
+def get_crontab_key(fields: dict) -> str:
+    """The normalized schedule, e.g. '0 9 * * 1,3 UTC'."""
+    return " ".join(get_crontab_fields(fields).values())
+
+
+def intern_crontab(**fields) -> CrontabSchedule:
+    """
+    Returns the CrontabSchedule for the given schedule fields (as for CrontabSchedule.objects.create),
+    creating it only if there isn't one for the same normalized schedule yet. An identical crontab
+    from before interning is adopted rather than duplicated.
+    """
+    key = get_crontab_key(fields)
+    now = timezone.now()
+    interned = CrontabKey.objects.filter(key=key).select_related("crontab").first()
+    if interned:
+        CrontabKey.objects.filter(id=interned.id).update(used_at=now)
+        return interned.crontab
+
+    normalized = get_crontab_fields(fields)
+    try:
+        with transaction.atomic():
+            crontab = CrontabSchedule.objects.filter(
+                **normalized, interned_key__isnull=True
+            ).first() or CrontabSchedule.objects.create(**normalized)
+            CrontabKey.objects.create(key=key, crontab=crontab, used_at=now)
+    except IntegrityError:
+        # interned concurrently
+        return CrontabKey.objects.select_related("crontab").get(key=key).crontab
+
+    return crontab
+
+
+def get_fired_one_off_tasks() -> QuerySet:
+    # beat disables a one-off task once it has run it
+    return PeriodicTask.objects.filter(one_off=True).filter(
+        Q(enabled=False) | Q(last_run_at__isnull=False)
+    )
+
+
+def get_orphaned_crontabs() -> QuerySet:
+    grace_cutoff = timezone.now() - timedelta(seconds=SCHEDULE_GC_GRACE_SECONDS)
+    return CrontabSchedule.objects.filter(periodictask__isnull=True).exclude(
+        interned_key__used_at__gte=grace_cutoff
+    )
+
+
+def delete_next_batch(
+    garbage: QuerySet, batch_size: int = SCHEDULE_GC_BATCH_SIZE
+) -> int:
+    """Deletes the next batch of rows matching `garbage`. Returns how many were deleted."""
+    with transaction.atomic():
+        ids = list(garbage.order_by("id").values_list("id", flat=True)[:batch_size])
+        # the rows are re-checked as they're deleted, in case one was put back to use meanwhile
+        garbage.filter(id__in=ids).delete()
+
+    return len(ids)
+
+
+def delete_schedule_garbage(
+    max_batches: int = SCHEDULE_GC_MAX_BATCHES_PER_RUN,
+) -> ScheduleGarbage:
+    """
+    Deletes fired one-off PeriodicTasks, then orphaned crontabs (including those the deleted tasks
+    leave behind), at most max_batches batches in all. Returns how many of each were deleted.
+    """
+    deleted = {}
+    batches = 0
+    for name, get_garbage in (
+        ("periodic_tasks", get_fired_one_off_tasks),
+        ("crontabs", get_orphaned_crontabs),
+    ):
+        deleted[name] = 0
+        while batches < max_batches:
+            batches += 1
+            batch = delete_next_batch(get_garbage())
+            deleted[name] += batch
+            if batch < SCHEDULE_GC_BATCH_SIZE:
+                break
+
+    return ScheduleGarbage(**deleted)
+
+
+def get_schedule_table_sizes() -> dict[str, TableSize]:
+    """Row counts (and on PostgreSQL, sizes on disk) of the scheduler tables, by table name."""
+    sizes = {}
+    for model in (PeriodicTask, CrontabSchedule, CrontabKey):
+        table = model._meta.db_table
+        size_bytes = None
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_total_relation_size(%s)", [table])
+                size_bytes = cursor.fetchone()[0]
+        sizes[table] = TableSize(model.objects.count(), size_bytes)
+
+    return sizes
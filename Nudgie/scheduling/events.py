@@ -0,0 +1,338 @@
+"""
+One-off jobs (nudges, deadlines and goal ends) are stored as ScheduledEvents rather than one-off
+PeriodicTasks. Beat's DatabaseScheduler re-reads its whole schedule whenever the PeriodicTask table
+changes, and one-off jobs are created and deleted all the time, so that table is left to the
+recurring reminders and the fixed beat entries.
+
+A dispatcher on the beat schedule claims the events that are due in batches (one indexed query per
+batch, however many events are pending) and enqueues their handlers with the event's id. Each handler
+deletes its event once it's done. A claim which is never followed by the event being handled (e.g.
+the message was lost) expires after SCHEDULED_EVENT_CLAIM_TIMEOUT_SECONDS and the event is dispatched
+again, so the same event can be delivered more than once. Handlers (see event_handler) start on an
+event with a conditional update, so only one delivery runs at a time and the others exit, as do
+deliveries of events which are already gone. A handler which fails releases the event to be
+dispatched again once its claim expires; after SCHEDULED_EVENT_MAX_ATTEMPTS failed attempts the
+event is given up on (failed_at is set) and kept for inspection.
+
+With ETA delivery (settings.SCHEDULED_EVENT_DELIVERY) the dispatcher instead hands events to Celery
+up to SCHEDULED_EVENT_ETA_HORIZON_SECONDS ahead of time, with their fire time as the ETA, and events
+scheduled within the horizon are handed over straight away. The table stays the ledger: the claim
+of an event handed over early only starts once it's due, so an ETA message lost with the broker is
+dispatched again like any other lost message, and cancelling an event revokes its Celery task (which
+has a fixed id per event, see get_celery_task_id).
+"""
+
+import functools
+import json
+from datetime import datetime, timedelta
+from typing import Optional
+
+from celery import current_app
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Case, F, Q, QuerySet, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from Nudgie.constants import (
+    QUEUE_NAME,
+    SCHEDULED_EVENT_BATCH_SIZE,
+    SCHEDULED_EVENT_CLAIM_TIMEOUT_SECONDS,
+    SCHEDULED_EVENT_DELIVERY_ETA,
+    SCHEDULED_EVENT_ETA_HORIZON_SECONDS,
+    SCHEDULED_EVENT_MAX_ATTEMPTS,
+    SCHEDULED_EVENT_MAX_BATCHES_PER_RUN,
+    SCHEDULED_EVENT_RUN_TIMEOUT_SECONDS,
+)
+from Nudgie.models import Goal, NudgieTask, ScheduledEvent
+from Nudgie.scheduling.periodic_task_helper import TaskData
+from Nudgie.scheduling.task_list import record_task_list_change
+from Nudgie.time_utils.time import TESTING, get_time
+
+
+def is_eta_delivery() -> bool:
+    """
+    Whether events are handed to Celery ahead of time with an ETA. ETAs are in real time, so while
+    time is mocked for testing the dispatcher delivers the events when they're due instead.
+    """
+    return (
+        settings.SCHEDULED_EVENT_DELIVERY == SCHEDULED_EVENT_DELIVERY_ETA
+        and not TESTING
+    )
+
+
+def get_dispatch_horizon() -> timedelta:
+    """How far ahead of their fire time events are dispatched."""
+    if is_eta_delivery():
+        return timedelta(seconds=SCHEDULED_EVENT_ETA_HORIZON_SECONDS)
+    return timedelta(0)
+
+
+def get_celery_task_id(event_id: int) -> str:
+    # fixed per event, so that revoking it also covers any redelivery of the event
+    return f"scheduled-event-{event_id}"
+
+
+def get_pending_events_q(now: datetime) -> Q:
+    """Events which haven't been handed to their handler yet, or have been but aren't due yet."""
+    return Q(failed_at__isnull=True) & (
+        Q(claimed_at__isnull=True) | Q(claimed_at__gt=now)
+    )
+
+
+def get_not_running_q(now: datetime) -> Q:
+    """Events which no handler is working on (or one started so long ago that it must have died)."""
+    run_expiry = now - timedelta(seconds=SCHEDULED_EVENT_RUN_TIMEOUT_SECONDS)
+    return Q(started_at__isnull=True) | Q(started_at__lt=run_expiry)
+
+
+def send_event(event: ScheduledEvent, now: datetime) -> None:
+    """Enqueues the event's handler, with the event's fire time as the ETA if it isn't due yet."""
+    current_app.send_task(
+        event.handler,
+        args=(event.id,),
+        queue=QUEUE_NAME,
+        task_id=get_celery_task_id(event.id),
+        eta=event.fire_at if event.fire_at > now else None,
+    )
+
+
+def schedule_event(
+    task_data: TaskData,
+    handler: str,
+    goal: Optional[Goal] = None,
+    nudgie_task: Optional[NudgieTask] = None,
+) -> ScheduledEvent:
+    """Schedules a one-off job, which fires at task_data.next_run_time."""
+    fire_at = datetime.fromisoformat(task_data.next_run_time)
+    now = timezone.now()
+    # within the ETA horizon it's handed over now, as the dispatcher would on its next run anyway
+    send_now = is_eta_delivery() and fire_at <= now + get_dispatch_horizon()
+    event = ScheduledEvent.objects.create(
+        user_id=task_data.user_id,
+        dialogue_type=task_data.dialogue_type,
+        handler=handler,
+        fire_at=fire_at,
+        goal=goal,
+        nudgie_task=nudgie_task,
+        kwargs=task_data.get_as_kwargs(),
+        claimed_at=max(fire_at, now) if send_now else None,
+    )
+    record_task_list_change([task_data.user_id])
+    if send_now:
+        transaction.on_commit(lambda: send_event(event, now))
+    return event
+
+
+def get_task_data_from_event(event: ScheduledEvent) -> TaskData:
+    return TaskData(crontab=None, **json.loads(event.kwargs))
+
+
+def get_event_task_data(event_id: int) -> Optional[TaskData]:
+    """Returns the event's TaskData, or None if the event has already been handled."""
+    event = ScheduledEvent.objects.filter(id=event_id).first()
+    return get_task_data_from_event(event) if event else None
+
+
+def start_event(event_id: int) -> Optional[TaskData]:
+    """
+    Marks a handler as working on the event, and returns its TaskData. Returns None if the event is
+    gone, given up on, or another delivery of it is already being handled.
+    """
+    now = timezone.now()
+    started = ScheduledEvent.objects.filter(
+        get_not_running_q(now),
+        id=event_id,
+        failed_at__isnull=True,
+        attempts__lt=SCHEDULED_EVENT_MAX_ATTEMPTS,
+    ).update(started_at=now, attempts=F("attempts") + 1)
+    return get_event_task_data(event_id) if started else None
+
+
+def fail_event(event_id: int, error: Exception) -> None:
+    """
+    Releases an event whose handler failed, to be dispatched again once its claim expires, or gives
+    up on it if that was its last attempt.
+    """
+    now = timezone.now()
+    ScheduledEvent.objects.filter(id=event_id).update(
+        started_at=None,
+        failed_at=Case(
+            When(attempts__gte=SCHEDULED_EVENT_MAX_ATTEMPTS, then=Value(now)),
+            default=None,
+        ),
+    )
+    event = ScheduledEvent.objects.filter(id=event_id).first()
+    if event is None:
+        return
+    if event.failed_at:
+        print(
+            f"giving up on {event} (event {event_id}) after {event.attempts} attempts: {error!r}"
+        )
+        record_task_list_change([event.user_id])
+    else:
+        print(
+            f"attempt {event.attempts} at {event} (event {event_id}) failed: {error!r}"
+        )
+
+
+def event_handler(func):
+    """
+    Wraps the handler of a ScheduledEvent (a Celery task taking the event's id), which is called with
+    the event's id and TaskData. Only one delivery of an event is handled at a time (see
+    start_event), and the event is deleted once its handler returns, or released to be retried if
+    it raises.
+    """
+
+    def wrapper(event_id):
+        task_data = start_event(event_id)
+        if task_data is None:
+            print(
+                f"{func.__name__}: event {event_id} is already handled or being handled"
+            )
+            return
+
+        try:
+            func(event_id, task_data)
+        except Exception as error:
+            fail_event(event_id, error)
+            raise
+        complete_event(event_id)
+
+    # not functools.wraps, whose __wrapped__ would give Celery the wrapped function's signature
+    functools.update_wrapper(wrapper, func, updated=())
+    del wrapper.__wrapped__
+    return wrapper
+
+
+def complete_event(event_id: int) -> None:
+    events = ScheduledEvent.objects.filter(id=event_id)
+    user_ids = list(events.values_list("user_id", flat=True))
+    deleted, _ = events.delete()
+    if deleted:
+        record_task_list_change(user_ids)
+
+
+def cancel_events(events: QuerySet) -> None:
+    """Deletes the events, revoking the Celery tasks of any handed over ahead of time."""
+    handed_over = list(
+        events.filter(claimed_at__gt=timezone.now()).values_list("id", flat=True)
+    )
+    if handed_over:
+        current_app.control.revoke(
+            [get_celery_task_id(event_id) for event_id in handed_over]
+        )
+
+    user_ids = list(events.values_list("user_id", flat=True).distinct())
+    deleted, _ = events.delete()
+    if deleted:
+        record_task_list_change(user_ids)
+
+
+def claim_event(event_id: int) -> bool:
+    """
+    Claims a single event, so that the dispatcher leaves it alone (the test tool runs handlers
+    itself), revoking its Celery task if it was handed over ahead of time. Returns False if it has
+    already been handed to its handler.
+    """
+    now = timezone.now()
+    handed_over = ScheduledEvent.objects.filter(
+        id=event_id, claimed_at__gt=now
+    ).exists()
+    claimed = ScheduledEvent.objects.filter(
+        get_pending_events_q(now), id=event_id
+    ).update(claimed_at=now)
+    if claimed and handed_over:
+        current_app.control.revoke(get_celery_task_id(event_id))
+    return bool(claimed)
+
+
+def get_dispatch_clocks(
+    user_ids: Optional[QuerySet] = None,
+) -> list[tuple[Optional[int], datetime]]:
+    """
+    The current time to dispatch against, as (user id, time) pairs. That's the real time for every
+    user, except while time is mocked for testing (see Nudgie/time_utils/time.py), when each user
+    (with scheduled events, or in user_ids) has their own clock.
+    """
+    if not TESTING:
+        return [(None, timezone.now())]
+
+    if user_ids is None:
+        user_ids = ScheduledEvent.objects.values_list("user_id", flat=True)
+    user_ids = user_ids.distinct()
+    return [(user.id, get_time(user)) for user in User.objects.filter(id__in=user_ids)]
+
+
+def claim_due_events(
+    now: datetime,
+    user_id: Optional[int] = None,
+    batch_size: int = SCHEDULED_EVENT_BATCH_SIZE,
+    horizon: timedelta = timedelta(0),
+) -> list[ScheduledEvent]:
+    """
+    Claims the next batch of events which are due within `horizon` of now (and not claimed
+    already), oldest first. The claim of an event which isn't due yet starts at its fire time.
+    """
+    claimed_at = timezone.now()
+    claim_expiry = claimed_at - timedelta(seconds=SCHEDULED_EVENT_CLAIM_TIMEOUT_SECONDS)
+    due_events = ScheduledEvent.objects.filter(
+        Q(claimed_at__isnull=True) | Q(claimed_at__lt=claim_expiry),
+        get_not_running_q(claimed_at),
+        fire_at__lte=now + horizon,
+        failed_at__isnull=True,
+    )
+    if user_id is not None:
+        due_events = due_events.filter(user_id=user_id)
+
+    # events out of attempts (their last handler died without failing them) are given up on
+    exhausted = list(
+        due_events.filter(attempts__gte=SCHEDULED_EVENT_MAX_ATTEMPTS).values_list(
+            "id", "user_id"
+        )
+    )
+    if exhausted:
+        ScheduledEvent.objects.filter(id__in=[id for id, _ in exhausted]).update(
+            failed_at=claimed_at
+        )
+        print(
+            f"giving up on {len(exhausted)} scheduled events whose handlers didn't finish"
+        )
+        record_task_list_change(user_id for _, user_id in exhausted)
+
+    with transaction.atomic():
+        # concurrent dispatchers skip each other's rows rather than waiting for them
+        events = list(
+            due_events.select_for_update(skip_locked=True).order_by("fire_at", "id")[
+                :batch_size
+            ]
+        )
+        ScheduledEvent.objects.filter(id__in=[event.id for event in events]).update(
+            claimed_at=(
+                Greatest(F("fire_at"), Value(claimed_at)) if horizon else claimed_at
+            )
+        )
+
+    return events
+
+
+def dispatch_due_events(max_batches: int = SCHEDULED_EVENT_MAX_BATCHES_PER_RUN) -> int:
+    """
+    Enqueues the handlers of the events which are due (or with ETA delivery, due within the
+    horizon), at most max_batches batches of them. Returns how many were dispatched.
+    """
+    horizon = get_dispatch_horizon()
+    dispatched = 0
+    batches = 0
+    for user_id, now in get_dispatch_clocks():
+        while batches < max_batches:
+            batches += 1
+            events = claim_due_events(now, user_id, horizon=horizon)
+            for event in events:
+                send_event(event, now)
+            dispatched += len(events)
+            if len(events) < SCHEDULED_EVENT_BATCH_SIZE:
+                break
+
+    return dispatched
@@ -1,17 +1,24 @@
 import json
+from datetime import datetime
 from typing import Any, NamedTuple, Optional
 
 from django.contrib.auth.models import User
+from django.db import transaction
 from django_celery_beat.models import CrontabSchedule, PeriodicTask
 
 from Nudgie.constants import (
     CRONTAB_AI_STRUCT_KEY,
     DIALOGUE_TYPE_REMINDER,
     PERIODIC_TASK_CRONTAB_FIELD,
+    PERIODIC_TASK_NEXT_RUNTIME_FIELD,
+    PERIODIC_TASK_NUDGIE_TASK_ID_FIELD,
     REMINDER_DATA_AI_STRUCT_KEY,
     REMINDER_NOTES_AI_STRUCT_KEY,
     TASK_NAME_AI_STRUCT_KEY,
 )
+from Nudgie.models import ScheduledJobLink
+from Nudgie.scheduling.crontabs import intern_crontab
+from Nudgie.scheduling.task_list import record_task_list_change
 from Nudgie.time_utils.time import (
     calculate_due_date_from_crontab,
     get_next_run_time_from_crontab,
@@ -26,7 +33,10 @@ class TaskData(NamedTuple):
     due_date: str
     dialogue_type: str
     reminder_notes: Optional[str] = None
-    next_run_time: Optional[str] = None  # only for testing tool, get rid of later
+    next_run_time: Optional[str] = None  # testing tool and message pregeneration
+    # the job's NudgieTask, so handlers can fetch it by primary key (None for goal ends, and for
+    # jobs scheduled before it was stored, see add_nudgie_task_ids)
+    nudgie_task_id: Optional[int] = None
 
     def get_as_kwargs(self):
         return json.dumps(
@@ -50,7 +60,7 @@ class TaskData(NamedTuple):
 def modify_periodic_task(id: int, task_data: Optional[TaskData] = None):
     """
     Modifies a periodic task by updating the crontab and kwargs fields with the
-    values provided in task_data.
+    values provided in task_data, and its ScheduledJobLink to match.
     """
     task = PeriodicTask.objects.get(id=id)
     current_kwargs = json.loads(task.kwargs)
@@ -66,11 +76,34 @@ def modify_periodic_task(id: int, task_data: Optional[TaskData] = None):
                     current_kwargs[key] = value
 
         task.kwargs = json.dumps(current_kwargs)
-        task.save()
+        link_fields = {}
+        if current_kwargs.get(PERIODIC_TASK_NEXT_RUNTIME_FIELD):
+            link_fields["next_run_time"] = datetime.fromisoformat(
+                current_kwargs[PERIODIC_TASK_NEXT_RUNTIME_FIELD]
+            )
+        if current_kwargs.get(PERIODIC_TASK_NUDGIE_TASK_ID_FIELD) is not None:
+            link_fields["nudgie_task_id"] = current_kwargs[
+                PERIODIC_TASK_NUDGIE_TASK_ID_FIELD
+            ]
+
+        with transaction.atomic():
+            task.save()
+            if link_fields:
+                ScheduledJobLink.objects.filter(periodic_task_id=id).update(
+                    **link_fields
+                )
+            record_task_list_change(
+                ScheduledJobLink.objects.filter(periodic_task_id=id).values_list(
+                    "user_id", flat=True
+                )
+            )
 
 
 def get_periodic_task_data(id):
-    task = PeriodicTask.objects.get(id=id)
+    return get_task_data_from_periodic_task(PeriodicTask.objects.get(id=id))
+
+
+def get_task_data_from_periodic_task(task: PeriodicTask) -> TaskData:
     kwargs = json.loads(task.kwargs)
 
     return TaskData(crontab=task.crontab, **kwargs)
@@ -85,9 +118,7 @@ def convert_chatgpt_task_data_to_task_data(
     Convert a dictionary of key-value pairs from the chatgpt task data 
     to a TaskData object.
     """
-    cron_schedule, _ = CrontabSchedule.objects.get_or_create(
-        **chatgpt_task_data[CRONTAB_AI_STRUCT_KEY]
-    )
+    cron_schedule = intern_crontab(**chatgpt_task_data[CRONTAB_AI_STRUCT_KEY])
     due_date = calculate_due_date_from_crontab(cron_schedule, user).isoformat()
 
     return TaskData(
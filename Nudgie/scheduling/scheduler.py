@@ -1,7 +1,10 @@
 from datetime import datetime
+from typing import Optional
 
 from django.contrib.auth.models import User
-from django_celery_beat.models import CrontabSchedule, PeriodicTask
+from django.db import transaction
+from django.db.models import QuerySet
+from django_celery_beat.models import PeriodicTask
 
 from Nudgie.constants import (
     DEADLINE_HANDLER,
@@ -14,33 +17,29 @@ from Nudgie.constants import (
     QUEUE_NAME,
     REMINDER_HANDLER,
 )
-from Nudgie.models import Goal, NudgieTask, Task
+from Nudgie.models import Goal, NudgieTask, ScheduledEvent, ScheduledJobLink, Task
+from Nudgie.scheduling.events import cancel_events, schedule_event
 from Nudgie.scheduling.periodic_task_helper import (
     TaskData,
     convert_chatgpt_task_data_to_task_data,
 )
-from Nudgie.time_utils.time import date_to_crontab, get_next_run_time_from_crontab
+from Nudgie.scheduling.task_list import record_task_list_change
 
 
-def schedule_deadline_task(task_data: TaskData) -> None:
-    """Schedule a deadline task to run at the specified crontab time."""
-    due_date_as_datetime = datetime.fromisoformat(task_data.due_date)
-
-    print(f"creating crontab for {due_date_as_datetime}")
-    crontab = date_to_crontab(due_date_as_datetime)
-
-    # Update the TaskData job non-destructively
+def schedule_deadline_task(task_data: TaskData, nudgie_task: NudgieTask) -> None:
+    """Schedule a deadline event for the NudgieTask's due date."""
     task_data = task_data._replace(
-        crontab=crontab,
+        crontab=None,
         dialogue_type=DIALOGUE_TYPE_DEADLINE,
-        next_run_time=get_next_run_time_from_crontab(
-            crontab, User.objects.get(id=task_data.user_id)
-        ).isoformat(),
+        next_run_time=task_data.due_date,
+        nudgie_task_id=nudgie_task.id,
+    )
+    schedule_event(
+        task_data, DEADLINE_HANDLER, goal=nudgie_task.goal, nudgie_task=nudgie_task
     )
-    schedule_periodic_task(task_data, DEADLINE_HANDLER, True)
 
 
-def create_nudgie_task(task_data: TaskData) -> None:
+def create_nudgie_task(task_data: TaskData) -> NudgieTask:
     """Creates a NudgieTask, indicating an outstanding task. NudgieTasks are used as a source of truth as to which tasks
     are still pending completion, and which have been completed. Each time a NudgieTask is logged in the database, a new
     deadline job is also scheduled. This deadline job, when triggered, will notify the user that he failed to complete the
@@ -48,59 +47,84 @@ def create_nudgie_task(task_data: TaskData) -> None:
     user = User.objects.get(id=task_data.user_id)
     goal = Goal.objects.get(goal_name=task_data.goal_name, user=user)
     task = Task.objects.get(name=task_data.task_name, goal=goal)
-    NudgieTask.objects.create(
+    nudgie_task = NudgieTask.objects.create(
         user=user,
         task=task,
         goal=goal,
         due_date=task_data.due_date,
+        reminder_time=task_data.next_run_time,
     )
 
-    schedule_deadline_task(task_data)
+    schedule_deadline_task(task_data, nudgie_task)
+    return nudgie_task
 
 
 def schedule_periodic_task(
-    task_data: TaskData, celery_task: str, one_off: bool = False
+    task_data: TaskData,
+    celery_task: str,
+    one_off: bool = False,
+    goal: Optional[Goal] = None,
+    nudgie_task: Optional[NudgieTask] = None,
 ):
     """Schedule a periodic task to run at the specified crontab time.
     task_data is a dictionary of key-value pairs that will be passed as kwargs
-    to the task.
+    to the task. Only for recurring jobs, one-off jobs are ScheduledEvents (see schedule_event).
+    The task is linked to its user, goal and NudgieTask by a ScheduledJobLink.
     """
-    PeriodicTask.objects.create(
-        crontab=task_data.crontab,
-        name=f"{task_data.user_id}: {task_data.dialogue_type} for {str(task_data.crontab)} created at {datetime.now().isoformat()}",
-        task=celery_task,
-        kwargs=task_data.get_as_kwargs(),
-        one_off=one_off,
-        queue=QUEUE_NAME,
+    with transaction.atomic():
+        periodic_task = PeriodicTask.objects.create(
+            crontab=task_data.crontab,
+            name=f"{task_data.user_id}: {task_data.dialogue_type} for {str(task_data.crontab)} created at {datetime.now().isoformat()}",
+            task=celery_task,
+            kwargs=task_data.get_as_kwargs(),
+            one_off=one_off,
+            queue=QUEUE_NAME,
+        )
+        ScheduledJobLink.objects.create(
+            periodic_task=periodic_task,
+            user_id=task_data.user_id,
+            goal=goal,
+            nudgie_task=nudgie_task,
+            dialogue_type=task_data.dialogue_type,
+            next_run_time=(
+                datetime.fromisoformat(task_data.next_run_time)
+                if task_data.next_run_time
+                else None
+            ),
+        )
+        record_task_list_change([task_data.user_id])
+
+
+def schedule_nudge(task_data: TaskData, nudgie_task: NudgieTask):
+    """Schedule a nudge for the NudgieTask, to fire at task_data.next_run_time."""
+    new_task_data = task_data._replace(
+        crontab=None, dialogue_type=DIALOGUE_TYPE_NUDGE, nudgie_task_id=nudgie_task.id
     )
-
-
-def schedule_nudge(task_data: TaskData):
-    """Schedule a nudge to run at the specified crontab time.
-    task_data is a dictionary of key-value pairs that will be passed as kwargs
-    to the task.
-    """
-    new_task_data = task_data._replace(dialogue_type=DIALOGUE_TYPE_NUDGE)
-    schedule_periodic_task(
-        task_data=new_task_data, celery_task=NUDGE_HANDLER, one_off=True
+    schedule_event(
+        new_task_data, NUDGE_HANDLER, goal=nudgie_task.goal, nudgie_task=nudgie_task
     )
 
 
-def schedule_goal_end(task_data: TaskData):
+def schedule_goal_end(task_data: TaskData, goal: Goal):
     """Schedule the event for when a goal's end date is reached."""
     new_task_data = task_data._replace(dialogue_type=DIALOGUE_TYPE_GOAL_END)
-    schedule_periodic_task(
-        task_data=new_task_data, celery_task=GOAL_END_HANDLER, one_off=True
-    )
+    schedule_event(new_task_data, GOAL_END_HANDLER, goal=goal)
 
 
-def schedule_reminder(task_data: TaskData):
+def schedule_reminder(task_data: TaskData, nudgie_task: NudgieTask):
     """Schedule a reminder to run at the specified crontab time.
     task_data is a dictionary of key-value pairs that will be passed as kwargs
     to the task.
     """
-    new_task_data = task_data._replace(dialogue_type=DIALOGUE_TYPE_REMINDER)
-    schedule_periodic_task(task_data=new_task_data, celery_task=REMINDER_HANDLER)
+    new_task_data = task_data._replace(
+        dialogue_type=DIALOGUE_TYPE_REMINDER, nudgie_task_id=nudgie_task.id
+    )
+    schedule_periodic_task(
+        task_data=new_task_data,
+        celery_task=REMINDER_HANDLER,
+        goal=nudgie_task.goal,
+        nudgie_task=nudgie_task,
+    )
 
 
 def schedule_tasks_from_crontab_list(crontab_list, goal_name, user):
@@ -108,5 +132,23 @@ def schedule_tasks_from_crontab_list(crontab_list, goal_name, user):
     for notif in crontab_list:
         task_data = convert_chatgpt_task_data_to_task_data(notif, goal_name, user)
 
-        create_nudgie_task(task_data)
-        schedule_reminder(task_data)
+        nudgie_task = create_nudgie_task(task_data)
+        schedule_reminder(task_data, nudgie_task)
+
+
+def get_user_periodic_tasks(user_id: int) -> QuerySet:
+    return PeriodicTask.objects.filter(job_link__user_id=user_id)
+
+
+def cancel_user_jobs(user_id: int) -> None:
+    """Deletes all of the user's scheduled jobs."""
+    get_user_periodic_tasks(user_id).delete()
+    cancel_events(ScheduledEvent.objects.filter(user_id=user_id))
+    record_task_list_change([user_id])
+
+
+def cancel_goal_jobs(goal: Goal, except_event_id: Optional[int] = None) -> None:
+    """Deletes the goal's scheduled jobs (except for the given event, e.g. the one being handled)."""
+    PeriodicTask.objects.filter(job_link__goal=goal).delete()
+    cancel_events(goal.scheduled_events.exclude(id=except_event_id))
+    record_task_list_change([goal.user_id])
@@ -0,0 +1,52 @@
+"""
+The version of each user's task list in the test tool (their PeriodicTasks and ScheduledEvents). The
+scheduler bumps a user's version (a TaskListChange row) whenever it creates, changes or deletes one of
+their jobs, so the browser only refreshes its task list when the user's own jobs changed, and can
+fetch just the items changed since the version it has (see get_task_list_delta in views.py).
+"""
+
+from datetime import datetime
+from typing import Iterable, Optional
+
+from django.utils import timezone
+
+from Nudgie.models import TaskListChange
+
+
+def record_task_list_change(user_ids: Iterable[int]) -> None:
+    """Bumps the task list version of each of the users, whose jobs were just changed."""
+    now = timezone.now()
+    for user_id in set(user_ids):
+        TaskListChange.objects.update_or_create(
+            user_id=user_id, defaults={"last_update": now}
+        )
+
+
+def get_task_list_last_change(user_id: int) -> Optional[datetime]:
+    """When one of the user's PeriodicTasks or ScheduledEvents was last created, changed or deleted."""
+    return (
+        TaskListChange.objects.filter(user_id=user_id)
+        .values_list("last_update", flat=True)
+        .first()
+    )
+
+
+def format_task_list_version(last_change: Optional[datetime]) -> str:
+    return last_change.isoformat() if last_change else ""
+
+
+def get_task_list_version(user_id: int) -> str:
+    return format_task_list_version(get_task_list_last_change(user_id))
+
+
+def get_task_list_versions(user_ids: Iterable[int]) -> dict[int, str]:
+    """The task list versions of the users, in one query."""
+    last_changes = dict(
+        TaskListChange.objects.filter(user_id__in=list(user_ids)).values_list(
+            "user_id", "last_update"
+        )
+    )
+    return {
+        user_id: format_task_list_version(last_changes.get(user_id))
+        for user_id in user_ids
+    }
@@ -12,6 +12,18 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 
+from Nudgie.constants import (
+    ARCHIVE_HANDLER,
+    ARCHIVE_INTERVAL_SECONDS,
+    DISPATCH_HANDLER,
+    PREGENERATION_HANDLER,
+    PREGENERATION_INTERVAL_SECONDS,
+    QUEUE_NAME,
+    SCHEDULE_GC_HANDLER,
+    SCHEDULE_GC_INTERVAL_SECONDS,
+    SCHEDULED_EVENT_DISPATCH_INTERVAL_SECONDS,
+)
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -177,6 +189,53 @@ CELERY_RESULT_BACKEND = "rpc://"
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 CELERY_TIMEZONE = "America/Lima"
 CELERY_BEAT_SCHEDULE_FILENAME = "./tmp/celerybeat-schedule"
+# Fixed beat entries. The DatabaseScheduler copies these into its PeriodicTask table on startup.
+# Besides these, beat only runs the recurring reminders; one-off jobs are fired by the dispatcher.
+CELERY_BEAT_SCHEDULE = {
+    "dispatch-scheduled-events": {
+        "task": DISPATCH_HANDLER,
+        "schedule": SCHEDULED_EVENT_DISPATCH_INTERVAL_SECONDS,
+        "options": {"queue": QUEUE_NAME},
+    },
+    "pregenerate-messages": {
+        "task": PREGENERATION_HANDLER,
+        "schedule": PREGENERATION_INTERVAL_SECONDS,
+        "options": {"queue": QUEUE_NAME},
+    },
+    "archive-conversation-history": {
+        "task": ARCHIVE_HANDLER,
+        "schedule": ARCHIVE_INTERVAL_SECONDS,
+        "options": {"queue": QUEUE_NAME},
+    },
+    "collect-schedule-garbage": {
+        "task": SCHEDULE_GC_HANDLER,
+        "schedule": SCHEDULE_GC_INTERVAL_SECONDS,
+        "options": {"queue": QUEUE_NAME},
+    },
+}
+
+# Base URL of the OpenAI API. None means the real API (or the OPENAI_BASE_URL environment variable).
+# Point it at the local stub for load testing, e.g. "http://127.0.0.1:8765/v1" after running
+# `py manage.py run_openai_stub --port 8765`.
+OPENAI_BASE_URL = None
+
+# Per-dialogue-type overrides for the OpenAI response cache key policies in Nudgie/constants.py,
+# e.g. {"nudge": "strip"}.
+CACHE_KEY_POLICY_OVERRIDES = {}
+
+# How completed tasks are identified, see TASK_COMPLETION_MODE_* in Nudgie/constants.py.
+TASK_COMPLETION_MODE = "single_call"
+
+# How one-off jobs are delivered, see SCHEDULED_EVENT_DELIVERY_* in Nudgie/constants.py.
+SCHEDULED_EVENT_DELIVERY = "dispatcher"
+
+# Overrides for the model routes in Nudgie/constants.py, merged field by field. Keys are dialogue
+# types or (dialogue type, call site) pairs, e.g. {"nudge": {"model": "gpt-4", "temperature": 1.2}}.
+MODEL_ROUTE_OVERRIDES = {}
+
+# When set to a file path, every OpenAI request is appended to it as a JSON line. The recording can be
+# replayed with `py manage.py cache_key_report <path>`.
+OPENAI_WORKLOAD_RECORD_PATH = None
 
 CACHES = {
     "default": {
@@ -7,12 +7,15 @@ function handleSubmit(input_val) {
     }
 
     let csrfToken = document.querySelector('[name=csrfmiddlewaretoken]').value;
+    // shown right away, and replaced by the saved lines once the reply is done (see refreshConversation)
     var conversationDiv = document.getElementById('conversation');
-    conversationDiv.innerHTML += '<strong>user :</strong> ' + input_val + '<br>';
+    conversationDiv.insertAdjacentHTML('beforeend', '<span class="pending-line"><strong>user :</strong> ' + input_val + '<br></span>');
 
     // fetch is nice because it is asynchronous, similar to AJAX but
     // with a nicer API and built into the browser.
-    fetch('/chatbot/api/', {
+    // The streaming endpoint responds with server-sent events, so the reply is rendered
+    // piece by piece as it is generated instead of all at once at the end.
+    fetch('/chatbot/api/stream/', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
@@ -23,21 +26,195 @@ function handleSubmit(input_val) {
             datetime: date_input
         })
     })
-        .then(response => response.json())
-        .then(data => {
-            var conversationDiv = document.getElementById('conversation');
-            conversationDiv.innerHTML += '<strong>' + data.sender + ':</strong> ' + data.message + '<br>';
-            document.getElementById('user_input').value = ''; // Clear input field
+        .then(response => {
+            let replySpan = startAssistantReply();
+            return readEventStream(response, data => {
+                replySpan.textContent += data.message;
+            });
         })
         .then(() => {
-            fetch('/get_task_list/')
-                .then(response => response.text())
-                .then(html => {
-                    document.getElementById('tasks').innerHTML = html;
-                })
+            document.getElementById('user_input').value = ''; // Clear input field
+            refreshConversation();
+            refreshTaskList();
+        });
+}
+
+function refreshConversation() {
+    // Fetches the lines after the last one on display and appends them, replacing the lines which
+    // were only shown while they were being sent or streamed. If the server says the cursor
+    // doesn't match anymore, it sends the latest page to replace the whole window with.
+    var conversationDiv = document.getElementById('conversation');
+
+    return fetch('/get_conversation_delta/?after=' + getConversationCursor())
+        .then(response => response.json())
+        .then(delta => {
+            if (delta.full) {
+                conversationDiv.innerHTML = delta.html;
+            } else {
+                conversationDiv.querySelectorAll('.pending-line').forEach(line => line.remove());
+                conversationDiv.insertAdjacentHTML('beforeend', delta.html);
+            }
+            scrollConversationToBottom();
+        });
+}
+
+function getConversationCursor() {
+    let lines = document.getElementById('conversation').getElementsByClassName('conversation-line');
+    return lines.length ? Number(lines[lines.length - 1].dataset.lineId) : 0;
+}
+
+function openConversationEvents() {
+    // New lines (including the reminders and nudges sent by the scheduler) and task list changes
+    // are pushed by the server as they happen, starting from what's on display.
+    let version = document.getElementById('task_list').dataset.version;
+    let source = new EventSource('/conversation_events/?after=' + getConversationCursor()
+        + '&version=' + encodeURIComponent(version));
+
+    source.addEventListener('line', event => {
+        let line = JSON.parse(event.data);
+        var conversationDiv = document.getElementById('conversation');
+        // while a message is being sent, its refreshConversation picks up the new lines instead
+        if (conversationDiv.querySelector('.pending-line')
+            || conversationDiv.querySelector('.conversation-line[data-line-id="' + line.id + '"]')) {
+            return;
+        }
+        // a line can arrive after later ones, if it was committed after them
+        let laterLine = Array.from(conversationDiv.getElementsByClassName('conversation-line'))
+            .find(element => Number(element.dataset.lineId) > line.id);
+        if (laterLine) {
+            laterLine.insertAdjacentHTML('beforebegin', line.html);
+            return;
+        }
+        conversationDiv.insertAdjacentHTML('beforeend', line.html);
+        scrollConversationToBottom();
+    });
+
+    source.addEventListener('tasks', event => {
+        if (JSON.parse(event.data).version !== document.getElementById('task_list').dataset.version) {
+            refreshTaskList();
+        }
+    });
+
+    // reconnect from what's on display now, rather than from the original cursor
+    source.onerror = () => {
+        source.close();
+        setTimeout(openConversationEvents, 3000);
+    };
+}
+
+function refreshTaskList() {
+    // Fetches the task list items which changed since the version on display, swaps them in, and
+    // puts the list in the order the server sent (dropping items that aren't in it anymore).
+    let taskList = document.getElementById('task_list');
+
+    return fetch('/get_task_list_delta/?version=' + encodeURIComponent(taskList.dataset.version))
+        .then(response => response.json())
+        .then(delta => {
+            if (delta.full) {
+                document.getElementById('tasks').innerHTML = delta.html;
+                return;
+            }
+            document.getElementById('server-time').textContent = delta.server_time;
+            taskList.dataset.version = delta.version;
+            if (!delta.order) {
+                return;
+            }
+
+            let items = {};
+            taskList.querySelectorAll('li[data-task-key]').forEach(item => {
+                items[item.dataset.taskKey] = item;
+            });
+            for (const changed of delta.items) {
+                let template = document.createElement('template');
+                template.innerHTML = changed.html.trim();
+                items[changed.id] = template.content.firstElementChild;
+            }
+
+            taskList.replaceChildren(...delta.order.map(id => items[id]).filter(item => item));
         });
 }
 
+function startAssistantReply() {
+    // Adds an empty assistant line to the conversation and returns the element that the
+    // streamed text should be appended to.
+    var conversationDiv = document.getElementById('conversation');
+    conversationDiv.insertAdjacentHTML('beforeend', '<span class="pending-line"><strong>assistant:</strong> <span class="streaming-reply"></span></span>');
+    scrollConversationToBottom();
+    let replySpans = conversationDiv.getElementsByClassName('streaming-reply');
+    return replySpans[replySpans.length - 1];
+}
+
+function scrollConversationToBottom() {
+    let conversationDiv = document.getElementById('conversation');
+    conversationDiv.scrollTop = conversationDiv.scrollHeight;
+}
+
+let loadingOlderConversation = false;
+
+function loadOlderConversation() {
+    // Only the latest page of the conversation is rendered up front. When there's more, the page
+    // starts with a marker holding the id of its first line, which is where the previous page
+    // ends. The marker is swapped out for that page, keeping the visible lines where they were.
+    var conversationDiv = document.getElementById('conversation');
+    let marker = conversationDiv.querySelector('.conversation-older');
+    if (!marker || loadingOlderConversation) {
+        return;
+    }
+
+    loadingOlderConversation = true;
+    fetch('/get_conversation_history/?before=' + marker.dataset.before)
+        .then(response => response.text())
+        .then(html => {
+            let previousHeight = conversationDiv.scrollHeight;
+            marker.remove();
+            conversationDiv.insertAdjacentHTML('afterbegin', html);
+            conversationDiv.scrollTop += conversationDiv.scrollHeight - previousHeight;
+        })
+        .finally(() => {
+            loadingOlderConversation = false;
+        });
+}
+
+async function readEventStream(response, onMessage) {
+    // Reads a server-sent event stream from a fetch response, calling onMessage with the parsed
+    // data of each message event. Resolves once the server sends the 'done' event.
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            return;
+        }
+        buffer += decoder.decode(value, { stream: true });
+
+        // events are separated by a blank line
+        let separatorIndex;
+        while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, separatorIndex);
+            buffer = buffer.slice(separatorIndex + 2);
+
+            let eventName = 'message';
+            let data = '';
+            for (const line of rawEvent.split('\n')) {
+                if (line.startsWith('event:')) {
+                    eventName = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            }
+
+            if (eventName === 'done') {
+                return;
+            }
+            if (data) {
+                onMessage(JSON.parse(data));
+            }
+        }
+    }
+}
+
 function standardSubmissionWrapper() {
     let textField = document.getElementById('user_input');
     let user_input = textField.value;
@@ -58,6 +235,14 @@ document.getElementById('test-button').addEventListener('click', function (event
 });
 
 document.addEventListener('DOMContentLoaded', function () {
+    scrollConversationToBottom();
+    openConversationEvents();
+    document.getElementById('conversation').addEventListener('scroll', function (event) {
+        if (event.target.scrollTop < 100) {
+            loadOlderConversation();
+        }
+    });
+
     document.getElementById('chatForm').addEventListener('submit', function (event) {
         event.preventDefault();
 
@@ -79,14 +264,14 @@ document.addEventListener('DOMContentLoaded', function () {
             const task_name = e.target.getAttribute('data-task-name');
             const due_date = e.target.getAttribute('data-due-date');
             const next_run_time = e.target.getAttribute('data-next-run-time');
-            const periodic_task_id = e.target.getAttribute('data-periodic-task-id');
+            const task_key = e.target.getAttribute('data-task-key');
 
-            triggerPeriodicTask(task_name, due_date, next_run_time, periodic_task_id);
+            triggerPeriodicTask(task_name, due_date, next_run_time, task_key);
         }
     });
 });
 
-function triggerPeriodicTask(task_name, due_date, next_run_time, periodic_task_id) {
+function triggerPeriodicTask(task_name, due_date, next_run_time, task_key) {
     // Handle the task trigger based on the task details
     console.log(`Task Name: ${task_name}, Due Date: ${due_date}`);
 
@@ -102,21 +287,11 @@ function triggerPeriodicTask(task_name, due_date, next_run_time, periodic_task_i
             task_name: task_name,
             due_date: due_date,
             next_run_time: next_run_time,
-            periodic_task_id: periodic_task_id
+            task_key: task_key
         })
     })
         .then(() => {
-            fetch('/get_conversation_display/')
-                .then(response => response.text())
-                .then(html => {
-                    document.getElementById('conversation').innerHTML = html;
-                })
-        })
-        .then(() => {
-            fetch('/get_task_list/')
-                .then(response => response.text())
-                .then(html => {
-                    document.getElementById('tasks').innerHTML = html;
-                })
+            refreshConversation();
+            refreshTaskList();
         });
 }
\ No newline at end of file
@@ -2,16 +2,25 @@ from datetime import datetime, timedelta
 
 from celery import shared_task
 from django.contrib.auth.models import User
-from django_celery_beat.models import PeriodicTask
 
+from Nudgie.chat.archive import archive_conversations, open_archive_manifest
 from Nudgie.chat.chatgpt import (
     generate_and_send_deadline,
-    generate_and_send_nudge,
     generate_and_send_performance_summary,
-    generate_and_send_reminder,
+)
+from Nudgie.chat.pregeneration import (
+    ScheduledJob,
+    pregenerate_upcoming_messages,
+    send_scheduled_message,
 )
 from Nudgie.config.chatgpt_inputs import PERFORMANCE_DATA_TEMPLATE_FOR_ONE_TASK
-from Nudgie.scheduling.scheduler import create_nudgie_task, schedule_nudge
+from Nudgie.scheduling.crontabs import delete_schedule_garbage
+from Nudgie.scheduling.events import dispatch_due_events, event_handler
+from Nudgie.scheduling.scheduler import (
+    cancel_goal_jobs,
+    create_nudgie_task,
+    schedule_nudge,
+)
 from Nudgie.time_utils.time import (
     calculate_due_date_from_crontab,
     get_next_run_time_from_crontab,
@@ -36,61 +45,56 @@ from .scheduling.periodic_task_helper import (
 # of which defines celery tasks.
 
 
-def get_nudgie_task(task_name: str, user_id: str, due_date: datetime) -> NudgieTask:
-    """Queries DB for a single NudgieTask object."""
-    filtered_tasks = NudgieTask.objects.filter(
-        task__name=task_name, user_id=user_id, due_date=due_date
-    )
-
-    assert len(filtered_tasks) == 1, f"expected 1 task, got {len(filtered_tasks)}"
-
-    return filtered_tasks[0]
-
-
-def deactivate_nudge(periodic_task_id: int) -> None:
-    """Deactivates a nudge by deleting the periodic task associated with the nudge (because it's set
-    to one-off, this will happen automatically in production, so the explicit deactivation is just for
-    the test tool)
+def get_nudgie_task(task_data: TaskData) -> NudgieTask:
+    """
+    Fetches the job's NudgieTask by primary key. Jobs scheduled before their payload had the id
+    fall back to looking it up by task name, user and due date.
     """
-    PeriodicTask.objects.get(id=periodic_task_id).delete()
+    if task_data.nudgie_task_id is not None:
+        return NudgieTask.objects.get(id=task_data.nudgie_task_id)
+
+    return NudgieTask.objects.get(
+        task__name=task_data.task_name,
+        user_id=task_data.user_id,
+        due_date=datetime.fromisoformat(task_data.due_date),
+    )
 
 
 # shared_task is different from app.task in that it doesn't require a celery app to be defined.
 # this is so that it can be used in other apps. The thing is, reusable apps cannot depend
 # on the project itself. So you can't import the celery app from the project.
 @shared_task
-def handle_nudge(periodic_task_id) -> None:
+@event_handler
+def handle_nudge(event_id, task_data: TaskData) -> None:
     """
     A nudge must know the due date, task name, and related notes/info. It must not
     fire off if the task has already been completed, or if the due date was missed.
     """
-    task_data = get_periodic_task_data(periodic_task_id)
     print(f"handling nudge for task {task_data.task_name} due on {task_data.due_date}")
 
-    nudgie_task = get_nudgie_task(
-        task_data.task_name,
-        task_data.user_id,
-        datetime.fromisoformat(task_data.due_date),
-    )
+    nudgie_task = get_nudgie_task(task_data)
 
     # only trigger the nudge if the task hasn't already been completed.
     if not nudgie_task.completed:
         print("task incomplete, sending nudge")
-        generate_and_send_nudge(User.objects.get(id=task_data.user_id))
-
-    deactivate_nudge(periodic_task_id)
+        send_scheduled_message(
+            User.objects.get(id=task_data.user_id),
+            task_data,
+            ScheduledJob(scheduled_event_id=event_id),
+        )
 
 
 @shared_task
-def goal_end_handler(periodic_task_id) -> None:
+@event_handler
+def goal_end_handler(event_id, task_data: TaskData) -> None:
     """
     Calculates the performance data and sends a message to the user congratulating him and giving him
-    a breakdown of his performance on each task. Closes out the goal.
+    a breakdown of his performance on each task. Closes out the goal, cancelling its remaining jobs,
+    and opens its transcript for archival (see Nudgie/chat/archive.py).
     """
-    task_data = get_periodic_task_data(periodic_task_id)
     goal_name = task_data.goal_name
 
-    goal = Goal.objects.get(goal_name=goal_name)
+    goal = Goal.objects.get(goal_name=goal_name, user_id=task_data.user_id)
     tasks = Task.objects.filter(goal=goal)
 
     performance_data = ""
@@ -117,34 +121,31 @@ def goal_end_handler(periodic_task_id) -> None:
         User.objects.get(id=task_data.user_id), goal_name, aggregated_data
     )
 
+    goal.completed = True
+    goal.save(update_fields=["completed"])
+    cancel_goal_jobs(goal, except_event_id=event_id)
+    open_archive_manifest(goal)
+
 
 @shared_task
-def deadline_handler(periodic_task_id) -> None:
+@event_handler
+def deadline_handler(event_id, task_data: TaskData) -> None:
     """
     When a deadline is reached, if the task has not yet been completed, the user will be notified of his failure to complete the task on time.
     """
-    task_data = get_periodic_task_data(periodic_task_id)
     print(
         f"handling deadline for task {task_data.task_name} due on {task_data.due_date}"
     )
 
-    nudgie_task = get_nudgie_task(
-        task_data.task_name,
-        task_data.user_id,
-        datetime.fromisoformat(task_data.due_date),
-    )
+    nudgie_task = get_nudgie_task(task_data)
 
     if not nudgie_task.completed:
         print("task incomplete, sending deadline notification")
         generate_and_send_deadline(task_data)
         # TODO: log datapoint or otherwise make it visible in the UI that the user missed the deadline
 
-    # Deactivate the task. Only necessary when manually triggering for testing, in production
-    # the one-off switch should take care of this.
-    PeriodicTask.objects.get(id=periodic_task_id).delete()
 
-
-def generate_nudges(user: User, task_data: TaskData) -> None:
+def generate_nudges(user: User, task_data: TaskData, nudgie_task: NudgieTask) -> None:
     """Generate nudges for a reminder. The number of nudges is determined by the
     time between the due date and the current time, with a bit of cushion added to the end.
     """
@@ -168,7 +169,7 @@ def generate_nudges(user: User, task_data: TaskData) -> None:
         print(f"Scheduling nudge {i+1} at {next_nudge_time}")
         task_data = task_data._replace(next_run_time=next_nudge_time.isoformat())
 
-        schedule_nudge(task_data)
+        schedule_nudge(task_data, nudgie_task)
 
 
 def handle_due_date_update(
@@ -186,9 +187,13 @@ def handle_due_date_update(
         ).isoformat(),
     )
 
-    modify_periodic_task(periodic_task_id, task_data)
     # create a new NudgieTask for the next due date
-    create_nudgie_task(task_data._replace(due_date=new_due_date.isoformat()))
+    nudgie_task = create_nudgie_task(
+        task_data._replace(due_date=new_due_date.isoformat())
+    )
+    modify_periodic_task(
+        periodic_task_id, task_data._replace(nudgie_task_id=nudgie_task.id)
+    )
 
 
 @shared_task
@@ -202,16 +207,61 @@ def handle_reminder(periodic_task_id):
     )
 
     user = User.objects.get(id=task_data.user_id)
-    nudgie_task = get_nudgie_task(
-        task_data.task_name,
-        task_data.user_id,
-        datetime.fromisoformat(task_data.due_date),
-    )
+    nudgie_task = get_nudgie_task(task_data)
 
     # retrieve task data to use for triggering reminder (and for updating the due date)
     if not nudgie_task.completed:
         print("task incomplete, sending reminder")
-        generate_and_send_reminder(user, task_data)
-        generate_nudges(user, task_data)
+        send_scheduled_message(
+            user, task_data, ScheduledJob(periodic_task_id=periodic_task_id)
+        )
+        generate_nudges(user, task_data, nudgie_task)
 
     handle_due_date_update(task_data, user, periodic_task_id)
+
+
+@shared_task
+def pregenerate_messages() -> None:
+    """
+    Drafts the reminders and nudges which are about to fire, so that their jobs only have to save
+    them. Runs on the beat schedule in settings.py.
+    """
+    drafted = pregenerate_upcoming_messages()
+    if drafted:
+        print(f"pregenerated {drafted} messages")
+
+
+@shared_task
+def archive_conversation_history() -> None:
+    """
+    Moves the next few batches of finished goals' transcripts into the archive. Runs on the beat
+    schedule in settings.py.
+    """
+    archived = archive_conversations()
+    if archived:
+        print(f"archived {archived} lines of conversation")
+
+
+@shared_task
+def dispatch_scheduled_events() -> None:
+    """
+    Enqueues the handlers of the nudges, deadlines and goal ends which are due. Runs on the beat
+    schedule in settings.py.
+    """
+    dispatched = dispatch_due_events()
+    if dispatched:
+        print(f"dispatched {dispatched} scheduled events")
+
+
+@shared_task
+def collect_schedule_garbage() -> None:
+    """
+    Deletes the next few batches of fired one-off PeriodicTasks and orphaned crontabs. Runs on the
+    beat schedule in settings.py.
+    """
+    garbage = delete_schedule_garbage()
+    if any(garbage):
+        print(
+            f"deleted {garbage.periodic_tasks} fired one-off PeriodicTasks and"
+            f" {garbage.crontabs} orphaned crontabs"
+        )
@@ -0,0 +1,71 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from Nudgie.chat.chatgpt import get_pending_tasks
+from Nudgie.models import Goal, NudgieTask, Task
+
+OCCURRENCES_APART = timedelta(days=1)
+
+
+class GetPendingTasksTests(TestCase):
+    """get_pending_tasks is run on every 'I finished my task' message, so it has to stay one query."""
+
+    def create_tasks(self, task_names: int, occurrences: int) -> User:
+        user = User.objects.create_user(username=f"user_{task_names}_{occurrences}")
+        goal = Goal.objects.create(
+            user=user,
+            goal_name="get_in_shape",
+            goal_end_date=self.now + timedelta(days=30),
+        )
+        for i in range(task_names):
+            task = Task.objects.create(goal=goal, name=f"task_{i}")
+            NudgieTask.objects.bulk_create(
+                NudgieTask(
+                    user=user,
+                    task=task,
+                    goal=goal,
+                    # the latest occurrences first, so that insertion order doesn't matter
+                    due_date=self.now + OCCURRENCES_APART * (occurrences - j - 0.5),
+                )
+                for j in range(occurrences)
+            )
+
+        return user
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def test_one_query_with_the_earliest_task_per_name(self):
+        # task names x occurrences per name
+        for task_names, occurrences in [(2, 1), (2, 5), (25, 4)]:
+            with self.subTest(task_names=task_names, occurrences=occurrences):
+                user = self.create_tasks(task_names, occurrences)
+
+                with self.assertNumQueries(1):
+                    tasks = get_pending_tasks(user, self.now)
+                    # everything identify_task reads from the tasks must already be loaded
+                    [(task.id, task.task.name, task.goal.goal_name) for task in tasks]
+
+                earliest = NudgieTask.objects.filter(
+                    user=user, due_date__lt=self.now + OCCURRENCES_APART
+                )
+                self.assertEqual(
+                    {task.id for task in tasks},
+                    set(earliest.values_list("id", flat=True)),
+                )
+                self.assertEqual(len(tasks), task_names)
+
+    def test_leaves_out_completed_and_past_tasks(self):
+        user = self.create_tasks(1, 3)
+        tasks = list(NudgieTask.objects.filter(user=user).order_by("due_date"))
+        NudgieTask.objects.filter(id=tasks[0].id).update(completed=True)
+        NudgieTask.objects.filter(id=tasks[1].id).update(
+            due_date=self.now - OCCURRENCES_APART
+        )
+
+        self.assertEqual(
+            [task.id for task in get_pending_tasks(user, self.now)], [tasks[2].id]
+        )
@@ -24,14 +24,43 @@ urlpatterns = [
     path("schedule/", views.schedule_task, name="schedule_task"),
     path("chatbot/", views.chatbot_view, name="chatbot"),
     path("chatbot/api/", views.chatbot_api, name="chatbot_api"),
+    path("chatbot/api/stream/", views.chatbot_stream_api, name="chatbot_stream_api"),
     path("clear_cache/", views.clear_cache, name="clear_cache"),
+    path("cache_stats/", views.cache_stats, name="cache_stats"),
+    path("llm_call_stats/", views.llm_call_stats, name="llm_call_stats"),
+    path(
+        "task_identification_stats/",
+        views.task_identification_stats,
+        name="task_identification_stats",
+    ),
+    path(
+        "openai_scheduler_stats/",
+        views.openai_scheduler_stats,
+        name="openai_scheduler_stats",
+    ),
     path("reset_user_data/", views.reset_user_data, name="reset_user_data"),
     path("get_task_list/", views.get_task_list_display, name="task_list"),
+    path("get_task_list_delta/", views.get_task_list_delta, name="task_list_delta"),
     path(
         "get_conversation_display/",
         views.get_conversation_display,
         name="conversation_display",
     ),
+    path(
+        "get_conversation_history/",
+        views.get_conversation_history,
+        name="conversation_history",
+    ),
+    path(
+        "get_conversation_delta/",
+        views.get_conversation_delta,
+        name="conversation_delta",
+    ),
+    path(
+        "conversation_events/",
+        views.conversation_events,
+        name="conversation_events",
+    ),
     path("trigger_task/", views.trigger_task, name="trigger_task"),
     path("accounts/", include("allauth.urls")),
 ]
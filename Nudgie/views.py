@@ -1,85 +1,246 @@
+import asyncio
 import json
 from datetime import datetime, timedelta
+from typing import AsyncIterator, Iterator, Optional
 
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user
 from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
 from django.forms import model_to_dict
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.http import (
+    HttpRequest,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils import timezone
 from django_celery_beat.models import CrontabSchedule, PeriodicTask
 
-from Nudgie.chat.dialogue import load_conversation
+from Nudgie.chat.dialogue import get_conversation_page, get_visible_lines
+from Nudgie.scheduling.crontabs import intern_crontab
+from Nudgie.scheduling.events import claim_event, get_event_task_data
 from Nudgie.scheduling.periodic_task_helper import get_periodic_task_data
+from Nudgie.scheduling.scheduler import cancel_user_jobs, get_user_periodic_tasks
+from Nudgie.scheduling.task_list import (
+    format_task_list_version,
+    get_task_list_last_change,
+    get_task_list_version,
+)
 from Nudgie.time_utils.time import get_next_run_time_from_crontab, get_time, set_time
 
-from .chat.chatgpt import handle_convo
+from .chat.chatgpt import ahandle_convo, get_conversation_context, handle_convo_stream
+from .chat.instrumentation import ROLLUP_FIELDS, get_latency_rollups
+from .chat.push import Subscription, push_hub
+from .chat.rate_limit import get_scheduler_metrics
+from .chat.response_cache import clear_response_cache, get_cache_stats
+from .chat.task_matching import get_task_identification_stats
 from .constants import (
-    CELERY_BACKEND_CLEANUP_TASK,
-    CHATBOT_CONVERSATION_FIELD,
     CHATBOT_TEMPLATE_NAME,
-    CHATBOT_TEMPLATE_SERVER_TIME_FIELD,
-    CHATBOT_TEMPLATE_TASKS_FIELD,
     CHATBOT_URL_PATH,
     CONVERSATION_FRAGMENT_CONVERSATION_FIELD,
+    CONVERSATION_FRAGMENT_OLDER_BEFORE_FIELD,
     CONVERSATION_FRAGMENT_TEMPLATE_NAME,
+    CONVERSATION_HISTORY_AFTER_PARAM,
+    CONVERSATION_HISTORY_BEFORE_PARAM,
     DIALOGUE_TYPE_DEADLINE,
     DIALOGUE_TYPE_GOAL_END,
     DIALOGUE_TYPE_NUDGE,
     DIALOGUE_TYPE_REMINDER,
     MESSAGE_FIELD,
-    PERIODIC_TASK_ID_FIELD,
     PERIODIC_TASK_NEXT_RUNTIME_FIELD,
-    PERIODIC_TASK_USER_ID,
     POST,
+    PUSH_HEARTBEAT_SECONDS,
     QUEUE_NAME,
     SEND_TYPE_ASSISTANT,
     SENDER_MESSAGE,
+    SSE_CONTENT_TYPE,
+    SSE_DONE_EVENT,
     TASKLIST_FRAGMENT_SERVER_TIME_FIELD,
     TASKLIST_FRAGMENT_TASKS_FIELD,
     TASKLIST_FRAGMENT_TEMPLATE_NAME,
+    TASKLIST_FRAGMENT_VERSION_FIELD,
+    TASKLIST_ITEM_KEY_FIELD,
+    TASKLIST_ITEM_TASK_FIELD,
+    TASKLIST_ITEM_TEMPLATE_NAME,
+    TASKLIST_PERIODIC_TASK_KEY_PREFIX,
+    TASKLIST_SCHEDULED_EVENT_KEY_PREFIX,
+    TASKLIST_VERSION_PARAM,
     TEST_FAST_FORWARD_SECONDS,
+    TRIGGER_TASK_KEY_FIELD,
     USER_INPUT_MESSAGE_FIELD,
     UTF_8,
 )
-from .models import CachedApiResponse, Conversation, Goal, MockedTime, NudgieTask
+from .models import (
+    Conversation,
+    ConversationArchiveManifest,
+    Goal,
+    MockedTime,
+    NudgieTask,
+    ScheduledEvent,
+)
 from .tasks import deadline_handler, goal_end_handler, handle_nudge, handle_reminder
 
 
+def get_scheduled_tasks(user: User):
+    """
+    The PeriodicTasks shown in the test tool: the user's own jobs, which leaves out the fixed beat
+    entries.
+    """
+    return get_user_periodic_tasks(user.id)
+
+
+def get_scheduled_events(user: User):
+    """The ScheduledEvents shown in the test tool, leaving out the ones which were given up on."""
+    return ScheduledEvent.objects.filter(user=user, failed_at__isnull=True)
+
+
+def get_next_run_time(kwargs: str) -> datetime:
+    return datetime.fromisoformat(json.loads(kwargs)[PERIODIC_TASK_NEXT_RUNTIME_FIELD])
+
+
+def get_periodic_task_item(task: PeriodicTask) -> dict:
+    return {
+        **model_to_dict(task),
+        TASKLIST_ITEM_KEY_FIELD: f"{TASKLIST_PERIODIC_TASK_KEY_PREFIX}{task.id}",
+    }
+
+
+def get_scheduled_event_item(event: ScheduledEvent) -> dict:
+    """A ScheduledEvent in the same shape as a PeriodicTask's item (it has no crontab)."""
+    return {
+        "id": event.id,
+        "kwargs": event.kwargs,
+        "crontab": None,
+        "task": event.handler,
+        TASKLIST_ITEM_KEY_FIELD: f"{TASKLIST_SCHEDULED_EVENT_KEY_PREFIX}{event.id}",
+    }
+
+
+def get_task_list_order(user: User) -> list[str]:
+    """The keys of all the task list items, in display order."""
+    rows = [
+        (f"{TASKLIST_PERIODIC_TASK_KEY_PREFIX}{id}", kwargs)
+        for id, kwargs in get_scheduled_tasks(user).values_list("id", "kwargs")
+    ] + [
+        (f"{TASKLIST_SCHEDULED_EVENT_KEY_PREFIX}{id}", kwargs)
+        for id, kwargs in get_scheduled_events(user).values_list("id", "kwargs")
+    ]
+    return [key for key, _ in sorted(rows, key=lambda row: get_next_run_time(row[1]))]
+
+
 def get_task_list_with_next_run(user: User):
-    """helper view for getting list of PeriodicTasks for the test tool"""
-    tasks = sorted(
-        PeriodicTask.objects.exclude(task=CELERY_BACKEND_CLEANUP_TASK),
-        key=lambda task: datetime.fromisoformat(
-            json.loads(task.kwargs)[PERIODIC_TASK_NEXT_RUNTIME_FIELD]
-        ),
-    )
+    """helper view for getting list of PeriodicTasks and ScheduledEvents for the test tool"""
+    items = [get_periodic_task_item(task) for task in get_scheduled_tasks(user)] + [
+        get_scheduled_event_item(event) for event in get_scheduled_events(user)
+    ]
 
-    return [{**model_to_dict(task)} for task in tasks]
+    return sorted(items, key=lambda item: get_next_run_time(item["kwargs"]))
 
 
-def chatbot_view(request):
-    """The main view for the chatbot - displays a chat window as well as some controls."""
-    convo = load_conversation(request.user)
+def get_task_list_context(user: User) -> dict:
+    return {
+        TASKLIST_FRAGMENT_TASKS_FIELD: get_task_list_with_next_run(user),
+        TASKLIST_FRAGMENT_SERVER_TIME_FIELD: get_time(user).isoformat(),
+        TASKLIST_FRAGMENT_VERSION_FIELD: get_task_list_version(user.id),
+    }
+
 
-    # for testing tool
-    tasks = get_task_list_with_next_run(request.user)
+def get_conversation_fragment_context(
+    user: User, before: Optional[int] = None, after: Optional[int] = None
+) -> dict:
+    """
+    Template context for a page of the conversation window. If there are older lines than the
+    page, the fragment marks where to load them from when the user scrolls up.
+    """
+    page = get_conversation_page(user, before=before, after=after)
+    older_before = None
+    if page.has_more and after is None:
+        older_before = page.lines[0]["id"]
 
+    return {
+        CONVERSATION_FRAGMENT_CONVERSATION_FIELD: page.lines,
+        CONVERSATION_FRAGMENT_OLDER_BEFORE_FIELD: older_before,
+    }
+
+
+def chatbot_view(request):
+    """The main view for the chatbot - displays a chat window as well as some controls."""
     return render(
         request,
         CHATBOT_TEMPLATE_NAME,
         {
-            CHATBOT_CONVERSATION_FIELD: convo,
-            CHATBOT_TEMPLATE_SERVER_TIME_FIELD: get_time(request.user).isoformat(),
-            CHATBOT_TEMPLATE_TASKS_FIELD: tasks,
+            **get_conversation_fragment_context(request.user),
+            # for testing tool
+            **get_task_list_context(request.user),
         },
     )
 
 
 def get_conversation_display(request):
-    """Contents of the conversation window (shows all of the things that have been said so far)"""
+    """Contents of the conversation window (the latest page of the conversation)"""
+    return render(
+        request,
+        CONVERSATION_FRAGMENT_TEMPLATE_NAME,
+        get_conversation_fragment_context(request.user),
+    )
+
+
+def get_conversation_history(request):
+    """
+    A page of the conversation window: the lines before the line id in ?before= (loaded lazily as
+    the user scrolls up), or the ones after the line id in ?after=.
+    """
+    try:
+        before, after = (
+            int(request.GET[param]) if param in request.GET else None
+            for param in (
+                CONVERSATION_HISTORY_BEFORE_PARAM,
+                CONVERSATION_HISTORY_AFTER_PARAM,
+            )
+        )
+    except ValueError:
+        return HttpResponseBadRequest("line ids must be integers")
+
     return render(
         request,
         CONVERSATION_FRAGMENT_TEMPLATE_NAME,
-        {CONVERSATION_FRAGMENT_CONVERSATION_FIELD: load_conversation(request.user)},
+        get_conversation_fragment_context(request.user, before=before, after=after),
+    )
+
+
+def get_conversation_delta(request):
+    """
+    The conversation lines after the line id in ?after= (the last line the browser has). If the
+    browser's cursor doesn't match the conversation anymore (the line is gone, or it's more than a
+    page behind), the latest page is sent instead, to replace the whole window.
+    """
+    try:
+        after = int(request.GET.get(CONVERSATION_HISTORY_AFTER_PARAM, 0))
+    except ValueError:
+        return HttpResponseBadRequest("line ids must be integers")
+
+    context = get_conversation_fragment_context(request.user, after=after)
+    cursor_gone = (
+        after and not get_visible_lines(request.user).filter(id=after).exists()
+    )
+    # the delta is more than a page, i.e. there are older lines than the ones in it
+    too_far_behind = context[CONVERSATION_FRAGMENT_OLDER_BEFORE_FIELD] is not None
+    full = bool(cursor_gone or too_far_behind)
+    if full:
+        context = get_conversation_fragment_context(request.user)
+
+    conversation = context[CONVERSATION_FRAGMENT_CONVERSATION_FIELD]
+    return JsonResponse(
+        {
+            "full": full,
+            "html": render_to_string(CONVERSATION_FRAGMENT_TEMPLATE_NAME, context),
+            "cursor": conversation[-1]["id"] if conversation else after,
+        }
     )
 
 
@@ -88,10 +249,60 @@ def get_task_list_display(request):
     return render(
         request,
         TASKLIST_FRAGMENT_TEMPLATE_NAME,
+        get_task_list_context(request.user),
+    )
+
+
+def get_task_list_delta(request):
+    """
+    The task list items which changed since the version in ?version=, along with the ids of all
+    the items in display order so that the browser can drop deleted ones and reorder the rest. If
+    the version isn't one this server handed out, the whole list is sent instead.
+    """
+    version = request.GET.get(TASKLIST_VERSION_PARAM, "")
+    last_change = get_task_list_last_change(request.user.id)
+    current_version = format_task_list_version(last_change)
+    delta = {
+        "version": current_version,
+        "server_time": get_time(request.user).isoformat(),
+    }
+    if version == current_version:
+        return JsonResponse({**delta, "full": False, "items": [], "order": None})
+
+    try:
+        since = datetime.fromisoformat(version)
+    except ValueError:
+        since = None
+    if since is None or last_change is None or since > last_change:
+        html = render_to_string(
+            TASKLIST_FRAGMENT_TEMPLATE_NAME, get_task_list_context(request.user)
+        )
+        return JsonResponse({**delta, "full": True, "html": html})
+
+    # the rows' own timestamps are taken just before the version's
+    changed_items = [
+        get_periodic_task_item(task)
+        for task in get_scheduled_tasks(request.user).filter(date_changed__gte=since)
+    ] + [
+        get_scheduled_event_item(event)
+        for event in get_scheduled_events(request.user).filter(created_at__gte=since)
+    ]
+    items = [
         {
-            TASKLIST_FRAGMENT_TASKS_FIELD: get_task_list_with_next_run(request.user),
-            TASKLIST_FRAGMENT_SERVER_TIME_FIELD: get_time(request.user).isoformat(),
-        },
+            "id": item[TASKLIST_ITEM_KEY_FIELD],
+            "html": render_to_string(
+                TASKLIST_ITEM_TEMPLATE_NAME, {TASKLIST_ITEM_TASK_FIELD: item}
+            ),
+        }
+        for item in changed_items
+    ]
+    return JsonResponse(
+        {
+            **delta,
+            "full": False,
+            "items": items,
+            "order": get_task_list_order(request.user),
+        }
     )
 
 
@@ -108,10 +319,18 @@ def trigger_task(request: HttpRequest) -> HttpResponse:
     """
     This is the API for triggering a task. It is for testing purposes only.
     """
-    task_id = json.loads(request.body.decode(UTF_8))[PERIODIC_TASK_ID_FIELD]
-    task_data = get_periodic_task_data(task_id)
+    task_key = json.loads(request.body.decode(UTF_8))[TRIGGER_TASK_KEY_FIELD]
+    if task_key.startswith(TASKLIST_SCHEDULED_EVENT_KEY_PREFIX):
+        task_id = int(task_key.removeprefix(TASKLIST_SCHEDULED_EVENT_KEY_PREFIX))
+        task_data = get_event_task_data(task_id)
+        # the dispatcher mustn't fire it as well once the clock is fast forwarded
+        if task_data is None or not claim_event(task_id):
+            print(f"scheduled event {task_id} has already been dispatched")
+            return HttpResponse(status=204)
+    else:
+        task_id = int(task_key.removeprefix(TASKLIST_PERIODIC_TASK_KEY_PREFIX))
+        task_data = get_periodic_task_data(task_id)
 
-    crontab = task_data.crontab
     fast_forward(
         datetime.fromisoformat(task_data.next_run_time),
         request.user,
@@ -146,29 +365,121 @@ def trigger_task(request: HttpRequest) -> HttpResponse:
 
 
 # for the initial conversation flow
-def chatbot_api(request):
-    """Handles all of the chat messages sent by the user."""
+async def chatbot_api(request):
+    """
+    Handles all of the chat messages sent by the user. This view is async so that waiting on
+    OpenAI doesn't tie up a thread when running under ASGI.
+    """
     if request.method == POST:
         data = json.loads(request.body.decode(UTF_8))
         user_input = data.get(USER_INPUT_MESSAGE_FIELD)
 
-        bot_response = handle_convo(
-            user_input, load_conversation(request.user), request.user
-        )
+        # request.user is loaded lazily from the DB, which can't happen on the event loop
+        user = await sync_to_async(get_user)(request)
+        context = await sync_to_async(get_conversation_context)(user)
+
+        bot_response = await ahandle_convo(user_input, context.messages, user)
 
         return JsonResponse(
             {SENDER_MESSAGE: SEND_TYPE_ASSISTANT, MESSAGE_FIELD: bot_response}
         )
 
 
+def chatbot_stream_api(request):
+    """
+    Streaming version of chatbot_api. Responds with server-sent events, one per piece of the
+    response as it is generated, followed by a 'done' event.
+    """
+    if request.method == POST:
+        data = json.loads(request.body.decode(UTF_8))
+        user_input = data.get(USER_INPUT_MESSAGE_FIELD)
+        user = request.user
+
+        def event_stream():
+            # flush the headers right away so the client knows the request went through
+            yield ": stream opened\n\n"
+            for text in handle_convo_stream(
+                user_input, get_conversation_context(user).messages, user
+            ):
+                yield f"data: {json.dumps({SENDER_MESSAGE: SEND_TYPE_ASSISTANT, MESSAGE_FIELD: text})}\n\n"
+            yield f"event: {SSE_DONE_EVENT}\ndata: {{}}\n\n"
+
+        # Django only streams async iterators under ASGI (it reads sync ones to the end before
+        # sending anything), and sync ones under WSGI (runserver)
+        if isinstance(request, ASGIRequest):
+            return get_event_stream_response(aiterate(event_stream()))
+        return get_event_stream_response(event_stream())
+
+
+async def aiterate(iterator: Iterator) -> AsyncIterator:
+    """
+    Iterates a sync iterator from async code, running each step (and closing it, if the caller
+    stops early) off the event loop, in the request's sync thread.
+    """
+    done = object()
+    try:
+        while (item := await sync_to_async(next)(iterator, done)) is not done:
+            yield item
+    finally:
+        await sync_to_async(iterator.close)()
+
+
+def get_event_stream_response(stream) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(stream, content_type=SSE_CONTENT_TYPE)
+    response["Cache-Control"] = "no-cache"
+    # stop proxies such as nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def conversation_events(request):
+    """
+    Server-sent events for the user's open chat window: each new conversation line as a 'line'
+    event (rendered like the conversation fragment), including the ones written by the Celery
+    workers, and a 'tasks' event whenever the task list changes. The stream starts after the line
+    id in ?after= and the task list version in ?version=.
+    """
+    try:
+        after = int(request.GET.get(CONVERSATION_HISTORY_AFTER_PARAM, 0))
+    except ValueError:
+        return HttpResponseBadRequest("line ids must be integers")
+    version = request.GET.get(TASKLIST_VERSION_PARAM, "")
+    user_id = request.user.id
+
+    def event_stream():
+        subscription = push_hub.subscribe(Subscription(user_id, after, version))
+        try:
+            yield ": stream opened\n\n"
+            while True:
+                event = subscription.get(timeout=PUSH_HEARTBEAT_SECONDS)
+                yield event.to_sse() if event else ": ping\n\n"
+        finally:
+            push_hub.unsubscribe(subscription)
+
+    async def aevent_stream():
+        subscription = push_hub.subscribe(
+            Subscription(user_id, after, version, asyncio.get_running_loop())
+        )
+        try:
+            yield ": stream opened\n\n"
+            while True:
+                event = await subscription.aget(timeout=PUSH_HEARTBEAT_SECONDS)
+                yield event.to_sse() if event else ": ping\n\n"
+        finally:
+            push_hub.unsubscribe(subscription)
+
+    # Django only streams async iterators under ASGI, and sync ones under WSGI (runserver)
+    if isinstance(request, ASGIRequest):
+        return get_event_stream_response(aevent_stream())
+    return get_event_stream_response(event_stream())
+
+
 def reset_user_data(request):
     """Resets all of the user's data, including conversations, nudgie tasks, and periodic tasks. For easier testing."""
     Conversation.objects.filter(user=request.user).delete()
+    ConversationArchiveManifest.objects.filter(user=request.user).delete()
     NudgieTask.objects.filter(user=request.user).delete()
-    # PeriodicTask.objects.filter(name__startswith=f"{request.user.id}").delete()
-    PeriodicTask.objects.filter(
-        kwargs__contains=f'"{PERIODIC_TASK_USER_ID}": {request.user.id}'
-    ).delete()
+    cancel_user_jobs(request.user.id)
     Goal.objects.filter(user=request.user).delete()
     CrontabSchedule.objects.exclude(periodictask__isnull=False).delete()
     MockedTime.objects.filter(user=request.user).delete()
@@ -178,11 +489,48 @@ def reset_user_data(request):
 
 def clear_cache(request):
     """Clears all of the cached API responses."""
-    CachedApiResponse.objects.all().delete()
+    clear_response_cache()
 
     return HttpResponseRedirect(CHATBOT_URL_PATH)
 
 
+def cache_stats(request):
+    """Reports the OpenAI response cache's hit/miss/eviction counters for this process."""
+    return JsonResponse(get_cache_stats())
+
+
+def openai_scheduler_stats(request):
+    """Reports the OpenAI call scheduler's queue depth, wait times and circuit state."""
+    return JsonResponse(get_scheduler_metrics())
+
+
+def task_identification_stats(request):
+    """Reports how often task identification was resolved locally vs by the LLM in this process."""
+    return JsonResponse(get_task_identification_stats())
+
+
+def llm_call_stats(request):
+    """
+    Reports OpenAI call latency percentiles, cache hit rate and token usage per dialogue type.
+    Pass ?by=day to group per day as well, and ?days=N to limit the window (default 7).
+    """
+    group_by = ["dialogue_type", *request.GET.getlist("by")]
+    if not set(group_by) <= set(ROLLUP_FIELDS):
+        return HttpResponseBadRequest(f"by must be one of {', '.join(ROLLUP_FIELDS)}")
+    try:
+        days = int(request.GET.get("days", 7))
+    except ValueError:
+        return HttpResponseBadRequest("days must be an integer")
+    if days < 1:
+        return HttpResponseBadRequest("days must be at least 1")
+
+    since = timezone.now().date() - timedelta(days=days - 1)
+    return JsonResponse(
+        {"rollups": get_latency_rollups(tuple(group_by), since)},
+        json_dumps_params={"default": str},
+    )
+
+
 # TODO: get rid of this soon, was just to test the celery beat integration.
 def schedule_task(request):
     message = ""
@@ -193,7 +541,7 @@ def schedule_task(request):
         # T stands for time, and it's the ISO 8601 standard for datetime formatting
         schedule_time = datetime.strptime(schedule_time_str, "%Y-%m-%dT%H:%M")
 
-        schedule, _ = CrontabSchedule.objects.get_or_create(
+        schedule = intern_crontab(
             minute=schedule_time.minute,
             hour=schedule_time.hour,
             day_of_week="*",